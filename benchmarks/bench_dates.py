@@ -0,0 +1,101 @@
+"""
+Microbenchmark for date range parsing
+
+Compares `whatson.dates.parse_date_range` (cold and memoised) against the
+`strptime` fallback chain the fetchers used previously, on a corpus of date
+strings in the formats found on the theatre listing pages.
+
+Usage: python benchmarks/bench_dates.py [-n NUMBER]
+"""
+
+import argparse
+import datetime
+import timeit
+
+from whatson.dates import DATE_REPLACER, parse_date_range, weekday_replacer
+
+CORPUS = [
+    ("1 january - 3 february 2020", None),
+    ("14 march 2020", None),
+    ("27th november - 11th january", 2019),
+    ("Sun 5 Jan - Sun 2 Feb 2020", 2020),
+    ("Fri 27 Mar & Sat 28 Mar", 2020),
+    ("16 - 19 January 2020", None),
+    ("31 January - 1 February 2020", None),
+    ("Tue 5th Nov - Sun 5th Jan 2020", 2020),
+    ("Thurs 16th - Sat 18th Jan", 2020),
+    ("Wed 8 Jan - Sat 11 Jan 2020", None),
+    ("Sat 18 Jan", 2020),
+]
+
+
+def legacy_parse(text, year):
+    """The exception-driven `strptime` chain previously used by the fetchers"""
+    text = weekday_replacer(DATE_REPLACER.sub(r"\1", text))
+
+    def parse_part(part, end_date=None):
+        for fmt in ("%a %d %b %Y", "%d %B %Y"):
+            try:
+                return datetime.datetime.strptime(part, fmt).date()
+            except ValueError as exc:
+                if "does not match format" not in str(exc):
+                    raise
+        fallback_year = end_date.year if end_date is not None else year
+        for fmt in ("%a %d %b %Y", "%d %B %Y"):
+            try:
+                return datetime.datetime.strptime(f"{part} {fallback_year}", fmt).date()
+            except ValueError as exc:
+                if "does not match format" not in str(exc):
+                    raise
+        for fmt in ("%a %d %m %Y", "%d %m %Y"):
+            try:
+                return datetime.datetime.strptime(
+                    f"{part} {end_date.month} {end_date.year}", fmt
+                ).date()
+            except (ValueError, AttributeError):
+                pass
+        raise ValueError(f"cannot parse {part}")
+
+    for separator in ("-", "&"):
+        if separator in text:
+            parts = [p.strip() for p in text.split(separator)]
+            end_date = parse_part(parts[1])
+            return parse_part(parts[0], end_date=end_date), end_date
+
+    start_date = parse_part(text)
+    return start_date, start_date
+
+
+def run_legacy():
+    for text, year in CORPUS:
+        legacy_parse(text, year)
+
+
+def run_uncached():
+    parse_date_range.cache_clear()
+    for text, year in CORPUS:
+        parse_date_range(text, year)
+
+
+def run_cached():
+    for text, year in CORPUS:
+        parse_date_range(text, year)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    for name, func in [
+        ("strptime chain", run_legacy),
+        ("regex, cold cache", run_uncached),
+        ("regex, warm cache", run_cached),
+    ]:
+        best = min(timeit.repeat(func, number=args.number, repeat=5))
+        per_call = best / (args.number * len(CORPUS)) * 1e6
+        print(f"{name:20s} {per_call:8.2f} us/date")
+
+
+if __name__ == "__main__":
+    main()
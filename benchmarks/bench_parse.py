@@ -0,0 +1,92 @@
+"""
+Benchmark for parsing listing pages in worker processes
+
+Parses the saved listing pages in `testing/responses` with each theatre's
+fetcher, first in this process and then spread over a pool of worker
+processes as `whatson-ingest --parse-workers N` does.
+
+Usage: python benchmarks/bench_parse.py [-r ROUNDS] [-w WORKERS ...]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+from whatson import ingest
+from whatson.pipeline import _parse_in_worker
+
+# The saved pages leave out the year in some dates, and were saved in 2020
+ingest.current_year = lambda: 2020
+
+RESPONSES = os.path.join(os.path.dirname(__file__), "..", "testing", "responses")
+
+FIXTURES = {
+    ingest.AlbanyFetcher: ["albany.html"],
+    ingest.BelgradeFetcher: ["belgrade.html"],
+    ingest.SymphonyHallFetcher: ["symphony_hall_1.html", "symphony_hall_2.html"],
+    ingest.HippodromeFetcher: ["hippodrome_1.html", "hippodrome_2.html"],
+    ingest.ResortsWorldFetcher: ["resortsworld.html"],
+    ingest.ArenaBirminghamFetcher: ["arena_birmingham.html"],
+    ingest.ArtrixFetcher: ["artrix_1.html", "artrix_2.html", "artrix_3.html"],
+    ingest.AlexFetcher: ["alex.html"],
+    ingest.WarwickArtsCentreFetcher: [
+        "arts_centre_1.html",
+        "arts_centre_2.html",
+        "arts_centre_3.html",
+    ],
+}
+
+
+def load_pages():
+    pages = []
+    for fetcher_cls, filenames in FIXTURES.items():
+        url = fetcher_cls().start_url()
+        for filename in filenames:
+            with open(os.path.join(RESPONSES, filename)) as infile:
+                pages.append((fetcher_cls, infile.read(), url, False))
+    return pages
+
+
+def run_serial(pages):
+    return sum(len(_parse_in_worker(*page).shows) for page in pages)
+
+
+def run_pool(executor, pages):
+    futures = [executor.submit(_parse_in_worker, *page) for page in pages]
+    return sum(len(future.result().shows) for future in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rounds", type=int, default=5)
+    parser.add_argument(
+        "-w", "--workers", type=int, nargs="+", default=[1, 2, os.cpu_count()]
+    )
+    args = parser.parse_args()
+
+    pages = load_pages() * args.rounds
+    total_bytes = sum(len(page[1]) for page in pages)
+    print(f"{len(pages)} pages, {total_bytes / 1e6:.1f} MB of HTML")
+
+    start = time.perf_counter()
+    shows = run_serial(pages)
+    elapsed = time.perf_counter() - start
+    print(f"in process      {elapsed:7.2f}s {len(pages) / elapsed:7.1f} pages/s")
+
+    for workers in args.workers:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Warm up the workers so process start up is not measured
+            run_pool(executor, pages[:workers])
+
+            start = time.perf_counter()
+            assert run_pool(executor, pages) == shows
+            elapsed = time.perf_counter() - start
+        print(
+            f"{workers:2d} processes    {elapsed:7.2f}s "
+            f"{len(pages) / elapsed:7.1f} pages/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
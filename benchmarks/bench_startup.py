@@ -0,0 +1,121 @@
+"""
+Startup benchmark for the ingest script
+
+Times importing `whatson.ingest` and running `whatson-ingest --help` in fresh
+interpreters, lists the slowest imports reported by `python -X importtime`,
+and checks that none of the heavy dependencies, which should only be
+imported once a fetcher needs them, are imported at startup.
+
+Usage: python benchmarks/bench_startup.py [-n NUMBER] [--top TOP]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Imported on first use by the fetchers, the database code or the profiler
+HEAVY_MODULES = [
+    "bs4",
+    "requests",
+    "psycopg2",
+    "selenium",
+    "PIL",
+    "cProfile",
+    "concurrent.futures.process",
+]
+
+TARGETS = [
+    ("import whatson.ingest", ["-c", "import whatson.ingest"]),
+    ("whatson-ingest --help", ["-c", "from whatson.ingest import main; main()", "-h"]),
+]
+
+
+def environment():
+    """The environment to run in, without a database, so a connection made at
+    import fails loudly rather than being timed"""
+    env = dict(os.environ)
+    env.pop("DATABASE_URL", None)
+    return env
+
+
+def time_command(args, number):
+    times = []
+    for _ in range(number):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            env=environment(),
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def slowest_imports(top):
+    """The `top` modules with the highest cumulative import time, in us"""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import whatson.ingest"],
+        env=environment(),
+        check=True,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    ).stderr
+
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def heavy_imports():
+    """The heavy modules imported by `import whatson.ingest`"""
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, whatson.ingest; print('\\n'.join(sys.modules))",
+        ],
+        env=environment(),
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    loaded = set(output.split())
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    baseline = time_command(["-c", "pass"], args.number)
+    print(f"{'interpreter':24s} {min(baseline) * 1e3:8.1f} ms")
+    for name, command in TARGETS:
+        times = time_command(command, args.number)
+        print(
+            f"{name:24s} {min(times) * 1e3:8.1f} ms "
+            f"(median {statistics.median(times) * 1e3:.1f} ms, "
+            f"{(min(times) - min(baseline)) * 1e3:.1f} ms over the interpreter)"
+        )
+
+    print("\nSlowest imports of whatson.ingest (cumulative):")
+    for cumulative, name in slowest_imports(args.top):
+        print(f"{cumulative / 1e3:8.1f} ms {name}")
+
+    heavy = heavy_imports()
+    if heavy:
+        print(f"\nHeavy modules imported at startup: {', '.join(heavy)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
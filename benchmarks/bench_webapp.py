@@ -0,0 +1,127 @@
+"""
+Load benchmark comparing the WSGI and ASGI apps
+
+Starts `whatson.wsgi:app` under gunicorn and `whatson.asgi:app` under uvicorn
+with the same number of workers, drives each with concurrent clients making
+a mix of `/api/months` and `/api/shows` requests, and reports requests per
+second with the median and p99 latency. Both servers use the database in
+`$DATABASE_URL`, which should already hold some shows.
+
+Usage: python benchmarks/bench_webapp.py [-c CONCURRENCY] [-d SECONDS] [-w WORKERS]
+"""
+
+import argparse
+import datetime
+import random
+import statistics
+import subprocess
+import threading
+import time
+
+import requests
+
+SERVERS = {
+    "wsgi": "gunicorn --workers {workers} --bind 127.0.0.1:{port} whatson.wsgi:app",
+    "asgi": "uvicorn --workers {workers} --port {port} --log-level warning "
+    "whatson.asgi:app",
+}
+
+
+def start_server(name, port, workers):
+    command = SERVERS[name].format(port=port, workers=workers).split()
+    process = subprocess.Popen(command)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url + "/api/months", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f"{name} server did not start")
+
+
+def make_request(session, url):
+    """Make one request from the mix the frontend makes: the months once, and
+    the shows for each month the user looks at"""
+    if random.random() < 0.2:
+        response = session.get(url + "/api/months")
+    else:
+        today = datetime.date.today()
+        month = random.randrange(12)
+        response = session.post(
+            url + "/api/shows",
+            json={
+                "year": today.year + (today.month + month - 1) // 12,
+                "month": (today.month + month - 1) % 12 + 1,
+            },
+        )
+    response.raise_for_status()
+
+
+def run_load(url, concurrency, duration):
+    """Make requests from `concurrency` threads for `duration` seconds,
+    returning the latency of each request and the number of errors"""
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                make_request(session, url)
+            except requests.RequestException:
+                errors.append(1)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, len(errors)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("-d", "--duration", type=float, default=20)
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5100)
+    args = parser.parse_args()
+
+    for offset, name in enumerate(SERVERS):
+        process, url = start_server(name, args.port + offset, args.workers)
+        try:
+            # Warm up the connection pools and caches
+            run_load(url, args.concurrency, 2)
+            latencies, errors = run_load(url, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+
+        if not latencies:
+            print(f"{name}: no successful requests ({errors} errors)")
+            continue
+
+        print(
+            f"{name}: {len(latencies) / args.duration:.1f} req/s, "
+            f"median {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms, {errors} errors"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Load test for the webapp against a seeded synthetic catalogue
+
+Optionally fills the database with a synthetic catalogue of theatres and
+shows, then drives each API endpoint in turn from a number of concurrent
+clients and reports the throughput, latency percentiles and database
+queries per request for each endpoint.
+
+By default the Flask app is driven in-process through its test client, with
+every query counted exactly. With `--url` a running server (WSGI or ASGI) is
+driven over HTTP instead, and the query count is estimated from the
+transactions Postgres reports for the database.
+
+The catalogue can instead be seeded with real listings with `--seed-from`,
+from a SQLite file written by `whatson-ingest --sink sqlite:PATH`.
+
+Seeding RESETS the target database, so point `--database-url` at a local
+database rather than a real one.
+
+Usage: python benchmarks/load_webapp.py --database-url URL
+           [--seed-shows N | --seed-from PATH] [-c CONCURRENCY] [-n REQUESTS]
+           [--url URL]
+"""
+
+import argparse
+import collections
+import datetime
+import os
+import random
+import sqlite3
+import statistics
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, execute_values
+import requests
+
+# (probability, shortest, longest) run lengths in days: one-off nights, week
+# long tours and long running shows
+RUN_LENGTHS = [(0.5, 0, 1), (0.3, 2, 8), (0.2, 21, 180)]
+
+ENDPOINTS = ["months", "shows"]
+
+
+def random_run_length(rng):
+    choice = rng.random()
+    for probability, shortest, longest in RUN_LENGTHS:
+        if choice < probability:
+            return rng.randint(shortest, longest)
+        choice -= probability
+    return 0
+
+
+def synthetic_shows(theatres, shows, seed=0):
+    """Generate `shows` shows spread over `theatres` theatres, starting between
+    two months ago and a year ahead"""
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    for i in range(shows):
+        start_date = today + datetime.timedelta(days=rng.randint(-60, 365))
+        end_date = start_date + datetime.timedelta(days=random_run_length(rng))
+        yield (
+            f"Theatre {i % theatres}",
+            f"Show {i}",
+            f"https://example.com/images/{i}.jpg",
+            f"https://example.com/shows/{i}",
+            start_date,
+            end_date,
+        )
+
+
+def sqlite_shows(path):
+    """Read the shows from a SQLite file written by the ingest SQLite sink"""
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            """SELECT theatre, title, image_url, link_url, start_date, end_date
+                FROM shows"""
+        ).fetchall()
+    finally:
+        conn.close()
+
+    for theatre, title, image_url, link_url, start_date, end_date in rows:
+        yield (
+            theatre,
+            title,
+            image_url,
+            link_url,
+            datetime.date.fromisoformat(start_date),
+            datetime.date.fromisoformat(end_date),
+        )
+
+
+def seed_database(conn, shows):
+    """Reset the database and fill it with the `(theatre, title, image_url,
+    link_url, start_date, end_date)` tuples of `shows`, returning how many"""
+    from whatson.db import reset_database  # pylint: disable=import-outside-toplevel
+
+    shows = list(shows)
+
+    reset_database(conn)
+    with conn:
+        cursor = conn.cursor()
+        execute_values(
+            cursor,
+            """INSERT INTO shows (theatre, title, image_url, link_url, start_date,
+                    end_date)
+                VALUES %s""",
+            shows,
+            page_size=1000,
+        )
+        cursor.execute("ANALYZE shows")
+    return len(shows)
+
+
+class QueryCounter:
+    """Counts the queries made while each endpoint is being driven"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.local = threading.local()
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.counts[getattr(self.local, "endpoint", None)] += 1
+
+    def connection_factory(self):
+        """A connection class whose cursors, whatever their type, count each
+        query they execute"""
+        counter = self
+        cursor_classes = {}
+
+        def counting(base):
+            if base not in cursor_classes:
+
+                class CountingCursor(base):
+                    def execute(self, query, vars=None):  # pylint: disable=W0622
+                        counter.count()
+                        return super().execute(query, vars)
+
+                cursor_classes[base] = CountingCursor
+            return cursor_classes[base]
+
+        class CountingConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, cursor_factory=None, **kwargs):
+                base = (
+                    cursor_factory or self.cursor_factory or psycopg2.extensions.cursor
+                )
+                return super().cursor(*args, cursor_factory=counting(base), **kwargs)
+
+        return CountingConnection
+
+
+def month_params(rng):
+    today = datetime.date.today()
+    month = today.month - 1 + rng.randint(-2, 12)
+    return {"year": today.year + month // 12, "month": month % 12 + 1}
+
+
+class InProcessClient:
+    """Drives the Flask app through its test client"""
+
+    def __init__(self, database_url, counter):
+        from whatson.webapp import create_app  # pylint: disable=import-outside-toplevel
+
+        self.counter = counter
+        self.conn = psycopg2.connect(
+            database_url,
+            connection_factory=counter.connection_factory(),
+            cursor_factory=RealDictCursor,
+        )
+        self.app = create_app(self.conn)
+        self.local = threading.local()
+
+    def request(self, endpoint, rng):
+        if not hasattr(self.local, "client"):
+            self.local.client = self.app.test_client()
+
+        self.counter.local.endpoint = endpoint
+        if endpoint == "months":
+            response = self.local.client.get("/api/months")
+        else:
+            response = self.local.client.post("/api/shows", json=month_params(rng))
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json())
+
+    def queries(self, endpoint):
+        return self.counter.counts[endpoint]
+
+
+class HttpClient:
+    """Drives a running server over HTTP"""
+
+    def __init__(self, database_url, url):
+        self.url = url.rstrip("/")
+        self.conn = psycopg2.connect(database_url)
+        self.conn.autocommit = True
+        self.local = threading.local()
+        self._start = {}
+
+    def request(self, endpoint, rng):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+
+        if endpoint == "months":
+            response = self.local.session.get(self.url + "/api/months")
+        else:
+            response = self.local.session.post(
+                self.url + "/api/shows", json=month_params(rng)
+            )
+        response.raise_for_status()
+
+    def _transactions(self):
+        # The statistics are only flushed periodically, so let them settle
+        time.sleep(1.0)
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT xact_commit + xact_rollback FROM pg_stat_database "
+            "WHERE datname = current_database()"
+        )
+        return cursor.fetchone()[0]
+
+    def begin(self, endpoint):
+        self._start[endpoint] = self._transactions()
+
+    def queries(self, endpoint):
+        # Discount the transaction which read the starting count
+        return self._transactions() - self._start[endpoint] - 1
+
+
+def drive(client, endpoint, concurrency, total):
+    """Make `total` requests to `endpoint` from `concurrency` threads,
+    returning the latencies, the errors and the elapsed time"""
+    remaining = iter(range(total))
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            try:
+                client.request(endpoint, rng)
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(endpoint, latencies, errors, elapsed, queries):
+    requests_made = len(latencies) + len(errors)
+    if not latencies:
+        print(f"{endpoint}: all {len(errors)} requests failed, e.g. {errors[0]!r}")
+        return
+
+    ms = [latency * 1000 for latency in latencies]
+    print(
+        f"{endpoint:>8}: {len(latencies) / elapsed:8.1f} req/s  "
+        f"p50 {statistics.median(ms):7.1f}ms  "
+        f"p90 {percentile(ms, 0.9):7.1f}ms  "
+        f"p99 {percentile(ms, 0.99):7.1f}ms  "
+        f"max {max(ms):7.1f}ms  "
+        f"{queries / requests_made:.2f} queries/req  "
+        f"{len(errors)} errors"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get("TEST_DATABASE_URL"),
+        help="Database to seed and query, defaulting to $TEST_DATABASE_URL",
+    )
+    parser.add_argument(
+        "--seed-shows",
+        type=int,
+        default=0,
+        help="Reset the database and seed it with this many shows",
+    )
+    parser.add_argument("--seed-theatres", type=int, default=50)
+    parser.add_argument(
+        "--seed-from",
+        metavar="PATH",
+        help="Reset the database and seed it with the shows in a SQLite file "
+        "written by `whatson-ingest --sink sqlite:PATH`",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument(
+        "-n", "--requests", type=int, default=2000, help="Requests per endpoint"
+    )
+    parser.add_argument(
+        "--url", help="Drive the server running at this url instead of the app"
+    )
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("no --database-url given and $TEST_DATABASE_URL is not set")
+
+    # The webapp connects to $DATABASE_URL when it is imported
+    os.environ["DATABASE_URL"] = args.database_url
+
+    if args.seed_shows or args.seed_from:
+        if args.seed_from:
+            shows = sqlite_shows(args.seed_from)
+        else:
+            shows = synthetic_shows(args.seed_theatres, args.seed_shows, args.seed)
+
+        start = time.perf_counter()
+        conn = psycopg2.connect(args.database_url, cursor_factory=RealDictCursor)
+        seeded = seed_database(conn, shows)
+        conn.close()
+        print(f"seeded {seeded} shows in {time.perf_counter() - start:.1f}s")
+
+    if args.url:
+        client = HttpClient(args.database_url, args.url)
+    else:
+        client = InProcessClient(args.database_url, QueryCounter())
+
+    for endpoint in ENDPOINTS:
+        if hasattr(client, "begin"):
+            client.begin(endpoint)
+        latencies, errors, elapsed = drive(
+            client, endpoint, args.concurrency, args.requests
+        )
+        report(endpoint, latencies, errors, elapsed, client.queries(endpoint))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ module Main exposing (..)
 import Array
 import Browser
 import Html exposing (Html, a, div, h1, img, label, option, p, select, span, text)
-import Html.Attributes exposing (class, for, href, id, src, value)
+import Html.Attributes exposing (class, for, href, id, selected, src, value)
 import Html.Events exposing (onInput)
 import Http
 import Json.Decode as D
@@ -121,14 +121,45 @@ compareDateElements a b =
             compare a.month b.month
 
 
-init : () -> ( Model, Cmd Msg )
-init _ =
-    ( initModel
-    , Http.get
-        { url = "/api/months"
-        , expect = Http.expectJson GotMonths monthsDecoder
-        }
-    )
+type alias InitialData =
+    { months : List DateElement
+    , selectedMonth : Maybe DateElement
+    , shows : Shows
+    }
+
+
+{-| The server embeds the months and the shows of the current month in the
+page, so they can be rendered straight away. If they are missing, fetch the
+months instead.
+-}
+init : D.Value -> ( Model, Cmd Msg )
+init flags =
+    case D.decodeValue initialDataDecoder flags of
+        Ok initial ->
+            ( { initModel
+                | availableMonths = List.sortWith compareDateElements initial.months
+                , selectedMonth = initial.selectedMonth
+                , shows = initial.shows
+                , theatres = theatresOf initial.shows
+              }
+            , Cmd.none
+            )
+
+        Err _ ->
+            ( initModel
+            , Http.get
+                { url = "/api/months"
+                , expect = Http.expectJson GotMonths monthsDecoder
+                }
+            )
+
+
+initialDataDecoder : D.Decoder InitialData
+initialDataDecoder =
+    D.map3 InitialData
+        (D.field "dates" (D.list decodeDateElement))
+        (D.field "selected" (D.nullable decodeDateElement))
+        showsDecoder
 
 
 monthsDecoder : D.Decoder (List DateElement)
@@ -184,12 +215,7 @@ update msg model =
         GotShows response ->
             case response of
                 Ok shows ->
-                    let
-                        theatres =
-                            List.map .theatre shows
-                                |> Set.fromList
-                    in
-                    ( { model | shows = shows, theatres = theatres }, Cmd.none )
+                    ( { model | shows = shows, theatres = theatresOf shows }, Cmd.none )
 
                 Err e ->
                     ( { model | error = Just <| httpErrorToString e }, Cmd.none )
@@ -218,6 +244,12 @@ update msg model =
             ( { model | filterTheatre = selectedTheatre }, Cmd.none )
 
 
+theatresOf : Shows -> Set String
+theatresOf shows =
+    List.map .theatre shows
+        |> Set.fromList
+
+
 bodyFromModel : Model -> E.Value
 bodyFromModel model =
     model.selectedMonth
@@ -415,7 +447,7 @@ modelSelect model =
     else
         let
             optionFromMonth i m =
-                option [ value <| String.fromInt i ] [ text <| monthIntToString m.month ++ " " ++ String.fromInt m.year ]
+                option [ value <| String.fromInt i, selected (model.selectedMonth == Just m) ] [ text <| monthIntToString m.month ++ " " ++ String.fromInt m.year ]
 
             initialValue =
                 option [ value "" ] [ text "-" ]
@@ -3,6 +3,10 @@
 import css from './main.css';
 var Elm = require("./elm/Main.elm").Elm;
 
+// The months and the first month's shows, embedded in the page by the server
+var initialData = document.getElementById("initial-data");
+
 var app = Elm.Main.init({
-  node: document.getElementById("container")
+  node: document.getElementById("container"),
+  flags: initialData ? JSON.parse(initialData.textContent) : null
 });
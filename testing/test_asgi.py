@@ -0,0 +1,139 @@
+import asyncio
+import datetime
+import pytest
+from unittest import mock
+
+pytest.importorskip("starlette")
+pytest.importorskip("asyncpg")
+
+from starlette.testclient import TestClient
+from whatson import asgi, webapp
+from whatson.asgi import ResponseCache
+from whatson.catalogue import ShowIndex
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_concurrent_misses_share_one_query():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "shows"
+
+    async def main():
+        cache = ResponseCache(ttl=60)
+        return await asyncio.gather(*[cache.get("key", compute) for _ in range(10)])
+
+    assert asyncio.run(main()) == ["shows"] * 10
+    assert len(calls) == 1
+
+
+def test_entries_expire():
+    clock = Clock()
+    cache = ResponseCache(ttl=60, clock=clock)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        first = await cache.get("key", compute)
+        clock.now = 30
+        cached = await cache.get("key", compute)
+        clock.now = 61
+        return first, cached, await cache.get("key", compute)
+
+    assert asyncio.run(main()) == (1, 1, 2)
+
+
+def test_failures_are_not_cached():
+    cache = ResponseCache(ttl=60)
+    results = iter([ValueError("database down"), "shows"])
+
+    async def compute():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def main():
+        with pytest.raises(ValueError):
+            await cache.get("key", compute)
+        return await cache.get("key", compute)
+
+    assert asyncio.run(main()) == "shows"
+
+
+def show(theatre, title, start, end):
+    start_date = datetime.date.fromisoformat(start)
+    return (theatre, title, "", None, "", start_date, datetime.date.fromisoformat(end))
+
+
+SHOWS = [
+    show("Rep", "Winter", "2020-01-20", "2020-02-08"),
+    show("Alex", "Panto", "2020-01-02", "2020-01-05"),
+    show("Rep", "Spring", "2020-03-01", "2020-03-07"),
+]
+
+
+class ShowsPool:
+    """Answers the shows query from `SHOWS` in place of Postgres"""
+
+    async def fetch(self, query, start_date, end_date, theatre):
+        assert query == asgi.SHOWS_QUERY
+        return sorted(
+            (
+                row
+                for row in SHOWS
+                if row[5] <= end_date
+                and row[6] >= start_date
+                and theatre in (None, row[0])
+            ),
+            key=lambda row: (row[5], row[6]),
+        )
+
+
+class FixedCatalogue:
+    def __init__(self, index):
+        self.index = index
+
+    def current(self):
+        return self.index
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"year": 2020, "month": 1},
+        {"year": "2020", "month": "3"},
+        {"start": "2020-01-04"},
+        {"start": "2020-01-06", "end": "2020-03-01"},
+        {"year": 2020, "month": 1, "theatre": "Rep"},
+        {"start": "2020-01-01", "end": "2020-12-31", "theatre": "Alex"},
+        {"start": "2020-01-01", "theatre": "Nowhere"},
+    ],
+)
+def test_both_apps_answer_shows_requests_alike(body):
+    flask_app = webapp.create_app(
+        mock.Mock(), catalogue=FixedCatalogue(ShowIndex(SHOWS))
+    )
+    with flask_app.test_client() as client:
+        expected = client.post("/api/shows", json=body).get_json()
+
+    app = asgi.create_app(database_url="postgresql://unused")
+    app.state.pool = ShowsPool()
+    # Not entered as a context manager, so the lifespan does not connect
+    response = TestClient(app).post("/api/shows", json=body)
+
+    assert expected["status"] == "ok"
+    assert response.status_code == 200
+    assert response.json() == expected
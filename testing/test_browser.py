@@ -0,0 +1,70 @@
+from whatson.browser import BrowserPool
+from selenium.common.exceptions import WebDriverException
+from unittest import mock
+import pytest
+
+
+def driver_factory(page_load_timeout):
+    driver = mock.Mock()
+    driver.page_source = "<html></html>"
+    return driver
+
+
+def test_browsers_are_reused():
+    factory = mock.Mock(side_effect=driver_factory)
+    pool = BrowserPool(size=2, driver_factory=factory)
+
+    for _ in range(3):
+        assert pool.fetch("http://example.com") == "<html></html>"
+
+    assert factory.call_count == 1
+
+
+def test_pool_size_is_respected():
+    factory = mock.Mock(side_effect=driver_factory)
+    pool = BrowserPool(size=2, driver_factory=factory)
+
+    with pool.checkout() as first:
+        with pool.checkout() as second:
+            assert first is not second
+
+    assert factory.call_count == 2
+
+
+def test_browsers_are_recycled():
+    factory = mock.Mock(side_effect=driver_factory)
+    pool = BrowserPool(size=1, max_pages=2, driver_factory=factory)
+
+    for _ in range(5):
+        pool.fetch("http://example.com")
+
+    assert factory.call_count == 3
+
+
+def test_broken_browsers_are_discarded():
+    factory = mock.Mock(side_effect=driver_factory)
+    pool = BrowserPool(size=1, driver_factory=factory)
+
+    with pytest.raises(WebDriverException):
+        with pool.checkout() as browser:
+            raise WebDriverException("crashed")
+
+    browser.driver.quit.assert_called_once()
+    pool.fetch("http://example.com")
+    assert factory.call_count == 2
+
+
+def test_close_quits_browsers():
+    pool = BrowserPool(size=2, driver_factory=driver_factory)
+
+    with pool.checkout() as first:
+        with pool.checkout() as second:
+            pass
+
+    pool.close()
+
+    first.driver.quit.assert_called_once()
+    second.driver.quit.assert_called_once()
+
+    with pytest.raises(RuntimeError):
+        pool.fetch("http://example.com")
@@ -0,0 +1,164 @@
+from whatson.catalogue import (
+    SHOWS_QUERY,
+    VERSION_QUERY,
+    Catalogue,
+    ShowIndex,
+    month_range,
+)
+from unittest import mock
+import datetime
+import pytest
+
+D = datetime.date
+
+
+def row(theatre, title, start_date, end_date, image_hash=None):
+    return (theatre, title, f"http://{title}.jpg", image_hash, "", start_date, end_date)
+
+
+ROWS = [
+    row("Alex", "Panto", D(2020, 12, 1), D(2021, 1, 10)),
+    row("Rep", "Hamlet", D(2021, 1, 5), D(2021, 1, 5), "abc"),
+    row("Alex", "Musical", D(2020, 6, 1), D(2021, 6, 1)),
+    row("Rep", "Play", D(2021, 2, 1), D(2021, 3, 1)),
+    row("Rep", "Old", D(2019, 1, 1), D(2019, 2, 1)),
+]
+
+
+def names(shows):
+    return [show["name"] for show in shows]
+
+
+def brute_force(rows, start_date, end_date):
+    rows = sorted(rows, key=lambda row: (row[5], row[6]))
+    return [r[1] for r in rows if r[5] <= end_date and r[6] >= start_date]
+
+
+def test_month_range():
+    assert month_range(2020, 2) == (D(2020, 2, 1), D(2020, 2, 29))
+    assert month_range(2020, 12) == (D(2020, 12, 1), D(2020, 12, 31))
+
+
+def test_shows_in_month_are_ordered_by_start():
+    index = ShowIndex(ROWS)
+
+    assert names(index.in_month(2021, 1)) == ["Musical", "Panto", "Hamlet"]
+    assert names(index.in_month(2021, 3)) == ["Musical", "Play"]
+    assert names(index.in_month(2018, 1)) == []
+    assert names(index.on(D(2021, 1, 6))) == ["Musical", "Panto"]
+
+
+def test_ranges_match_a_scan():
+    index = ShowIndex(ROWS)
+    day = D(2018, 12, 1)
+    while day < D(2021, 8, 1):
+        for days in (0, 1, 30, 400):
+            end = day + datetime.timedelta(days=days)
+            assert names(index.between(day, end)) == brute_force(ROWS, day, end)
+        day += datetime.timedelta(days=9)
+
+
+def test_theatre_sub_indexes():
+    index = ShowIndex(ROWS)
+
+    assert names(index.theatre("Rep").in_month(2021, 1)) == ["Hamlet"]
+    assert names(index.theatre("Alex").in_month(2021, 1)) == ["Musical", "Panto"]
+    assert len(index.theatre("Nowhere")) == 0
+
+
+def test_months_of_shows_still_running():
+    index = ShowIndex(ROWS)
+
+    months = index.months(D(2021, 1, 7))
+    assert months[0] == {"year": 2020, "month": 6}
+    assert months[-1] == {"year": 2021, "month": 6}
+    assert len(months) == 13
+    assert index.months(D(2021, 6, 1)) == []
+    assert ShowIndex([]).months(D(2021, 1, 1)) == []
+
+
+def test_images_and_productions():
+    productions = [(1, *ROWS[0]), (1, *ROWS[2]), (2, *ROWS[4])]
+    index = ShowIndex(ROWS, productions)
+
+    assert index.image_url("abc") == "http://Hamlet.jpg"
+    assert index.image_url("missing") is None
+    current = index.current_productions(D(2021, 1, 1))
+    assert [p["name"] for p in current] == ["Panto"]
+    assert names(current[0]["shows"]) == ["Panto", "Musical"]
+
+
+class FakeDB:
+    """Serves the dataset version, shows and productions queries"""
+
+    def __init__(self):
+        self.version = 1
+        self.rows = ROWS[:2]
+        self.queries = []
+        self.fail = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def cursor(self, cursor_factory=None):
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value = cursor
+
+        def execute(query):
+            if self.fail:
+                raise OSError("database down")
+            self.queries.append(query)
+            results = {VERSION_QUERY: [(self.version,)], SHOWS_QUERY: self.rows}
+            cursor.fetchall.return_value = results.get(query, [])
+            cursor.fetchone.return_value = results.get(query, [None])[0]
+
+        cursor.execute.side_effect = execute
+        return cursor
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_catalogue_reloads_when_the_version_changes():
+    db = FakeDB()
+    clock = Clock()
+    catalogue = Catalogue(db, check_interval=5, clock=clock)
+
+    first = catalogue.current()
+    assert len(first) == 2
+    assert catalogue.version == 1
+
+    # Not checked again until the interval has passed
+    db.version, db.rows = 2, ROWS
+    assert catalogue.current() is first
+    clock.now = 5
+    assert len(catalogue.current()) == len(ROWS)
+    assert catalogue.version == 2
+
+    # An unchanged version only checks the version
+    db.queries.clear()
+    clock.now = 10
+    catalogue.current()
+    assert db.queries == [VERSION_QUERY]
+
+
+def test_catalogue_serves_the_last_index_if_the_database_fails():
+    db = FakeDB()
+    clock = Clock()
+    catalogue = Catalogue(db, check_interval=5, clock=clock)
+    first = catalogue.current()
+
+    db.fail = True
+    clock.now = 5
+    assert catalogue.current() is first
+
+    with pytest.raises(OSError):
+        Catalogue(db).current()
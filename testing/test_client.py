@@ -0,0 +1,148 @@
+from whatson.client import CircuitBreaker, CircuitOpenError, HttpClient, TokenBucket
+from unittest import mock
+import io
+import pytest
+import requests
+
+
+def make_response(status_code, text="", headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = text.encode()
+    response.raw = io.BytesIO()
+    response.headers.update(headers or {})
+    return response
+
+
+@pytest.fixture
+def session():
+    return mock.Mock(headers={})
+
+
+@pytest.fixture
+def sleep():
+    return mock.Mock()
+
+
+def test_request_has_timeout(session, sleep):
+    session.get.return_value = make_response(200, "ok")
+    client = HttpClient("test", timeout=5, session=session, sleep=sleep)
+
+    assert client.get_text("http://example.com/") == "ok"
+    session.get.assert_called_once_with("http://example.com/", timeout=5)
+
+
+def test_transient_errors_are_retried(session, sleep):
+    session.get.side_effect = [
+        make_response(503),
+        requests.ConnectionError("reset"),
+        make_response(200, "ok"),
+    ]
+    client = HttpClient("test", retries=3, session=session, sleep=sleep)
+
+    assert client.get_text("http://example.com/") == "ok"
+    assert session.get.call_count == 3
+
+
+def test_retry_after_is_honoured(session, sleep):
+    session.get.side_effect = [
+        make_response(429, headers={"Retry-After": "7"}),
+        make_response(200, "ok"),
+    ]
+    client = HttpClient("test", rate=1000, session=session, sleep=sleep)
+
+    client.get("http://example.com/")
+    sleep.assert_called_with(7.0)
+
+
+def test_gives_up_after_retries(session, sleep):
+    session.get.return_value = make_response(503)
+    client = HttpClient("test", retries=2, session=session, sleep=sleep)
+
+    with pytest.raises(requests.HTTPError):
+        client.get("http://example.com/")
+
+    assert session.get.call_count == 3
+
+
+def test_client_errors_are_not_retried(session, sleep):
+    session.get.return_value = make_response(404)
+    client = HttpClient("test", session=session, sleep=sleep)
+
+    with pytest.raises(requests.HTTPError):
+        client.get("http://example.com/")
+
+    assert session.get.call_count == 1
+
+
+def test_circuit_opens_per_host(session, sleep):
+    session.get.return_value = make_response(500)
+    client = HttpClient(
+        "test", retries=0, failure_threshold=2, session=session, sleep=sleep
+    )
+
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.get("http://broken.example.com/")
+
+    with pytest.raises(CircuitOpenError):
+        client.get("http://broken.example.com/")
+    assert session.get.call_count == 2
+
+    session.get.return_value = make_response(200, "ok")
+    assert client.get_text("http://working.example.com/") == "ok"
+
+
+def test_circuit_half_opens_after_cooldown():
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=1, cooldown=10, clock=lambda: now[0])
+
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 11.0
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.allow()
+
+
+def test_token_bucket_limits_rate():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2, capacity=1, clock=lambda: now[0], sleep=sleep)
+    for _ in range(5):
+        bucket.acquire()
+
+    assert now[0] == pytest.approx(2.0)
+
+
+def test_streamed_bodies_are_read_in_chunks(session, sleep):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(b"abcdefg")
+    session.get.return_value = response
+    client = HttpClient("test", timeout=5, session=session, sleep=sleep)
+
+    with mock.patch.object(response, "close") as close:
+        chunks = client.get_chunks("http://example.com/", chunk_size=3)
+        assert list(chunks) == [b"abc", b"def", b"g"]
+
+    session.get.assert_called_once_with("http://example.com/", stream=True, timeout=5)
+    close.assert_called_once_with()
+
+
+def test_failed_responses_are_closed(session, sleep):
+    responses = [make_response(503), make_response(404)]
+    session.get.side_effect = responses
+    client = HttpClient("test", session=session, sleep=sleep)
+
+    with mock.patch.object(requests.Response, "close") as close:
+        with pytest.raises(requests.HTTPError):
+            client.get("http://example.com/", stream=True)
+
+    assert close.call_count == len(responses)
@@ -0,0 +1,67 @@
+from whatson.dates import parse_date_range
+import datetime
+import pytest
+
+
+def test_single_date():
+    start_date, end_date = parse_date_range("Sat 18th Jan 2020")
+
+    assert start_date == datetime.date(2020, 1, 18)
+    assert end_date == start_date
+
+
+def test_start_takes_year_from_end():
+    start_date, end_date = parse_date_range("1 january - 3 february 2020")
+
+    assert start_date == datetime.date(2020, 1, 1)
+    assert end_date == datetime.date(2020, 2, 3)
+
+
+def test_start_takes_month_from_end():
+    start_date, end_date = parse_date_range("16 - 19 January 2020")
+
+    assert start_date == datetime.date(2020, 1, 16)
+    assert end_date == datetime.date(2020, 1, 19)
+
+
+def test_start_in_previous_month():
+    start_date, end_date = parse_date_range("Fri 31 – Sun 2 Feb 2020")
+
+    assert start_date == datetime.date(2020, 1, 31)
+    assert end_date == datetime.date(2020, 2, 2)
+
+
+def test_default_year():
+    start_date, end_date = parse_date_range("Thurs 26 Mar & Sat 28 Mar", year=2020)
+
+    assert start_date == datetime.date(2020, 3, 26)
+    assert end_date == datetime.date(2020, 3, 28)
+
+
+def test_run_over_new_year():
+    start_date, end_date = parse_date_range("27th november - 11th january", year=2019)
+
+    assert start_date == datetime.date(2019, 11, 27)
+    assert end_date == datetime.date(2020, 1, 11)
+
+    start_date, end_date = parse_date_range("Tue 5th Nov - Sun 5th Jan 2020")
+
+    assert start_date == datetime.date(2019, 11, 5)
+    assert end_date == datetime.date(2020, 1, 5)
+
+
+def test_run_over_new_year_into_a_leap_day():
+    start_date, end_date = parse_date_range("1 dec - 29 feb", year=2023)
+
+    assert start_date == datetime.date(2023, 12, 1)
+    assert end_date == datetime.date(2024, 2, 29)
+
+
+def test_missing_year():
+    with pytest.raises(ValueError):
+        parse_date_range("Sat 18th Jan")
+
+
+def test_invalid_text():
+    with pytest.raises(ValueError):
+        parse_date_range("every weekend")
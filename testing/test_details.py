@@ -0,0 +1,103 @@
+from whatson.details import DetailCache, DetailFetcher, ShowDetails, parse_details
+from types import SimpleNamespace
+import json
+
+PAGE = """<html><head>
+<meta name="description" content="Not this one">
+<script type="application/ld+json">{}</script>
+</head><body></body></html>"""
+
+EVENTS = [
+    {
+        "@type": "TheaterEvent",
+        "name": "Cinderella",
+        "description": "A  traditional\n pantomime",
+        "startDate": "2020-01-10T19:00",
+        "offers": [
+            {"price": "15.00", "priceCurrency": "GBP"},
+            {"lowPrice": 10, "highPrice": "32.50", "priceCurrency": "GBP"},
+        ],
+    },
+    {"@type": "TheaterEvent", "startDate": "2020-01-09T19:00"},
+    {"@type": "Organization", "description": "The theatre"},
+]
+
+
+def test_details_are_read_from_json_ld():
+    details = parse_details(PAGE.format(json.dumps(EVENTS)))
+
+    assert details == ShowDetails(
+        description="A traditional pantomime",
+        performances=("2020-01-09T19:00", "2020-01-10T19:00"),
+        min_price=10.0,
+        max_price=32.5,
+        currency="GBP",
+    )
+
+
+def test_description_falls_back_to_meta_tags():
+    details = parse_details(PAGE.format("not json"))
+
+    assert details.description == "Not this one"
+    assert details.performances == ()
+    assert details.min_price is None
+
+
+class FakeClient:
+    """Serves a page which changes when `body` is set, honouring ETags"""
+
+    def __init__(self):
+        self.body = PAGE.format(json.dumps(EVENTS))
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        etag = str(hash(self.body))
+        if headers.get("If-None-Match") == etag:
+            return SimpleNamespace(status_code=304, content=b"", text="", headers={})
+        return SimpleNamespace(
+            status_code=200,
+            content=self.body.encode(),
+            text=self.body,
+            headers={"ETag": etag},
+        )
+
+
+def test_pages_are_only_fetched_when_new_or_changed(tmpdir):
+    now = [0]
+    client = FakeClient()
+    fetcher = DetailFetcher(
+        client, DetailCache(str(tmpdir)), max_age=100, clock=lambda: now[0]
+    )
+    url = "https://example.com/cinderella"
+
+    details, first_hash, changed = fetcher.fetch(url)
+    assert changed and details.currency == "GBP"
+
+    # Fresh pages are not requested again
+    assert fetcher.fetch(url)[1:] == (first_hash, False)
+    assert len(client.requests) == 1
+
+    # Old pages are revalidated, and only reported if they changed
+    now[0] = 200
+    assert fetcher.fetch(url)[1:] == (first_hash, False)
+    assert client.requests[-1] == {"If-None-Match": str(hash(client.body))}
+
+    client.body = PAGE.format("[]")
+    details, content_hash, changed = fetcher.fetch(url, force=True)
+    assert changed and content_hash != first_hash
+    assert details.description == "Not this one"
+
+
+def test_failed_pages_are_counted(tmpdir):
+    client = FakeClient()
+    fetcher = DetailFetcher(client, DetailCache(str(tmpdir)))
+    urls = {"https://example.com/a": False, "https://example.com/b": True}
+
+    fetched, failed = fetcher.fetch_all(urls)
+    assert sorted(url for url, *_ in fetched) == sorted(urls)
+    assert failed == 0
+
+    client.get = None
+    fetched, failed = fetcher.fetch_all({"https://example.com/c": False})
+    assert (fetched, failed) == ([], 1)
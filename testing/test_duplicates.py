@@ -0,0 +1,62 @@
+import datetime
+import random
+from whatson.duplicates import group_titles, normalise_title
+from whatson.shows import group_productions
+
+
+def test_normalise_title():
+    assert normalise_title("LES MISÉRABLES - The Musical") == "les miserables"
+    assert normalise_title("The Lion King") == "lion king"
+    assert normalise_title("Joseph & the Amazing Technicolor Dreamcoat") == (
+        "joseph and the amazing technicolor dreamcoat"
+    )
+    # A title which is entirely billing is left alone
+    assert normalise_title("The Musical") == "the musical"
+
+
+def test_grouping_titles():
+    titles = [
+        "Les Misérables",
+        "Hamlet",
+        "LES MISERABLES - The Musical",
+        "The Lion King",
+        "Hamilton",
+        "Priscilla Queen of the Desert",
+        "Lion King",
+        "Priscilla, Queen Of The Desert - The Musical",
+        "Swan Lake",
+        "Swan Lake Reloaded",
+    ]
+
+    groups = sorted(group_titles(titles))
+
+    assert groups == [[0, 2], [3, 6], [5, 7]]
+
+
+def test_grouping_many_titles():
+    rng = random.Random(0)
+    words = ["red", "blue", "night", "king", "queen", "dream", "lake", "magic"]
+    titles = [
+        " ".join(rng.choice(words) for _ in range(3)) + f" {i}" for i in range(2000)
+    ]
+    titles.append(titles[10].upper() + "!")
+
+    assert any({10, 2000} <= set(group) for group in group_titles(titles))
+
+
+def test_group_productions():
+    date = datetime.date(2020, 1, 1)
+    rows = [
+        (1, "Hippodrome", "Cats", "", None, "", date, date),
+        (1, "Alexandra", "CATS", "", None, "", date, date),
+        (5, "Albany", "Hamlet", "", None, "", date, date),
+        (5, "Belgrade", "Hamlet", "", None, "", date, date),
+    ]
+
+    productions = group_productions(rows)
+
+    assert [production["name"] for production in productions] == ["Cats", "Hamlet"]
+    assert [show["theatre"] for show in productions[0]["shows"]] == [
+        "Hippodrome",
+        "Alexandra",
+    ]
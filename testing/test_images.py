@@ -0,0 +1,94 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import os
+import threading
+import pytest
+
+pytest.importorskip("PIL")
+
+from PIL import Image
+from whatson.client import HttpClient
+from whatson.images import ImageCache, ImageError
+
+
+def make_image(width, height, colour="red", image_format="PNG"):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), colour).save(output, image_format)
+    return output.getvalue()
+
+
+@pytest.fixture(scope="module")
+def image_server():
+    """A stand in for a theatre's site, serving a large image"""
+    images = {"/poster.png": make_image(2000, 1000)}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = images.get(self.path)
+            self.send_response(200 if body else 404)
+            self.send_header("Content-Type", "image/png")
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ImageCache(str(tmpdir))
+
+
+def test_images_are_stored_as_thumbnails(image_server, cache):
+    client = HttpClient("test", rate=1000)
+    image_hash = cache.store(client.get(f"{image_server}/poster.png").content)
+
+    assert image_hash in cache
+    path, media_type = cache.lookup(image_hash, "image/webp,*/*")
+    assert media_type == "image/webp"
+    assert Image.open(path).size == (480, 240)
+
+    path, media_type = cache.lookup(image_hash, "*/*")
+    assert media_type == "image/jpeg"
+    assert path.endswith(".jpg")
+
+
+def test_images_are_content_addressed(cache):
+    first = cache.store(make_image(100, 100))
+    assert cache.store(make_image(100, 100)) == first
+    assert cache.store(make_image(100, 100, "blue")) != first
+
+
+def test_unknown_and_invalid_hashes_are_not_found(cache):
+    assert cache.lookup("0" * 64) is None
+    assert cache.lookup("../../etc/passwd") is None
+
+
+def test_bad_images_are_rejected(cache):
+    with pytest.raises(ImageError):
+        cache.store(b"<html>not an image</html>")
+
+
+def test_least_recently_used_images_are_evicted(cache):
+    colours = ["red", "green", "blue"]
+    hashes = [cache.store(make_image(200, 200, colour)) for colour in colours]
+    for age, image_hash in enumerate(reversed(hashes)):
+        for extension in ("webp", "jpg"):
+            mtime = 1000000 - age * 1000
+            os.utime(cache.path(image_hash, extension), (mtime, mtime))
+
+    # Using the oldest image keeps it in the cache
+    cache.touch(hashes[0])
+    cache.max_bytes = cache.total_size() - 1
+    cache.evict()
+
+    assert hashes[0] in cache
+    assert hashes[1] not in cache
+    assert hashes[2] in cache
+    assert cache.total_size() <= cache.max_bytes
@@ -1,4 +1,6 @@
+import pytest
 from whatson import ingest
+from whatson.pipeline import Pipeline
 from unittest import mock
 import datetime
 
@@ -12,8 +14,8 @@ def test_albany(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 29
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 1)
-    assert shows[-1]["title"] == "The Mersey Beatles 2020"
+    assert shows[0].start_date == datetime.date(2020, 1, 1)
+    assert shows[-1].title == "The Mersey Beatles 2020"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -25,13 +27,13 @@ def test_belgrade(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 66
-    assert shows[0]["start_date"] == datetime.date(2019, 11, 27)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 11)
-    assert shows[0]["title"] == "Puss In Boots"
+    assert shows[0].start_date == datetime.date(2019, 11, 27)
+    assert shows[0].end_date == datetime.date(2020, 1, 11)
+    assert shows[0].title == "Puss In Boots"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 11, 25)
-    assert shows[-1]["end_date"] == datetime.date(2021, 1, 9)
-    assert shows[-1]["title"] == "Beauty and the Beast"
+    assert shows[-1].start_date == datetime.date(2020, 11, 25)
+    assert shows[-1].end_date == datetime.date(2021, 1, 9)
+    assert shows[-1].title == "Beauty and the Beast"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -48,17 +50,19 @@ def test_symphony_hall(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 24
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 5)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 12)
-    assert shows[0]["title"] == "We're Going On A Bear Hunt"
+    assert shows[0].start_date == datetime.date(2020, 1, 5)
+    assert shows[0].end_date == datetime.date(2020, 1, 12)
+    assert shows[0].title == "We're Going On A Bear Hunt"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 1, 28)
-    assert shows[-1]["end_date"] == datetime.date(2020, 1, 28)
-    assert shows[-1]["title"] == "Echo Eternal Youth Arts Festival 2020: Horizons"
+    assert shows[-1].start_date == datetime.date(2020, 1, 28)
+    assert shows[-1].end_date == datetime.date(2020, 1, 28)
+    assert shows[-1].title == "Echo Eternal Youth Arts Festival 2020: Horizons"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
-def test_hippodrome(client):
+def test_hippodrome(client, monkeypatch):
+    # The pages leave out the year in some dates, and were saved in 2020
+    monkeypatch.setattr(ingest, "current_year", lambda: 2020)
     with open("testing/responses/hippodrome_1.html") as infile:
         resp1 = infile.read()
 
@@ -71,16 +75,33 @@ def test_hippodrome(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 32
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 5)
-    assert shows[0]["end_date"] == datetime.date(2020, 2, 2)
-    assert shows[0]["title"] == "Snow White & the Seven Dwarfs"
+    assert shows[0].start_date == datetime.date(2020, 1, 5)
+    assert shows[0].end_date == datetime.date(2020, 2, 2)
+    assert shows[0].title == "Snow White & the Seven Dwarfs"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 3, 27)
-    assert shows[-1]["end_date"] == datetime.date(2020, 3, 28)
-    assert shows[-1]["title"] == "DX - Mariposa"
+    assert shows[-1].start_date == datetime.date(2020, 3, 27)
+    assert shows[-1].end_date == datetime.date(2020, 3, 28)
+    assert shows[-1].title == "DX - Mariposa"
 
 
-@mock.patch("whatson.ingest._fetch_html_selenium")
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_hippodrome_skips_dates_missing_from_the_year(client, monkeypatch):
+    # "Tue 18 Feb - Sat 29 Feb" does not exist in 2021
+    monkeypatch.setattr(ingest, "current_year", lambda: 2021)
+    pages = []
+    for name in ("hippodrome_1.html", "hippodrome_2.html"):
+        with open(f"testing/responses/{name}") as infile:
+            pages.append(infile.read())
+    client.side_effect = pages
+
+    fetcher = ingest.HippodromeFetcher()
+    shows = list(fetcher.fetch())
+
+    assert len(shows) == 31
+    assert shows[-1].title == "DX - Mariposa"
+
+
+@mock.patch("whatson.ingest._stream_html_requests")
 def test_resortsworld(client):
     with open("testing/responses/resortsworld.html") as infile:
         client.return_value = infile.read()
@@ -89,20 +110,20 @@ def test_resortsworld(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 28
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 31)
-    assert shows[0]["end_date"] == datetime.date(2020, 2, 1)
-    assert shows[0]["title"] == "The Arenacross Tour 2020"
+    assert shows[0].start_date == datetime.date(2020, 1, 31)
+    assert shows[0].end_date == datetime.date(2020, 2, 1)
+    assert shows[0].title == "The Arenacross Tour 2020"
     assert (
-        shows[0]["image_url"]
+        shows[0].image_url
         == "https://d1t1vb5tk5g2b3.cloudfront.net/media/1655/arenacross-2020-arenas.jpg?anchor=center&mode=crop&width=537&height=294&rnd=132185532740000000&quality=60"
     )
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 11, 21)
-    assert shows[-1]["end_date"] == datetime.date(2020, 11, 21)
-    assert shows[-1]["title"] == "Free Radio Hits Live 2020"
+    assert shows[-1].start_date == datetime.date(2020, 11, 21)
+    assert shows[-1].end_date == datetime.date(2020, 11, 21)
+    assert shows[-1].title == "Free Radio Hits Live 2020"
 
 
-@mock.patch("whatson.ingest._fetch_html_selenium")
+@mock.patch("whatson.ingest._stream_html_requests")
 def test_arena_bham(client):
     with open("testing/responses/arena_birmingham.html") as infile:
         client.return_value = infile.read()
@@ -111,21 +132,53 @@ def test_arena_bham(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 61
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 16)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 19)
-    assert shows[0]["title"] == "Strictly Come Dancing The Live Tour 2020"
+    assert shows[0].start_date == datetime.date(2020, 1, 16)
+    assert shows[0].end_date == datetime.date(2020, 1, 19)
+    assert shows[0].title == "Strictly Come Dancing The Live Tour 2020"
     assert (
-        shows[0]["image_url"]
+        shows[0].image_url
         == "https://d38sswc4c2k2dz.cloudfront.net/media/1815/scd-lineup-arenas.jpg?anchor=center&mode=crop&width=537&height=294&rnd=132197819540000000&quality=60"
     )
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 12, 11)
-    assert shows[-1]["end_date"] == datetime.date(2020, 12, 11)
-    assert shows[-1]["title"] == "Il Divo"
+    assert shows[-1].start_date == datetime.date(2020, 12, 11)
+    assert shows[-1].end_date == datetime.date(2020, 12, 11)
+    assert shows[-1].title == "Il Divo"
+
+
+@mock.patch("whatson.ingest._stream_html_requests")
+def test_arena_bham_streamed_in_chunks(client):
+    with open("testing/responses/arena_birmingham.html", "rb") as infile:
+        page = infile.read()
+    client.return_value = (page[i : i + 4096] for i in range(0, len(page), 4096))
+
+    fetcher = ingest.ArenaBirminghamFetcher()
+    shows = list(fetcher.fetch())
+
+    assert len(shows) == 61
+    assert shows[0].title == "Strictly Come Dancing The Live Tour 2020"
+    assert shows[-1].title == "Il Divo"
+
+
+@mock.patch("whatson.ingest._fetch_html_selenium")
+@mock.patch("whatson.ingest._stream_html_requests")
+def test_arena_bham_selenium_fallback(client, selenium_client):
+    client.return_value = "<html><body>Please enable javascript</body></html>"
+    with open("testing/responses/arena_birmingham.html") as infile:
+        selenium_client.return_value = infile.read()
+
+    fetcher = ingest.ArenaBirminghamFetcher()
+    shows = list(fetcher.fetch())
+
+    assert selenium_client.call_count == 1
+    assert len(shows) == 61
+    assert shows[0].title == "Strictly Come Dancing The Live Tour 2020"
+    assert shows[-1].title == "Il Divo"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
-def test_artrix(client):
+def test_artrix(client, monkeypatch):
+    # The pages leave out the year in some dates, and were saved in 2020
+    monkeypatch.setattr(ingest, "current_year", lambda: 2020)
     with open("testing/responses/artrix_1.html") as infile:
         resp1 = infile.read()
 
@@ -141,13 +194,13 @@ def test_artrix(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 32
-    assert shows[0]["start_date"] == datetime.date(2019, 11, 5)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 5)
-    assert shows[0]["title"] == "KATHLEEN WATSON AND LYNNE SAWYER  - INSPIRE BY NATURE"
+    assert shows[0].start_date == datetime.date(2019, 11, 5)
+    assert shows[0].end_date == datetime.date(2020, 1, 5)
+    assert shows[0].title == "KATHLEEN WATSON AND LYNNE SAWYER - INSPIRE BY NATURE"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 1, 18)
-    assert shows[-1]["end_date"] == datetime.date(2020, 1, 18)
-    assert shows[-1]["title"] == "Polar Squad"
+    assert shows[-1].start_date == datetime.date(2020, 1, 18)
+    assert shows[-1].end_date == datetime.date(2020, 1, 18)
+    assert shows[-1].title == "Polar Squad"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -159,13 +212,41 @@ def test_alex(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 63
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 8)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 11)
-    assert shows[0]["title"] == "Ghost Stories"
+    assert shows[0].start_date == datetime.date(2020, 1, 8)
+    assert shows[0].end_date == datetime.date(2020, 1, 11)
+    assert shows[0].title == "Ghost Stories"
+
+    assert shows[-1].start_date == datetime.date(2020, 12, 8)
+    assert shows[-1].end_date == datetime.date(2021, 1, 2)
+    assert shows[-1].title == "Dreamgirls"
+
+
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_invalid_shows_are_skipped(client):
+    with open("testing/responses/alex.html") as infile:
+        html = infile.read()
+    # Break the first card's link, and swap the second card's image for a
+    # lazy loading placeholder
+    html = html.replace(
+        'href="/shows/ghost-stories/the-alexandra-theatre-birmingham/"',
+        'href="mailto:boxoffice@example.com"',
+    )
+    html = html.replace(
+        "https://res.cloudinary.com/dwzhqvxaz/w_288,f_auto,q_auto,fl_progressive/"
+        "v1548688824/Titles/Sing-a-Long-a/The%20Greatest%20Showman/"
+        "SingaLongaTheGreatestShowman_Title1_2000x800.jpg",
+        "data:image/gif;base64,R0lGODlhAQABAAAAACw=",
+    )
+    client.return_value = html
+
+    fetcher = ingest.AlexFetcher()
+    shows = list(fetcher.fetch())
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 12, 8)
-    assert shows[-1]["end_date"] == datetime.date(2021, 1, 2)
-    assert shows[-1]["title"] == "Dreamgirls"
+    assert len(shows) == 62
+    assert "Ghost Stories" not in [show.title for show in shows]
+    assert shows[0].image_url == ""
+    assert shows[1].image_url.startswith("https://res.cloudinary.com/")
+    assert shows[-1].title == "Dreamgirls"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -185,13 +266,86 @@ def test_arts_centre(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 20
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 9)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 12)
-    assert shows[0]["title"] == "Cinderella"
+    assert shows[0].start_date == datetime.date(2020, 1, 9)
+    assert shows[0].end_date == datetime.date(2020, 1, 12)
+    assert shows[0].title == "Cinderella"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 1, 26)
-    assert shows[-1]["end_date"] == datetime.date(2020, 1, 26)
+    assert shows[-1].start_date == datetime.date(2020, 1, 26)
+    assert shows[-1].end_date == datetime.date(2020, 1, 26)
     assert (
-        shows[-1]["title"]
+        shows[-1].title
         == "Warwick Masterclass 2020: Getting Creative with your Fancy Camera"
     )
+
+
+def run_pipeline(*fetcher_classes):
+    batches = []
+    pipeline = Pipeline(batches.append, venue_timeout=60)
+    results = pipeline.run(fetcher_classes)
+    return results, [show for batch in batches for show in batch]
+
+
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_pipeline_isolates_failures(client):
+    with open("testing/responses/albany.html") as infile:
+        albany = infile.read()
+
+    def fetch(url):
+        if "belgrade" in url:
+            return "<html><body>Under maintenance</body></html>"
+        return albany
+
+    client.side_effect = fetch
+
+    failed, succeeded = run_pipeline(ingest.BelgradeFetcher, ingest.AlbanyFetcher)[0]
+
+    assert not failed.succeeded
+    assert failed.theatre == "Belgrade"
+    assert failed.pages_fetched == 1
+    assert "AttributeError" in failed.errors[0]
+
+    assert succeeded.succeeded
+    assert succeeded.shows == 29
+
+
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_pipeline_deadline(client):
+    with open("testing/responses/symphony_hall_1.html") as infile:
+        client.return_value = infile.read()
+
+    pipeline = Pipeline(mock.Mock(), venue_timeout=-1)
+    (result,) = pipeline.run([ingest.SymphonyHallFetcher])
+
+    # The deadline has passed before the first page is fetched
+    assert not result.succeeded
+    assert "DeadlineExceeded" in result.errors[0]
+    assert result.pages_fetched == 0
+
+
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_pipeline_follows_pages(client):
+    pages = {}
+    for i in range(1, 4):
+        with open(f"testing/responses/arts_centre_{i}.html") as infile:
+            pages[f"start={(i - 1) * 10}"] = infile.read()
+
+    client.side_effect = lambda url: pages[url.split("?")[1]]
+
+    (result,), shows = run_pipeline(ingest.WarwickArtsCentreFetcher)
+
+    assert result.succeeded
+    assert result.shows == len(shows) == 20
+    assert result.pages_fetched == 3
+    assert shows[0] == ("Warwick Arts Centre", mock.ANY)
+    assert shows[0][1].title == "Cinderella"
+
+
+def test_selecting_venues():
+    assert ingest.select_fetchers(["symphony hall", "AlbanyFetcher"]) == [
+        ingest.SymphonyHallFetcher,
+        ingest.AlbanyFetcher,
+    ]
+    assert all(fetcher_cls.active for fetcher_cls in ingest.select_fetchers())
+
+    with pytest.raises(ValueError):
+        ingest.select_fetchers(["Nowhere"])
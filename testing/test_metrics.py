@@ -0,0 +1,52 @@
+import json
+from whatson.metrics import MetricsWriter, venue_metrics
+from whatson.pipeline import VenueResult
+
+
+def make_result(theatre="Hippodrome", errors=()):
+    return VenueResult(
+        theatre=theatre,
+        shows=12,
+        pages_fetched=3,
+        duration=4.5,
+        errors=list(errors),
+        bytes_downloaded=30000,
+        download_seconds=[0.2, 0.7, 45.0],
+        parse_seconds=0.3,
+    )
+
+
+def test_venue_metrics():
+    metrics = venue_metrics(7, make_result(), (2, 1, 4), timestamp=1000)
+
+    assert metrics["rows_added"] == 2
+    assert metrics["rows_changed"] == 1
+    assert metrics["rows_unchanged"] == 9
+    assert metrics["rows_removed"] == 4
+    assert metrics["succeeded"] == 1
+    assert metrics["download_seconds"]["buckets"][0.25] == 1
+    assert metrics["download_seconds"]["buckets"][1.0] == 1
+    assert metrics["download_seconds"]["count"] == 3
+
+
+def test_textfile_keeps_the_latest_run_of_each_venue(tmpdir):
+    textfile = tmpdir.join("whatson.prom")
+    jsonl = tmpdir.join("whatson.jsonl")
+    writer = MetricsWriter(str(textfile), str(jsonl))
+
+    writer.record(1, [make_result("Hippodrome"), make_result("Alex")], {})
+    writer.record(2, [make_result("Alex", errors=["ValueError: oops"])], {})
+
+    text = textfile.read()
+    assert 'whatson_ingest_succeeded{venue="Hippodrome"} 1' in text
+    assert 'whatson_ingest_succeeded{venue="Alex"} 0' in text
+    assert 'whatson_ingest_download_seconds_bucket{venue="Alex",le="5.0"} 2' in text
+    assert 'whatson_ingest_download_seconds_bucket{venue="Alex",le="+Inf"} 3' in text
+
+    lines = [json.loads(line) for line in jsonl.readlines()]
+    assert [(line["run_id"], line["venue"]) for line in lines] == [
+        (1, "Hippodrome"),
+        (1, "Alex"),
+        (2, "Alex"),
+    ]
+    assert lines[-1]["errors"] == ["ValueError: oops"]
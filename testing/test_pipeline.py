@@ -0,0 +1,242 @@
+from whatson.pipeline import Pipeline
+from whatson.profiling import Profiler
+from whatson.ingest import Page
+from whatson.shows import Show
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import threading
+import time
+
+TODAY = datetime.date.today()
+
+
+class FakeFetcher:
+    """Serves `pages` numbered pages of `per_page` shows each"""
+
+    name = "Fake"
+    rendered = False
+    pages = 3
+    per_page = 5
+
+    def __init__(self):
+        self.pages_fetched = 0
+        self.deadline = None
+
+    def start_url(self):
+        return 1
+
+    def check_deadline(self):
+        pass
+
+    def download(self, url, rendered=False):
+        self.pages_fetched += 1
+        return url
+
+    def parse(self, html, url, rendered=False):
+        shows = [{"title": f"{self.name} {url}.{i}"} for i in range(self.per_page)]
+        next_url = url + 1 if url < self.pages else None
+        return Page(shows, next_url=next_url)
+
+
+class OtherFetcher(FakeFetcher):
+    name = "Other"
+    pages = 2
+
+
+class BrokenFetcher(FakeFetcher):
+    name = "Broken"
+
+    def parse(self, html, url, rendered=False):
+        if url == 2:
+            raise ValueError("unexpected page layout")
+        return super().parse(html, url, rendered)
+
+
+def test_all_venues_are_written():
+    batches = []
+    pipeline = Pipeline(batches.append, fetch_workers=2, parse_workers=2)
+
+    results = pipeline.run([FakeFetcher, OtherFetcher])
+
+    assert [(r.theatre, r.shows, r.pages_fetched) for r in results] == [
+        ("Fake", 15, 3),
+        ("Other", 10, 2),
+    ]
+    written = [show for batch in batches for show in batch]
+    assert len(written) == 25
+    assert ("Other", {"title": "Other 2.4"}) in written
+    assert pipeline.stats["parse"].items == 5
+
+
+def test_batches_are_bounded():
+    batches = []
+    pipeline = Pipeline(batches.append, batch_size=4)
+
+    pipeline.run([FakeFetcher])
+
+    assert max(len(batch) for batch in batches) <= 4
+    assert sum(len(batch) for batch in batches) == 15
+
+
+def test_failing_venue_is_isolated():
+    batches = []
+    pipeline = Pipeline(batches.append)
+
+    broken, other = pipeline.run([BrokenFetcher, OtherFetcher])
+
+    assert not broken.succeeded
+    assert broken.shows == 5
+    assert "unexpected page layout" in broken.errors[0]
+    assert other.succeeded
+
+
+def test_write_errors_are_recorded():
+    def write_batch(batch):
+        raise RuntimeError("database went away")
+
+    (result,) = Pipeline(write_batch).run([OtherFetcher])
+
+    assert not result.succeeded
+    assert "database went away" in result.errors[0]
+
+
+def test_slow_writer_applies_backpressure():
+    release = threading.Event()
+
+    def write_batch(batch):
+        release.wait()
+
+    class ManyPagesFetcher(FakeFetcher):
+        pages = 50
+
+    pipeline = Pipeline(
+        write_batch, page_queue_size=2, show_queue_size=10, batch_size=1
+    )
+    thread = threading.Thread(target=pipeline.run, args=([ManyPagesFetcher],))
+    thread.start()
+
+    time.sleep(0.2)
+    # The writer is blocked, so only a few pages can have been parsed
+    assert pipeline.stats["parse"].items < 5
+
+    release.set()
+    thread.join()
+    assert pipeline.stats["parse"].items == 50
+
+
+def test_parsing_in_worker_processes():
+    batches = []
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        pipeline = Pipeline(batches.append, parse_workers=2, executor=executor)
+        results = pipeline.run([FakeFetcher, OtherFetcher])
+
+    assert [r.shows for r in results] == [15, 10]
+    assert sum(len(batch) for batch in batches) == 25
+
+
+class InterruptedFetcher(FakeFetcher):
+    """Streams a page whose download is cut off, and renders it instead"""
+
+    name = "Interrupted"
+
+    def download(self, url, rendered=False):
+        self.pages_fetched += 1
+        if rendered:
+            return url
+
+        def chunks():
+            yield b"<html>"
+            raise ConnectionError("connection reset")
+
+        return chunks()
+
+    def parse(self, html, url, rendered=False):
+        if rendered:
+            return super().parse(html, url, rendered)
+        try:
+            b"".join(html)
+        except ConnectionError:
+            return Page([], next_url=url, next_rendered=True)
+        raise AssertionError("the stream should have failed")
+
+
+def test_failed_streams_reach_the_fetcher_with_worker_processes():
+    batches = []
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        pipeline = Pipeline(batches.append, executor=executor)
+        (result,) = pipeline.run([InterruptedFetcher])
+
+    assert result.succeeded
+    assert result.shows == 15
+
+
+def test_profiling_writes_a_profile_per_venue(tmpdir):
+    profiler = Profiler(str(tmpdir), memory=True)
+    pipeline = Pipeline(lambda batch: None, profiler=profiler)
+
+    pipeline.run([FakeFetcher, OtherFetcher])
+    profiler.write()
+
+    written = {path.basename for path in tmpdir.listdir()}
+    assert {"fake.prof", "other.prof", "upload.prof", "summary.txt"} <= written
+    summary = tmpdir.join("summary.txt").read()
+    assert "== Fake:" in summary
+    assert "== upload:" in summary
+
+
+def test_profiled_blocks_of_a_section_take_turns(tmpdir):
+    profiler = Profiler(str(tmpdir))
+    running = []
+    most_running = []
+
+    def upload():
+        with profiler.profile("upload"):
+            running.append(1)
+            most_running.append(len(running))
+            time.sleep(0.02)
+            running.pop()
+
+    threads = [threading.Thread(target=upload) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert most_running == [1, 1, 1, 1]
+
+
+class ListingFetcher(FakeFetcher):
+    """Serves pages of `Show`s, with the shows on the first page new"""
+
+    name = "Listing"
+    pages = 6
+
+    def parse(self, html, url, rendered=False):
+        shows = [
+            Show(f"{'New' if url == 1 else 'Known'} {url}.{i}", "", "", TODAY, TODAY)
+            for i in range(self.per_page)
+        ]
+        next_url = url + 1 if url < self.pages else None
+        return Page(shows, next_url=next_url)
+
+
+def test_incremental_crawl_stops_after_known_pages():
+    known = {(f"Known {page}.{i}", TODAY) for page in range(2, 7) for i in range(5)}
+    pipeline = Pipeline(
+        lambda batch: None, known_shows={"Listing": known}, known_pages=2
+    )
+
+    (result,) = pipeline.run([ListingFetcher])
+
+    assert result.pages_fetched == 3
+    assert not result.complete
+    assert result.succeeded
+
+
+def test_venues_without_known_shows_are_fully_crawled():
+    pipeline = Pipeline(lambda batch: None, known_shows={}, known_pages=2)
+
+    (result,) = pipeline.run([ListingFetcher])
+
+    assert result.pages_fetched == 6
+    assert result.complete
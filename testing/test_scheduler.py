@@ -0,0 +1,60 @@
+from whatson.scheduler import Scheduler
+import collections
+import threading
+import time
+
+
+def run_for(scheduler, seconds):
+    stop = threading.Event()
+    thread = threading.Thread(target=scheduler.run, args=(stop,))
+    thread.start()
+    time.sleep(seconds)
+    stop.set()
+    thread.join()
+
+
+def test_jobs_run_on_their_own_interval():
+    runs = collections.Counter()
+    scheduler = Scheduler(lambda job: runs.update([job]), jitter=0)
+
+    scheduler.add("busy", 0.05)
+    scheduler.add("quiet", 10)
+    run_for(scheduler, 0.5)
+
+    assert runs["busy"] >= 4
+    assert runs["quiet"] == 1
+
+
+def test_concurrent_jobs_are_capped():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def run_job(job):
+        with lock:
+            running.append(job)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(job)
+
+    scheduler = Scheduler(run_job, max_jobs=2, jitter=0)
+    for job in range(5):
+        scheduler.add(job, 0.01)
+    run_for(scheduler, 0.5)
+
+    assert max(peak) == 2
+
+
+def test_failing_jobs_are_rescheduled():
+    runs = []
+
+    def run_job(job):
+        runs.append(job)
+        raise RuntimeError("venue is down")
+
+    scheduler = Scheduler(run_job, jitter=0)
+    scheduler.add("broken", 0.05)
+    run_for(scheduler, 0.3)
+
+    assert len(runs) >= 2
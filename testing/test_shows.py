@@ -0,0 +1,51 @@
+from whatson.shows import InvalidShow, Show
+import datetime
+import pytest
+
+
+def test_creating_a_show():
+    show = Show.create(
+        "  Puss   In Boots\n",
+        "/images/puss.jpg",
+        "whats-on/puss-in-boots",
+        datetime.datetime(2019, 11, 27, 19, 30),
+        base_url="http://www.belgrade.co.uk/",
+    )
+
+    assert show == (
+        "Puss In Boots",
+        "http://www.belgrade.co.uk/images/puss.jpg",
+        "http://www.belgrade.co.uk/whats-on/puss-in-boots",
+        datetime.date(2019, 11, 27),
+        datetime.date(2019, 11, 27),
+    )
+    assert show.to_json()["end_date"] == "2019-11-27"
+
+
+@pytest.mark.parametrize(
+    "title,link_url,end_date",
+    [
+        ("", "https://example.com/show", None),
+        ("Show", "/show", None),
+        ("Show", "https://example.com/show", datetime.date(2019, 12, 31)),
+    ],
+)
+def test_invalid_shows_are_rejected(title, link_url, end_date):
+    with pytest.raises(InvalidShow):
+        Show.create(title, "", link_url, datetime.date(2020, 1, 1), end_date)
+
+
+@pytest.mark.parametrize(
+    "image_url",
+    ["", "data:image/gif;base64,R0lGODlhAQABAAAAACw=", "javascript:void(0)"],
+)
+def test_unusable_images_are_dropped(image_url):
+    show = Show.create(
+        "Show",
+        image_url,
+        "/show",
+        datetime.date(2020, 1, 1),
+        base_url="https://example.com/",
+    )
+
+    assert show.image_url == ""
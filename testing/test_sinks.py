@@ -0,0 +1,82 @@
+from whatson.pipeline import VenueResult
+from whatson.shows import Show
+from whatson.sinks import JsonlSink, SqliteSink, create_sink
+import datetime
+import json
+import pytest
+
+TODAY = datetime.date.today()
+
+
+def make_show(title, days=0, link_url=None):
+    return Show.create(
+        title,
+        "",
+        link_url or f"https://example.com/{title}",
+        TODAY + datetime.timedelta(days=days),
+    )
+
+
+def run(sink, theatre, shows, remove=True):
+    run_id = sink.start_run()
+    sink.write_batch(run_id, [(theatre, show) for show in shows])
+    changes = sink.apply_changes(run_id, theatre, remove=remove)
+    result = VenueResult(theatre, len(shows), 1, 0.1, [])
+    sink.finish_run(run_id, [result], {theatre: changes})
+    return changes
+
+
+def test_sqlite_sink_tracks_changes(tmpdir):
+    sink = SqliteSink(str(tmpdir.join("shows.db")))
+    sink.prepare()
+
+    shows = [make_show("a"), make_show("b"), make_show("c")]
+    assert run(sink, "Albany", shows) == (3, 0, 0)
+
+    shows = [make_show("a"), make_show("b", link_url="https://example.com/new")]
+    assert run(sink, "Albany", shows) == (0, 1, 1)
+    # Nothing is removed when a venue fails, or finds nothing
+    assert run(sink, "Albany", [make_show("a")], remove=False) == (0, 0, 0)
+    assert run(sink, "Albany", []) == (0, 0, 0)
+    # Shows which have already ended are not added
+    assert run(sink, "Belgrade", [make_show("old", days=-2)]) == (0, 0, 0)
+
+    titles = sink.conn.execute("SELECT title FROM shows ORDER BY title").fetchall()
+    assert titles == [("a",), ("b",)]
+    (runs,) = sink.conn.execute("SELECT COUNT(*) FROM ingest_run_venues").fetchone()
+    assert runs == 5
+    sink.close()
+
+
+def test_jsonl_sink_streams_shows(tmpdir):
+    path = str(tmpdir.join("shows.jsonl"))
+    sink = JsonlSink(path)
+    sink.prepare()
+    assert run(sink, "Albany", [make_show("a"), make_show("b")]) is None
+    sink.close()
+
+    with open(path) as infile:
+        lines = [json.loads(line) for line in infile]
+    assert [line["title"] for line in lines] == ["a", "b"]
+    assert lines[0]["theatre"] == "Albany"
+    assert lines[0]["start_date"] == TODAY.isoformat()
+
+
+@pytest.mark.parametrize("spec", ["mysql", "sqlite", "postgres:somewhere"])
+def test_invalid_sinks_are_rejected(spec):
+    with pytest.raises(ValueError):
+        create_sink(spec)
+
+
+def test_sqlite_sink_knows_shows_after_a_full_crawl(tmpdir):
+    sink = SqliteSink(str(tmpdir.join("shows.db")))
+    sink.prepare()
+    an_hour_ago = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        hours=1
+    )
+    assert sink.known_shows("Albany", an_hour_ago) is None
+
+    run(sink, "Albany", [make_show("a")])
+    assert sink.known_shows("Albany", an_hour_ago) == {("a", TODAY)}
+    assert sink.known_shows("Belgrade", an_hour_ago) is None
+    sink.close()
@@ -0,0 +1,46 @@
+from whatson.streaming import iter_elements
+
+PAGE = b"""<html><head><title>Listings</title></head><body>
+<div class="filters"><input id="search" value=""></div>
+<ul>
+  <li class="event"><a href="/one">One</a></li>
+  <li class="event"><a href="/two">Two</a></li>
+  <li class="advert">Buy now</li>
+  <li class="event"><a href="/three">Three &amp; Four</a></li>
+</ul>
+<input id="all-events" value="{&quot;events&quot;: []}">
+</body></html>"""
+
+
+def in_chunks(data, size):
+    return (data[i : i + size] for i in range(0, len(data), size))
+
+
+def test_elements_are_found_across_chunks():
+    for size in (1, 7, len(PAGE)):
+        titles = [
+            element.findtext("a")
+            for element in iter_elements(
+                in_chunks(PAGE, size), "li", lambda e: e.get("class") == "event"
+            )
+        ]
+        assert titles == ["One", "Two", "Three & Four"]
+
+
+def test_attributes_are_unescaped():
+    element = next(
+        iter_elements(PAGE.decode(), "input", lambda e: e.get("id") == "all-events")
+    )
+    assert element.get("value") == '{"events": []}'
+
+
+def test_parsed_elements_are_discarded():
+    seen = []
+    for element in iter_elements(in_chunks(PAGE, 16), "li"):
+        seen.append(element.findtext("a"))
+        # Only the open ancestors, the current item and the emptied element
+        # before each of them are kept
+        assert all(len(e) == 0 for e in element.itersiblings(preceding=True))
+        assert len(list(element.getroottree().iter())) <= 8
+
+    assert seen == ["One", "Two", None, "Three & Four"]
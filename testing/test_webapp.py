@@ -1,13 +1,17 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring
 import pytest
+from whatson.catalogue import Catalogue, ShowIndex
+from whatson.db import archive_shows
 from whatson.webapp import create_app, interpolate_months
 import datetime
+import json
 from unittest import mock
 
 
 @pytest.fixture(scope="module")
 def client(connection):
-    app = create_app(connection)
+    # Check the dataset version on every request, so inserted shows are seen
+    app = create_app(connection, catalogue=Catalogue(connection, check_interval=0))
     with app.test_client() as client:
         yield client
 
@@ -78,3 +82,76 @@ def test_something():
         {"year": 2020, "month": 7},
         {"year": 2020, "month": 8},
     ]
+
+
+def test_getting_archived_shows(client, connection, cursor):
+    today = datetime.date.today()
+    start_date = datetime.date(today.year - 1, 1, 2)
+    end_date = datetime.date(today.year - 1, 2, 3)
+    cursor.execute(
+        """INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
+            VALUES (%s, %s, %s, %s, %s, %s)""",
+        ("test", "ended show", "", "", start_date, end_date),
+    )
+
+    assert archive_shows(connection) >= 1
+
+    rv = client.post("/api/shows", json={"year": today.year - 1, "month": 1})
+    assert rv.get_json()["shows"] == []
+
+    rv = client.post("/api/archive", json={"year": today.year - 1, "month": 1})
+    names = [show["name"] for show in rv.get_json()["shows"]]
+    assert "ended show" in names
+
+
+class FixedCatalogue:
+    def __init__(self, index):
+        self.index = index
+
+    def current(self):
+        return self.index
+
+
+def test_index_embeds_the_current_month():
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    next_year = today + datetime.timedelta(days=366)
+    rows = [
+        ("Rep", "Now", "http://now.jpg", None, "", today, tomorrow),
+        ("Rep", "Later", "http://later.jpg", None, "", next_year, next_year),
+    ]
+    catalogue = FixedCatalogue(ShowIndex(rows))
+    app = create_app(mock.Mock(), catalogue=catalogue)
+
+    with app.test_client() as client:
+        html = client.get("/").get_data(as_text=True)
+        # Rendered once per index and day
+        assert client.get("/").get_data(as_text=True) == html
+
+    start = html.index('type="application/json">') + len('type="application/json">')
+    initial = json.loads(html[start : html.index("</script>", start)])
+    assert initial["selected"] == {"year": today.year, "month": today.month}
+    assert initial["dates"][0] == initial["selected"]
+    assert [show["name"] for show in initial["shows"]] == ["Now"]
+
+    catalogue.index = ShowIndex([])
+    with app.test_client() as client:
+        html = client.get("/").get_data(as_text=True)
+    assert '"selected": null' in html
+
+
+def test_dataset_version_only_changes_with_the_shows(connection, cursor):
+    def version():
+        cursor.execute("SELECT version FROM dataset_version")
+        return cursor.fetchone()["version"]
+
+    before = version()
+    cursor.execute("DELETE FROM shows WHERE title = 'no such show'")
+    cursor.execute("UPDATE shows SET title = title")
+    assert version() == before
+
+    cursor.execute(
+        """INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
+            VALUES ('test', 'versioned show', '', '', CURRENT_DATE, CURRENT_DATE)"""
+    )
+    assert version() > before
@@ -0,0 +1,238 @@
+"""
+Whatson ASGI app
+
+An async alternative to `whatson.wsgi`, serving the same `/api/shows` and
+`/api/months` contract from a Starlette app backed by an `asyncpg`
+connection pool, so a slow query does not tie up a worker. Responses are
+cached for `CACHE_TTL` seconds: cache hits are answered without waiting on
+the database, and concurrent misses for the same key share a single query.
+
+Run with e.g. `uvicorn whatson.asgi:app`. This needs the `asgi` extra
+(`poetry install -E asgi`).
+"""
+
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, RedirectResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+
+from .images import CACHE_CONTROL, ImageCache
+from .shows import (
+    SHOW_COLUMNS,
+    group_productions,
+    interpolate_months,
+    serialise_show,
+    shows_request,
+)
+
+load_dotenv()
+
+LOG = logging.getLogger("whatson.asgi")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds a response is served from the cache before it is fetched again
+CACHE_TTL = 60
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 10
+
+# asyncpg prepares and caches each statement on its connection itself
+SHOWS_QUERY = f"""SELECT {", ".join(SHOW_COLUMNS)} FROM shows
+    WHERE start_date <= $2 AND end_date >= $1
+    AND ($3::text IS NULL OR theatre = $3)
+    ORDER BY start_date, end_date
+    """
+
+MONTHS_QUERY = """(SELECT
+        EXTRACT(MONTH FROM start_date)::int AS month,
+        EXTRACT(YEAR FROM start_date)::int AS year
+    FROM shows
+    WHERE end_date > CURRENT_DATE
+    )
+    UNION
+    (
+    SELECT
+        EXTRACT(MONTH FROM end_date)::int AS month,
+        EXTRACT(YEAR FROM end_date)::int AS year
+    FROM shows
+    WHERE end_date > CURRENT_DATE
+    )
+    ORDER BY year, month
+    """
+
+PRODUCTIONS_QUERY = f"""SELECT group_id, {", ".join(SHOW_COLUMNS)}
+    FROM show_groups
+    JOIN shows ON shows.id = show_groups.show_id
+    WHERE end_date >= CURRENT_DATE
+    ORDER BY group_id, start_date, theatre
+    """
+
+IMAGE_URL_QUERY = """SELECT image_url FROM shows WHERE image_hash = $1
+    UNION ALL
+    SELECT image_url FROM shows_archive WHERE image_hash = $1
+    LIMIT 1
+    """
+
+
+class ResponseCache:
+    """Caches the results of coroutines for `ttl` seconds.
+
+    A key being computed is stored as a future, so concurrent requests for it
+    wait on the one query in flight rather than each querying the database.
+    Failures are not cached.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = {}
+
+    async def get(self, key, compute):
+        """Return the cached value for `key`, calling `compute()` to create it
+        if it is missing or has expired"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > self.clock():
+            return await entry[1]
+
+        future = asyncio.get_event_loop().create_future()
+        self._entries[key] = (self.clock() + self.ttl, future)
+        try:
+            future.set_result(await compute())
+        except BaseException as exc:
+            if self._entries.get(key, (None, None))[1] is future:
+                del self._entries[key]
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+                # Mark the exception as retrieved in case nothing is waiting
+                future.exception()
+            raise
+
+        return future.result()
+
+    def clear(self):
+        self._entries.clear()
+
+
+def create_app(database_url=None, cache_ttl=CACHE_TTL, images=None):
+    cache = ResponseCache(cache_ttl)
+    if images is None:
+        images = ImageCache()
+    templates = Jinja2Templates(directory=os.path.join(HERE, "templates"))
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        app.state.pool = await asyncpg.create_pool(
+            database_url or os.environ["DATABASE_URL"],
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+        )
+        try:
+            yield
+        finally:
+            await app.state.pool.close()
+
+    def static_url(endpoint, filename):  # pylint: disable=unused-argument
+        """Stand in for Flask's `url_for` in the shared template"""
+        return f"/static/{filename}"
+
+    async def index(request):
+        return templates.TemplateResponse(
+            "index.html", {"request": request, "url_for": static_url}
+        )
+
+    def json_ok(**kwargs):
+        kwargs.pop("status", None)
+        return JSONResponse(dict(status="ok", **kwargs))
+
+    def json_error(exc):
+        return JSONResponse({"status": "error", "msg": str(exc)}, status_code=500)
+
+    async def get_by_month(request):
+        try:
+            args = shows_request(await request.json())
+
+            async def fetch():
+                rows = await request.app.state.pool.fetch(SHOWS_QUERY, *args)
+                return [serialise_show(row) for row in rows]
+
+            shows = await cache.get(("shows", *args), fetch)
+        except Exception as exc:  # pylint: disable=broad-except
+            return json_error(exc)
+
+        return json_ok(shows=shows)
+
+    async def get_months(request):
+        try:
+
+            async def fetch():
+                rows = await request.app.state.pool.fetch(MONTHS_QUERY)
+                return list(interpolate_months(rows)) if rows else []
+
+            dates = await cache.get(("months", datetime.date.today()), fetch)
+        except Exception as exc:  # pylint: disable=broad-except
+            return json_error(exc)
+
+        return json_ok(dates=dates)
+
+    async def get_productions(request):
+        try:
+
+            async def fetch():
+                rows = await request.app.state.pool.fetch(PRODUCTIONS_QUERY)
+                return group_productions(rows)
+
+            productions = await cache.get("productions", fetch)
+        except Exception as exc:  # pylint: disable=broad-except
+            return json_error(exc)
+
+        return json_ok(productions=productions)
+
+    async def get_image(request):
+        image_hash = request.path_params["image_hash"]
+        found = images.lookup(image_hash, request.headers.get("accept", ""))
+        if found is None:
+            # The image has not been fetched yet or has been evicted, so send
+            # the browser to the original
+            image_url = await request.app.state.pool.fetchval(
+                IMAGE_URL_QUERY, image_hash
+            )
+            if image_url is None:
+                return Response(status_code=404)
+            return RedirectResponse(image_url, status_code=302)
+
+        path, media_type = found
+        return FileResponse(
+            path,
+            media_type=media_type,
+            headers={"Cache-Control": CACHE_CONTROL, "Vary": "Accept"},
+        )
+
+    static = StaticFiles(directory=os.path.join(HERE, "static"), check_dir=False)
+    app = Starlette(
+        routes=[
+            Route("/", index),
+            Route("/api/shows", get_by_month, methods=["POST"]),
+            Route("/api/months", get_months, methods=["GET"]),
+            Route("/api/productions", get_productions, methods=["GET"]),
+            Route("/img/{image_hash}", get_image, methods=["GET"]),
+            Mount("/static", app=static, name="static"),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.cache = cache
+    return app
+
+
+app = create_app()
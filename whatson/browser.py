@@ -0,0 +1,169 @@
+"""
+Whatson browser pool
+
+A small pool of headless Chrome workers for the theatres whose listings are
+rendered with javascript. Workers are started lazily, checked out by one
+thread at a time, recycled after a number of pages to cap their memory use,
+and all shut down by `BrowserPool.close`.
+"""
+
+import contextlib
+import logging
+import queue
+import threading
+
+LOG = logging.getLogger("whatson.browser")
+
+# Requests for these are refused by the browser, as we only need the markup
+BLOCKED_URLS = ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"]
+
+
+def create_driver(page_load_timeout):
+    """Start a headless Chrome instance which does not load images or fonts"""
+    # Imported here so only the rendered venues pay for loading selenium
+    # pylint: disable=import-outside-toplevel
+    from selenium import webdriver
+    from selenium.common.exceptions import WebDriverException
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--no-sandbox")
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option(
+        "prefs", {"profile.managed_default_content_settings.images": 2}
+    )
+
+    driver = webdriver.Chrome(chrome_options=options)
+    driver.set_page_load_timeout(page_load_timeout)
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    except WebDriverException:
+        LOG.warning("cannot block font requests, continuing")
+    return driver
+
+
+class Browser:
+    """A single browser worker, tracking how many pages it has loaded"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+    def fetch(self, url):
+        """Load the url and return the rendered page source"""
+        self.pages += 1
+        self.driver.get(url)
+        return self.driver.page_source
+
+    def quit(self):
+        # pylint: disable=import-outside-toplevel
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            self.driver.quit()
+        except WebDriverException:
+            LOG.exception("error shutting down browser")
+
+
+class BrowserPool:
+    """Pool of up to `size` browsers, each replaced after `max_pages` pages"""
+
+    def __init__(
+        self, size=1, page_load_timeout=30, max_pages=50, driver_factory=create_driver
+    ):
+        self.size = size
+        self.page_load_timeout = page_load_timeout
+        self.max_pages = max_pages
+        self.driver_factory = driver_factory
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._browsers = set()
+        self._closed = False
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("browser pool is closed")
+
+                try:
+                    return self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+
+                if len(self._browsers) < self.size:
+                    # Reserve the slot before starting the (slow) browser
+                    browser = Browser(None)
+                    self._browsers.add(browser)
+                    break
+
+            # All browsers are busy so wait for one to be returned
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+        try:
+            browser.driver = self.driver_factory(self.page_load_timeout)
+        except:
+            with self._lock:
+                self._browsers.discard(browser)
+            raise
+
+        LOG.debug("started browser %d of %d", len(self._browsers), self.size)
+        return browser
+
+    def _discard(self, browser):
+        with self._lock:
+            self._browsers.discard(browser)
+        browser.quit()
+
+    def _release(self, browser):
+        with self._lock:
+            closed = self._closed
+
+        if closed or browser.pages >= self.max_pages:
+            LOG.debug("recycling browser after %d pages", browser.pages)
+            self._discard(browser)
+        else:
+            self._idle.put(browser)
+
+    @contextlib.contextmanager
+    def checkout(self):
+        """Check out a browser for exclusive use, returning it to the pool after"""
+        # pylint: disable=import-outside-toplevel
+        from selenium.common.exceptions import WebDriverException
+
+        browser = self._acquire()
+        try:
+            yield browser
+        except WebDriverException:
+            # The browser may be in a bad state, so do not reuse it
+            self._discard(browser)
+            raise
+        except:
+            self._release(browser)
+            raise
+        else:
+            self._release(browser)
+
+    def fetch(self, url):
+        """Render the url with the next free browser"""
+        with self.checkout() as browser:
+            return browser.fetch(url)
+
+    def close(self):
+        """Shut down all of the browsers. Browsers that are checked out are
+        shut down when they are returned."""
+        with self._lock:
+            self._closed = True
+
+        while True:
+            try:
+                browser = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(browser)
@@ -0,0 +1,223 @@
+"""
+Whatson catalogue
+
+An in-memory index of the shows currently listed, which the webapp answers
+its calendar queries from rather than querying Postgres on every request.
+
+The shows are held sorted by start date, with arrays of the start and end
+date ordinals and of the shows' positions in end date order, so the shows
+overlapping any range of dates are found with binary searches and a scan of
+the smaller side: the shows ending in or after the range, or those starting
+in it or at most the longest run before it. Each theatre has its own
+sub-index. The index is rebuilt whenever the `dataset_version` counter,
+bumped by every change to the shows, moves on, and the new index replaces the
+old one in a single assignment, so a request always sees one consistent
+snapshot.
+"""
+
+import array
+import bisect
+import datetime
+import logging
+import threading
+import time
+import psycopg2.extensions
+from .shows import (
+    SHOW_COLUMNS,
+    group_productions,
+    interpolate_months,
+    month_range,
+    serialise_show,
+)
+
+LOG = logging.getLogger("whatson.catalogue")
+
+# Seconds between checks of the dataset version
+CHECK_INTERVAL = 5
+
+VERSION_QUERY = "SELECT version FROM dataset_version"
+
+SHOWS_QUERY = f"""SELECT {", ".join(SHOW_COLUMNS)} FROM shows
+    ORDER BY start_date, end_date, theatre, title
+    """
+
+PRODUCTIONS_QUERY = f"""SELECT group_id, {", ".join(SHOW_COLUMNS)}
+    FROM show_groups
+    JOIN shows ON shows.id = show_groups.show_id
+    ORDER BY group_id, start_date, theatre
+    """
+
+THEATRE = SHOW_COLUMNS.index("theatre")
+IMAGE_URL = SHOW_COLUMNS.index("image_url")
+IMAGE_HASH = SHOW_COLUMNS.index("image_hash")
+START_DATE = SHOW_COLUMNS.index("start_date")
+END_DATE = SHOW_COLUMNS.index("end_date")
+
+
+class ShowIndex:
+    """An immutable interval index of rows of the `SHOW_COLUMNS`, returning
+    the shows in their API representation. `productions` are rows of a group
+    id followed by the `SHOW_COLUMNS`, ordered by group."""
+
+    def __init__(self, rows, productions=(), by_theatre=True):
+        rows = sorted(rows, key=lambda row: (row[START_DATE], row[END_DATE]))
+        self.shows = [serialise_show(row) for row in rows]
+
+        self.starts = array.array("l", (row[START_DATE].toordinal() for row in rows))
+        self.ends = array.array("l", (row[END_DATE].toordinal() for row in rows))
+        # Positions of the shows in end date order, and their end dates
+        self.by_end = array.array(
+            "l", sorted(range(len(rows)), key=self.ends.__getitem__)
+        )
+        self.sorted_ends = array.array("l", (self.ends[i] for i in self.by_end))
+        # No show starts earlier than this many days before any date it runs
+        self.longest = max(
+            (end - start for start, end in zip(self.starts, self.ends)), default=0
+        )
+        # The earliest start of the shows from each position in end date order
+        # onwards, for the months which have shows still to come
+        self.min_starts = array.array("l", (self.starts[i] for i in self.by_end))
+        for i in range(len(self.min_starts) - 2, -1, -1):
+            self.min_starts[i] = min(self.min_starts[i], self.min_starts[i + 1])
+
+        self.image_urls = {
+            row[IMAGE_HASH]: row[IMAGE_URL] for row in rows if row[IMAGE_HASH]
+        }
+        self.productions = list(productions)
+
+        self.theatres = {}
+        if by_theatre:
+            for theatre in sorted({row[THEATRE] for row in rows}):
+                self.theatres[theatre] = ShowIndex(
+                    [row for row in rows if row[THEATRE] == theatre], by_theatre=False
+                )
+
+    def __len__(self):
+        return len(self.shows)
+
+    def theatre(self, name):
+        """The sub-index of a theatre's shows"""
+        return self.theatres.get(name) or ShowIndex([], by_theatre=False)
+
+    def between(self, start_date, end_date):
+        """The shows running on any day from `start_date` to `end_date`
+        inclusive, ordered by start date"""
+        # Shows starting by the end of the range, and ending in or after it
+        first = start_date.toordinal()
+        started = bisect.bisect_right(self.starts, end_date.toordinal())
+        ending = bisect.bisect_left(self.sorted_ends, first)
+        earliest = bisect.bisect_left(self.starts, first - self.longest)
+
+        if started - earliest <= len(self.by_end) - ending:
+            positions = [i for i in range(earliest, started) if self.ends[i] >= first]
+        else:
+            positions = sorted(i for i in self.by_end[ending:] if i < started)
+        return [self.shows[i] for i in positions]
+
+    def on(self, day):
+        """The shows running on a day"""
+        return self.between(day, day)
+
+    def in_month(self, year, month):
+        """The shows running during a month"""
+        return self.between(*month_range(year, month))
+
+    def months(self, today):
+        """The months from the first month of the shows which have not ended by
+        `today` to the last month they run in"""
+        ending = bisect.bisect_right(self.sorted_ends, today.toordinal())
+        if ending == len(self.sorted_ends):
+            return []
+
+        first = datetime.date.fromordinal(self.min_starts[ending])
+        last = datetime.date.fromordinal(self.sorted_ends[-1])
+        return list(
+            interpolate_months(
+                [
+                    {"year": first.year, "month": first.month},
+                    {"year": last.year, "month": last.month},
+                ]
+            )
+        )
+
+    def current_productions(self, today):
+        """The productions at several theatres, of the shows not ended by
+        `today`"""
+        return group_productions(
+            [row for row in self.productions if row[1 + END_DATE] >= today]
+        )
+
+    def image_url(self, image_hash):
+        """The original url of the image of a show, or None"""
+        return self.image_urls.get(image_hash)
+
+
+class Catalogue:
+    """The `ShowIndex` of the shows in the database `db`, reloaded when the
+    dataset version changes. The version is checked at most once every
+    `check_interval` seconds, by one request while the others carry on with
+    the current index."""
+
+    def __init__(self, db, check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        self.db = db
+        self.check_interval = check_interval
+        self.clock = clock
+
+        self.version = None
+        self._index = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _due(self):
+        return (
+            self._checked_at is None
+            or self.clock() - self._checked_at >= self.check_interval
+        )
+
+    def current(self):
+        """The index of the current dataset"""
+        index = self._index
+        if index is not None and not self._due():
+            return index
+
+        # Only wait for a check in progress if there is no index to serve yet
+        if not self._lock.acquire(blocking=index is None):
+            return index
+        try:
+            if self._index is None or self._due():
+                self._refresh()
+            return self._index
+        except Exception:  # pylint: disable=broad-except
+            if self._index is None:
+                raise
+            LOG.exception(
+                "cannot check the dataset version, serving version %s", self.version
+            )
+            self._checked_at = self.clock()
+            return self._index
+        finally:
+            self._lock.release()
+
+    def _refresh(self):
+        with self.db as conn:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+                cursor.execute(VERSION_QUERY)
+                (version,) = cursor.fetchone()
+                if self._index is None or version != self.version:
+                    # The version is read first, so the shows are at least as
+                    # new as it, and a change in between is reloaded next time
+                    cursor.execute(SHOWS_QUERY)
+                    rows = cursor.fetchall()
+                    cursor.execute(PRODUCTIONS_QUERY)
+                    productions = cursor.fetchall()
+
+                    start = time.perf_counter()
+                    self._index = ShowIndex(rows, productions)
+                    self.version = version
+                    LOG.info(
+                        "indexed %d shows of dataset version %s in %.1fms",
+                        len(rows),
+                        version,
+                        (time.perf_counter() - start) * 1e3,
+                    )
+        self._checked_at = self.clock()
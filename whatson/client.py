@@ -0,0 +1,225 @@
+"""
+Whatson HTTP client
+
+Wraps a `requests.Session` with the politeness and resilience the scrapers
+need: a timeout on every request, retries with jittered exponential backoff
+for transient failures, a token bucket rate limit per host and a circuit
+breaker that stops hitting hosts which keep failing.
+"""
+
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+
+LOG = logging.getLogger("whatson.client")
+
+# Responses worth retrying, as the server may recover
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Bytes read at a time from streamed responses
+CHUNK_SIZE = 64 * 1024
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of making a request to a host whose circuit is open"""
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, with bursts of `capacity`"""
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            self.sleep(wait)
+
+
+class CircuitBreaker:
+    """Open after `threshold` consecutive failures, rejecting calls until
+    `cooldown` seconds have passed. A single trial call is then let through,
+    which closes the circuit again if it succeeds."""
+
+    def __init__(self, threshold=5, cooldown=300, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+
+        self.failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Return whether a call may be made"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            if self.clock() - self._opened_at >= self.cooldown:
+                # Half open: allow one trial call and restart the cooldown
+                self._opened_at = self.clock()
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self._opened_at = self.clock()
+
+
+class HttpClient:
+    """HTTP client with per-host rate limits, retries and circuit breakers"""
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(
+        self,
+        user_agent,
+        timeout=30,
+        retries=3,
+        backoff=1.0,
+        max_backoff=30.0,
+        rate=1.0,
+        burst=2,
+        failure_threshold=5,
+        cooldown=300,
+        session=None,
+        sleep=time.sleep,
+    ):
+        self.session = session if session is not None else requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.sleep = sleep
+
+        self._limiters = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, host):
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = TokenBucket(
+                    self.rate, self.burst, sleep=self.sleep
+                )
+            return self._limiters[host]
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    self.failure_threshold, self.cooldown
+                )
+            return self._breakers[host]
+
+    def _backoff_delay(self, attempt, response=None):
+        """Full jitter exponential backoff, honouring `Retry-After` if given"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def get(self, url, **kwargs):
+        """Make a GET request, retrying transient failures. Raises
+        `requests.RequestException` if the request ultimately fails."""
+        host = urlparse(url).netloc
+        breaker = self.breaker(host)
+        limiter = self.limiter(host)
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"too many failures from {host}, skipping")
+
+            limiter.acquire()
+
+            response = None
+            try:
+                response = self.session.get(url, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    breaker.record_success()
+                    return response
+                error = requests.HTTPError(
+                    f"{response.status_code} error for url {url}", response=response
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+            except requests.HTTPError:
+                # Client errors are not the host's fault, so do not count them
+                breaker.record_success()
+                response.close()
+                raise
+
+            breaker.record_failure()
+            if response is not None:
+                # Release a streamed response's connection back to the pool
+                response.close()
+            if attempt >= self.retries:
+                raise error
+
+            delay = self._backoff_delay(attempt, response)
+            LOG.info("retrying %s in %.1fs: %s", url, delay, error)
+            self.sleep(delay)
+            attempt += 1
+
+    def get_text(self, url, **kwargs):
+        return self.get(url, **kwargs).text
+
+    def get_chunks(self, url, chunk_size=CHUNK_SIZE, **kwargs):
+        """Make a GET request as `get`, but without reading the body, which is
+        returned as an iterator of chunks of bytes. Only the request itself is
+        retried; errors reading the body are raised by the iterator."""
+        response = self.get(url, stream=True, **kwargs)
+        return _iter_body(response, chunk_size)
+
+
+def _iter_body(response, chunk_size):
+    try:
+        yield from response.iter_content(chunk_size)
+    finally:
+        response.close()
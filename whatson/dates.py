@@ -0,0 +1,121 @@
+"""
+Whatson dates
+
+Shared parsing of the free-text date ranges found on theatre listing pages,
+e.g. "Tue 5th Nov - Sun 5th Jan 2020", "1 - 3 February 2020" or
+"Fri 27 Mar & Sat 28 Mar".
+
+Parsing is done with precompiled regular expressions rather than a chain of
+`strptime` attempts, and results are memoised as the same strings repeat
+across listing pages and nightly runs.
+"""
+
+import datetime
+import functools
+import re
+
+# Regex replacer to remove 1st/2nd/3rd/4th etc.
+DATE_REPLACER = re.compile(r"\b([0123]?[0-9])(st|th|nd|rd)\b")
+
+# Separators between the start and end of a date range
+RANGE_SEPARATOR = re.compile(r"\s*[-–&]\s*")
+
+# A single date, with optional weekday, month and year, e.g. "tue 5 nov 2019"
+SINGLE_DATE = re.compile(
+    r"""^
+    (?:[a-z]+\.?,?\s+)??          # optional weekday
+    (?P<day>[0-9]{1,2})
+    (?:\s+(?P<month>[a-z]+)\.?)?  # optional month name
+    (?:,?\s+(?P<year>[0-9]{4}))?  # optional year
+    $""",
+    re.IGNORECASE | re.VERBOSE,
+)
+
+MONTHS = {}
+for _number in range(1, 13):
+    _name = datetime.date(2000, _number, 1).strftime("%B").lower()
+    MONTHS[_name] = _number
+    MONTHS[_name[:3]] = _number
+MONTHS["sept"] = 9
+
+# Maximum number of distinct date strings to remember
+CACHE_SIZE = 4096
+
+
+def weekday_replacer(text):
+    """Replace Thurs -> Thu, Tues -> Tue"""
+    return text.replace("Thurs", "Thu").replace("Tues", "Tue")
+
+
+def _parse_part(text):
+    """Split a single date into its (day, month, year) components. The month
+    and year are `None` if they are not present in the text.
+    """
+    match = SINGLE_DATE.match(text)
+    if match is None:
+        raise ValueError(f"cannot parse date {text!r}")
+
+    month = match.group("month")
+    if month is not None:
+        try:
+            month = MONTHS[month.lower()]
+        except KeyError:
+            raise ValueError(f"unknown month in date {text!r}") from None
+
+    year = match.group("year")
+    if year is not None:
+        year = int(year)
+
+    return int(match.group("day")), month, year
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_date_range(text, year=None):
+    """Parse a date or date range into a `(start_date, end_date)` tuple.
+
+    Missing components of the start date are taken from the end date. If the
+    end date has no year then `year` is used, and if no year is available at
+    all a `ValueError` is raised. A single date gives `start_date == end_date`.
+    """
+    text = weekday_replacer(DATE_REPLACER.sub(r"\1", text.strip()))
+    parts = RANGE_SEPARATOR.split(text, maxsplit=1)
+
+    end_day, end_month, end_year = _parse_part(parts[-1])
+    if end_month is None:
+        raise ValueError(f"no month found in date {text!r}")
+
+    end_year_inferred = end_year is None
+    if end_year_inferred:
+        if year is None:
+            raise ValueError(f"no year found in date {text!r}")
+        end_year = year
+
+    if len(parts) == 1:
+        end_date = datetime.date(end_year, end_month, end_day)
+        return end_date, end_date
+
+    start_day, start_month, start_year = _parse_part(parts[0])
+    start_year_inferred = start_year is None
+    if start_year_inferred:
+        start_year = end_year
+    if start_month is None:
+        # e.g. "30 - 2 February" starts in the previous month
+        start_month = end_month
+        if start_day > end_day:
+            start_month -= 1
+            if start_month == 0:
+                start_month = 12
+                start_year -= 1
+
+    # Runs that cross the new year, e.g. "27 Dec - 4 Jan". This is decided
+    # before the dates are built, as e.g. "1 Dec - 29 Feb" is only a valid
+    # date in the following year.
+    if (start_year, start_month, start_day) > (end_year, end_month, end_day):
+        if end_year_inferred:
+            end_year += 1
+        elif start_year_inferred:
+            start_year -= 1
+
+    start_date = datetime.date(start_year, start_month, start_day)
+    end_date = datetime.date(end_year, end_month, end_day)
+    return start_date, end_date
@@ -4,10 +4,10 @@ Whatson db
 This module handles talking to Postgres via `psycopg2`.
 """
 
+import contextlib
 import logging
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,7 +16,295 @@ LOG = logging.getLogger("whatson.db")
 LOG.setLevel(logging.DEBUG)
 
 
-DB = psycopg2.connect(os.environ["DATABASE_URL"], cursor_factory=RealDictCursor)
+class LazyConnection:
+    """A connection to `$DATABASE_URL` which is opened when first used, so
+    importing whatson does not need (or wait for) the database. It can be used
+    as a context manager and otherwise behaves like the connection."""
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """The underlying connection, connecting if needed"""
+        with self._lock:
+            if self._conn is None:
+                # pylint: disable=import-outside-toplevel
+                import psycopg2
+                from psycopg2.extras import RealDictCursor
+
+                self._conn = psycopg2.connect(
+                    os.environ["DATABASE_URL"], cursor_factory=RealDictCursor
+                )
+            return self._conn
+
+    def __enter__(self):
+        return self.connection().__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.connection().__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self.connection(), name)
+
+
+DB = LazyConnection()
+
+# Connections for code writing from several threads at once, opened on demand
+POOL_SIZE = 4
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def pooled_connection():
+    """Borrow a connection from the pool for a single transaction, which is
+    committed if the block succeeds and rolled back otherwise"""
+    global _POOL  # pylint: disable=global-statement
+
+    with _POOL_LOCK:
+        if _POOL is None:
+            # pylint: disable=import-outside-toplevel
+            from psycopg2.extras import RealDictCursor
+            from psycopg2.pool import ThreadedConnectionPool
+
+            _POOL = ThreadedConnectionPool(
+                1, POOL_SIZE, os.environ["DATABASE_URL"], cursor_factory=RealDictCursor
+            )
+
+    conn = _POOL.getconn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        _POOL.putconn(conn)
+
+
+def execute_values(cursor, sql, argslist, **kwargs):
+    """`psycopg2.extras.execute_values`, importing `psycopg2` on first use"""
+    # pylint: disable=import-outside-toplevel
+    from psycopg2.extras import execute_values as _execute_values
+
+    return _execute_values(cursor, sql, argslist, **kwargs)
+
+
+def ensure_schema(db):
+    """Create the ingest bookkeeping tables if they do not exist yet. These are
+    kept when the database is reset so the run history is not lost."""
+    with db as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS ingest_runs (
+                id SERIAL PRIMARY KEY,
+                started_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMPTZ
+                )"""
+        )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS ingest_run_venues (
+                run_id INTEGER NOT NULL REFERENCES ingest_runs (id) ON DELETE CASCADE,
+                theatre VARCHAR(255) NOT NULL,
+                succeeded BOOLEAN NOT NULL,
+                shows INTEGER NOT NULL,
+                pages_fetched INTEGER NOT NULL,
+                duration_seconds REAL NOT NULL,
+                errors TEXT[] NOT NULL,
+                added INTEGER NOT NULL DEFAULT 0,
+                changed INTEGER NOT NULL DEFAULT 0,
+                removed INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (run_id, theatre)
+                )"""
+        )
+        # Shows scraped in a run, waiting to be compared with the shows table.
+        # This is rebuilt from scratch on every run so it is not crash safe.
+        cursor.execute(
+            """CREATE UNLOGGED TABLE IF NOT EXISTS show_staging (
+                run_id INTEGER NOT NULL,
+                theatre VARCHAR(255) NOT NULL,
+                title VARCHAR(255) NOT NULL,
+                image_url TEXT NOT NULL,
+                link_url TEXT NOT NULL,
+                start_date DATE NOT NULL,
+                end_date DATE NOT NULL
+                )"""
+        )
+        cursor.execute(
+            """CREATE INDEX IF NOT EXISTS _idx_show_staging_run_theatre
+                ON show_staging (run_id, theatre)
+                """
+        )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS show_changes (
+                run_id INTEGER NOT NULL REFERENCES ingest_runs (id) ON DELETE CASCADE,
+                theatre VARCHAR(255) NOT NULL,
+                title VARCHAR(255) NOT NULL,
+                change VARCHAR(7) NOT NULL,
+                start_date DATE NOT NULL,
+                end_date DATE NOT NULL
+                )"""
+        )
+        cursor.execute(
+            """CREATE INDEX IF NOT EXISTS _idx_show_changes_run
+                ON show_changes (run_id)
+                """
+        )
+        # Shows which have ended, moved out of the shows table so that the
+        # queries behind the calendar only scan the current listings
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS shows_archive (
+                id SERIAL PRIMARY KEY,
+                theatre VARCHAR(255) NOT NULL,
+                title VARCHAR(255) NOT NULL,
+                image_url TEXT NOT NULL,
+                link_url TEXT NOT NULL,
+                start_date DATE NOT NULL,
+                end_date DATE NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL,
+                archived_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )"""
+        )
+        # Shows at different theatres found to be the same production, named
+        # by the lowest show id in the group. Rebuilt after every ingest run.
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS show_groups (
+                show_id INTEGER PRIMARY KEY,
+                group_id INTEGER NOT NULL
+                )"""
+        )
+        # Details from each show's own page, by the page's url, which are only
+        # rewritten when the page's content changes
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS show_details (
+                link_url TEXT PRIMARY KEY,
+                description TEXT NOT NULL,
+                performances TEXT[] NOT NULL,
+                min_price NUMERIC(10, 2),
+                max_price NUMERIC(10, 2),
+                currency VARCHAR(3) NOT NULL,
+                content_hash VARCHAR(64) NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )"""
+        )
+        # Whether each venue was crawled to the end, rather than stopping
+        # early in an incremental crawl
+        cursor.execute(
+            """ALTER TABLE ingest_run_venues
+                ADD COLUMN IF NOT EXISTS complete BOOLEAN NOT NULL DEFAULT TRUE"""
+        )
+        # The hash of each show's thumbnail in the image cache, if fetched
+        for table in ("shows", "shows_archive"):
+            cursor.execute(
+                f"""ALTER TABLE IF EXISTS {table}
+                    ADD COLUMN IF NOT EXISTS image_hash VARCHAR(64)"""
+            )
+        cursor.execute(
+            """CREATE INDEX IF NOT EXISTS _idx_shows_archive_dates
+                ON shows_archive (start_date, end_date)
+                """
+        )
+        # A counter bumped by every statement which changes the shows, so the
+        # webapp knows when to reload its in-memory index of them
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS dataset_version (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                version BIGINT NOT NULL DEFAULT 0
+                )"""
+        )
+        cursor.execute(
+            "INSERT INTO dataset_version DEFAULT VALUES ON CONFLICT DO NOTHING"
+        )
+        cursor.execute(
+            """CREATE OR REPLACE FUNCTION bump_dataset_version()
+            RETURNS trigger AS $$
+                BEGIN
+                    UPDATE dataset_version SET version = version + 1;
+                    RETURN NULL;
+                END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        # Statements which match no rows, or rewrite rows unchanged, still fire
+        # statement triggers, so only bump the version if the rows they saw
+        # differ. This needs the transition tables to be named `old_rows` and
+        # `new_rows`.
+        cursor.execute(
+            """CREATE OR REPLACE FUNCTION bump_dataset_version_if_changed()
+            RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        PERFORM 1 FROM new_rows LIMIT 1;
+                    ELSIF TG_OP = 'DELETE' THEN
+                        PERFORM 1 FROM old_rows LIMIT 1;
+                    ELSE
+                        PERFORM 1 FROM (
+                            SELECT * FROM new_rows EXCEPT SELECT * FROM old_rows
+                        ) AS changed LIMIT 1;
+                    END IF;
+                    IF FOUND THEN
+                        UPDATE dataset_version SET version = version + 1;
+                    END IF;
+                    RETURN NULL;
+                END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        for table in ("shows", "show_groups"):
+            cursor.execute(
+                f"""DO $$
+                BEGIN
+                    IF to_regclass('{table}') IS NOT NULL THEN
+                        DROP TRIGGER IF EXISTS {table}_dataset_version ON {table};
+                        DROP TRIGGER IF EXISTS {table}_dataset_version_insert
+                            ON {table};
+                        DROP TRIGGER IF EXISTS {table}_dataset_version_update
+                            ON {table};
+                        DROP TRIGGER IF EXISTS {table}_dataset_version_delete
+                            ON {table};
+                        DROP TRIGGER IF EXISTS {table}_dataset_version_truncate
+                            ON {table};
+                        CREATE TRIGGER {table}_dataset_version_insert
+                            AFTER INSERT ON {table}
+                            REFERENCING NEW TABLE AS new_rows
+                            FOR EACH STATEMENT
+                            EXECUTE PROCEDURE bump_dataset_version_if_changed();
+                        CREATE TRIGGER {table}_dataset_version_update
+                            AFTER UPDATE ON {table}
+                            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                            FOR EACH STATEMENT
+                            EXECUTE PROCEDURE bump_dataset_version_if_changed();
+                        CREATE TRIGGER {table}_dataset_version_delete
+                            AFTER DELETE ON {table}
+                            REFERENCING OLD TABLE AS old_rows
+                            FOR EACH STATEMENT
+                            EXECUTE PROCEDURE bump_dataset_version_if_changed();
+                        CREATE TRIGGER {table}_dataset_version_truncate
+                            AFTER TRUNCATE ON {table}
+                            FOR EACH STATEMENT
+                            EXECUTE PROCEDURE bump_dataset_version();
+                    END IF;
+                END
+                $$"""
+            )
+
+
+def archive_shows(db, retention_days=0):
+    """Move shows which ended more than `retention_days` days ago from the
+    shows table into the archive, returning the number moved"""
+    with db as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """WITH ended AS (
+                    DELETE FROM shows
+                    WHERE end_date < CURRENT_DATE - %(retention_days)s
+                    RETURNING theatre, title, image_url, image_hash, link_url,
+                        start_date, end_date, created_at
+                )
+                INSERT INTO shows_archive (theatre, title, image_url, image_hash,
+                        link_url, start_date, end_date, created_at)
+                    SELECT * FROM ended""",
+            {"retention_days": retention_days},
+        )
+        return cursor.rowcount
 
 
 def reset_database(db):
@@ -41,6 +329,11 @@ def reset_database(db):
                 ON shows (theatre, title)
                 """
         )
+        cursor.execute(
+            """CREATE INDEX _idx_shows_end_date
+                ON shows (end_date)
+                """
+        )
 
         cursor.execute(
             """CREATE OR REPLACE FUNCTION total_months(date)
@@ -49,3 +342,5 @@ def reset_database(db):
                     language sql immutable
             """
         )
+
+    ensure_schema(db)
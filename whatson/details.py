@@ -0,0 +1,247 @@
+"""
+Whatson details
+
+Optional enrichment of the shows with the details on each show's own page:
+a description, the performance times and the prices. These are read from the
+schema.org `Event` data which most theatre sites embed as JSON-LD for search
+engines, falling back to the page's description meta tags.
+
+Detail pages are fetched concurrently, with at most `per_host` requests in
+flight to each site on top of the HTTP client's rate limit. Every page is
+cached on disk by url along with its validators and the hash of its content,
+so a page is only requested again once its cache entry is older than
+`max_age` (or its show changed), is then revalidated with a conditional
+request, and is only parsed and written if its content changed.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+LOG = logging.getLogger("whatson.details")
+
+DETAILS_DIR = os.environ.get("WHATSON_DETAILS_DIR", "details")
+MAX_AGE = 7 * 24 * 60 * 60
+
+
+class ShowDetails(NamedTuple):
+    """The details found on a show's page"""
+
+    description: str = ""
+    # ISO 8601 start times of the performances, as given by the page
+    performances: Tuple[str, ...] = ()
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    currency: str = ""
+
+
+def _json_ld_objects(soup):
+    for script in soup.find_all("script", type="application/ld+json"):
+        try:
+            data = json.loads(script.string or "")
+        except ValueError:
+            continue
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(reversed(item))
+            elif isinstance(item, dict):
+                yield item
+                if "@graph" in item:
+                    stack.append(item["@graph"])
+
+
+def _is_event(item):
+    types = item.get("@type", [])
+    if isinstance(types, str):
+        types = [types]
+    return any(t.endswith("Event") for t in types if isinstance(t, str))
+
+
+def _prices(offers):
+    if isinstance(offers, dict):
+        offers = [offers]
+    for offer in offers if isinstance(offers, list) else []:
+        if not isinstance(offer, dict):
+            continue
+        for key in ("price", "lowPrice", "highPrice"):
+            try:
+                price = float(str(offer[key]).replace(",", ""))
+            except (KeyError, ValueError):
+                continue
+            yield price, offer.get("priceCurrency", "")
+
+
+def parse_details(html):
+    """Extract the `ShowDetails` from a show's page"""
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
+    soup = BeautifulSoup(html, "lxml")
+
+    description = ""
+    performances = set()
+    prices = []
+    currency = ""
+    for item in _json_ld_objects(soup):
+        if not _is_event(item):
+            continue
+        if not description and isinstance(item.get("description"), str):
+            description = item["description"]
+        if isinstance(item.get("startDate"), str):
+            performances.add(item["startDate"])
+        for price, price_currency in _prices(item.get("offers")):
+            prices.append(price)
+            currency = currency or price_currency
+
+    if not description:
+        for attrs in ({"name": "description"}, {"property": "og:description"}):
+            meta = soup.find("meta", attrs=attrs)
+            if meta is not None and meta.get("content"):
+                description = meta["content"]
+                break
+
+    return ShowDetails(
+        description=" ".join(description.split()),
+        performances=tuple(sorted(performances)),
+        min_price=min(prices) if prices else None,
+        max_price=max(prices) if prices else None,
+        currency=currency,
+    )
+
+
+def _cached_details(entry):
+    description, performances, *prices = entry["details"]
+    return ShowDetails(description, tuple(performances), *prices)
+
+
+class DetailCache:
+    """Detail page cache entries on disk, one JSON file per url"""
+
+    def __init__(self, directory=DETAILS_DIR):
+        self.directory = directory
+
+    def path(self, url):
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, name[:2], f"{name}.json")
+
+    def get(self, url):
+        """The cache entry of a url as a dict, or None"""
+        try:
+            with open(self.path(url)) as infile:
+                entry = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        # Guard against the (unlikely) hash collision
+        return entry if entry.get("url") == url else None
+
+    def put(self, url, entry):
+        path = self.path(url)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Replace the entry atomically, as pages are fetched concurrently
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as outfile:
+            json.dump(dict(entry, url=url), outfile)
+        os.replace(tmp_path, path)
+
+
+class DetailFetcher:
+    """Fetches show detail pages through the cache"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        client,
+        cache,
+        workers=8,
+        per_host=2,
+        max_age=MAX_AGE,
+        parse=parse_details,
+        clock=time.time,
+    ):
+        self.client = client
+        self.cache = cache
+        self.workers = workers
+        self.per_host = per_host
+        self.max_age = max_age
+        self.parse = parse
+        self.clock = clock
+
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def fetch(self, url, force=False):
+        """Return the details of the page at `url`, the hash of its content
+        and whether it is new or has changed since it was cached. Cached pages
+        younger than `max_age` are not requested unless `force` is set."""
+        entry = self.cache.get(url)
+        now = self.clock()
+        if entry is not None and not force and now - entry["fetched_at"] < self.max_age:
+            return _cached_details(entry), entry["content_hash"], False
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with self._host_slot(url):
+            response = self.client.get(url, headers=headers)
+
+        if entry is not None and response.status_code == 304:
+            content_hash = entry["content_hash"]
+        else:
+            content_hash = hashlib.sha256(response.content).hexdigest()
+
+        changed = entry is None or content_hash != entry["content_hash"]
+        if changed:
+            details = self.parse(response.text)
+            entry = {"content_hash": content_hash, "details": list(details)}
+        else:
+            details = _cached_details(entry)
+
+        entry.update(
+            fetched_at=now,
+            etag=response.headers.get("ETag", entry.get("etag")),
+            last_modified=response.headers.get(
+                "Last-Modified", entry.get("last_modified")
+            ),
+        )
+        self.cache.put(url, entry)
+        return details, content_hash, changed
+
+    def fetch_all(self, urls):
+        """Fetch the pages of a dict of urls to whether to `force` a request,
+        returning a list of `(url, details, content_hash, changed)` and the
+        number of pages which could not be fetched"""
+        fetched = []
+        failed = 0
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            futures = {
+                executor.submit(self.fetch, url, force): url
+                for url, force in urls.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                url = futures[future]
+                try:
+                    fetched.append((url, *future.result()))
+                except Exception as exc:  # pylint: disable=broad-except
+                    LOG.warning("cannot fetch details from %s: %s", url, exc)
+                    failed += 1
+        return fetched, failed
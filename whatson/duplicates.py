@@ -0,0 +1,152 @@
+"""
+Whatson duplicates
+
+Finds the same production listed by several theatres, which happens with
+touring shows. Titles are normalised to remove differences in case,
+punctuation and accents, and then near identical titles are found using
+MinHash signatures of their trigrams, with locality sensitive hashing to
+only compare titles which are likely to match. This takes time roughly
+proportional to the number of shows, rather than comparing every pair.
+"""
+
+import re
+import unicodedata
+import zlib
+
+# Number of hash functions in each MinHash signature, split into bands of
+# rows. Titles sharing all the rows of any band are compared, so with 16
+# bands of 2 rows, titles whose trigrams overlap by half are compared with a
+# probability of over 99%.
+BANDS = 16
+ROWS = 2
+
+# Trigram Jaccard similarity at or above which two titles are the same show
+THRESHOLD = 0.6
+
+_MASK = (1 << 64) - 1
+_SIGNATURE_SIZE = BANDS * ROWS
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACE = re.compile(r"\s+")
+# Billing that varies between theatres for the same production
+_NOISE = re.compile(r"\b(the musical|live on stage|uk tour|in concert)$|^the\b")
+
+
+def normalise_title(title):
+    """Reduce a title to a canonical form: lower case, without accents,
+    punctuation, a leading "the" or billing such as "the musical"."""
+    title = unicodedata.normalize("NFKD", title)
+    title = "".join(char for char in title if not unicodedata.combining(char))
+    title = title.lower().replace("&", " and ")
+    title = _SPACE.sub(" ", _NON_WORD.sub(" ", title)).strip()
+
+    # Strip the billing repeatedly, e.g. "the ... the musical uk tour"
+    while True:
+        stripped = _NOISE.sub("", title).strip()
+        if stripped == title or not stripped:
+            return title
+        title = stripped
+
+
+def trigrams(normalised):
+    """The set of trigrams of the words in a normalised title, padded as in
+    Postgres' pg_trgm so that short words still have some"""
+    grams = set()
+    for word in normalised.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(first, second):
+    """Jaccard similarity of two sets of trigrams"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def minhash(grams):
+    """The MinHash signature of a set of trigrams.
+
+    This uses one permutation hashing, which hashes each trigram once and
+    keeps the minimum hash in each of `BANDS * ROWS` bins, rather than
+    hashing every trigram once per bin. Empty bins borrow the value of the
+    next bin along, so that similar titles still tend to agree on them.
+    """
+    bins = [None] * _SIGNATURE_SIZE
+    for gram in grams:
+        # Spread the bits of the CRC over 64 bits, so both the bin and the
+        # value are well mixed
+        value = (zlib.crc32(gram.encode()) * 0x9E3779B97F4A7C15) & _MASK
+        index = value % _SIGNATURE_SIZE
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+
+    signature = list(bins)
+    for index, value in enumerate(bins):
+        offset = 1
+        while value is None:
+            value = bins[(index + offset) % _SIGNATURE_SIZE]
+            offset += 1
+        # Mix in the distance borrowed from, so a borrowed value does not
+        # collide with the bin it was borrowed from
+        signature[index] = value + offset - 1
+    return signature
+
+
+class UnionFind:
+    """Disjoint sets of the integers 0 to `size - 1`"""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression, so later finds are quick
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+def group_titles(titles, threshold=THRESHOLD):
+    """Group the titles which name the same show, returning a list of groups
+    of indices into `titles`. Titles without a duplicate are not included."""
+    groups = UnionFind(len(titles))
+
+    # Identical titles once normalised need no further comparison
+    normalised = {}
+    for index, title in enumerate(titles):
+        normalised.setdefault(normalise_title(title), []).append(index)
+
+    names = list(normalised)
+    for indices in normalised.values():
+        for index in indices[1:]:
+            groups.union(indices[0], index)
+
+    # Compare each distinct title with the first title in each bucket it
+    # falls in, which keeps the work linear even for crowded buckets
+    grams = [trigrams(name) for name in names]
+    buckets = {}
+    for position, name_grams in enumerate(grams):
+        if not name_grams:
+            continue
+        signature = minhash(name_grams)
+        for band in range(BANDS):
+            key = (band, tuple(signature[band * ROWS : (band + 1) * ROWS]))
+            first = buckets.setdefault(key, position)
+            if first != position and similarity(grams[first], name_grams) >= threshold:
+                groups.union(
+                    normalised[names[first]][0], normalised[names[position]][0]
+                )
+
+    members = {}
+    for index in range(len(titles)):
+        members.setdefault(groups.find(index), []).append(index)
+    return [indices for indices in members.values() if len(indices) > 1]
@@ -0,0 +1,175 @@
+"""
+Whatson images
+
+Show images are downloaded at ingest time and stored as small thumbnails,
+so the frontend does not hotlink full size originals from the theatres'
+sites. Thumbnails are stored in a content addressed cache on disk: each
+image is named by the SHA-256 of the original bytes, and stored as both WebP
+and JPEG. The least recently used images are evicted once the cache grows
+past its size limit.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+
+LOG = logging.getLogger("whatson.images")
+
+IMAGE_DIR = os.environ.get("WHATSON_IMAGE_DIR", "images")
+MAX_BYTES = 256 * 1024 * 1024
+
+# Bounding box of the thumbnails, which is large enough for the show cards
+THUMBNAIL_SIZE = (480, 480)
+
+# Served formats, by preference, with their file extensions and media types
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpg": ("JPEG", "image/jpeg"),
+}
+
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# An image's path changes with its content, so it can be cached forever
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class ImageError(ValueError):
+    """Raised for data that cannot be read as an image"""
+
+
+def make_thumbnails(data, size=THUMBNAIL_SIZE):
+    """Return the encoded thumbnail of the image `data` in each format"""
+    # Imported here as only ingest runs which store new images need Pillow
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ImageError(f"cannot read image: {exc}") from exc
+
+    image.thumbnail(size)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    thumbnails = {}
+    for extension, (image_format, _) in FORMATS.items():
+        output = io.BytesIO()
+        image.save(output, image_format, quality=80)
+        thumbnails[extension] = output.getvalue()
+    return thumbnails
+
+
+class ImageCache:
+    """Thumbnails on disk, named by the hash of the original image"""
+
+    def __init__(self, directory=IMAGE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._size = None
+
+    def path(self, image_hash, extension):
+        """The path an image is stored at, which may not exist"""
+        return os.path.join(self.directory, image_hash[:2], f"{image_hash}.{extension}")
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                yield os.path.join(root, name)
+
+    def total_size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(os.path.getsize(path) for path in self._files())
+            return self._size
+
+    def __contains__(self, image_hash):
+        return all(os.path.exists(self.path(image_hash, ext)) for ext in FORMATS)
+
+    def store(self, data):
+        """Store the thumbnails of an image, returning its hash"""
+        image_hash = hashlib.sha256(data).hexdigest()
+        if image_hash in self:
+            self.touch(image_hash)
+            return image_hash
+
+        thumbnails = make_thumbnails(data)
+        # Measure the cache before adding to it, so the new files are counted once
+        self.total_size()
+        directory = os.path.dirname(self.path(image_hash, "jpg"))
+        os.makedirs(directory, exist_ok=True)
+
+        added = 0
+        for extension, thumbnail in thumbnails.items():
+            # Write to a temporary file first so a thumbnail is never served
+            # half written
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "wb") as outfile:
+                outfile.write(thumbnail)
+            os.replace(tmp_path, self.path(image_hash, extension))
+            added += len(thumbnail)
+
+        with self._lock:
+            self._size += added
+        self.evict()
+        return image_hash
+
+    def touch(self, image_hash):
+        """Mark an image as recently used"""
+        for extension in FORMATS:
+            try:
+                os.utime(self.path(image_hash, extension))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Remove the least recently used images until the cache fits within
+        `max_bytes`"""
+        if self.total_size() <= self.max_bytes:
+            return
+
+        with self._lock:
+            # Group the files by image, so each image is removed as a whole
+            images = {}
+            for path in self._files():
+                stat = os.stat(path)
+                image_hash = os.path.basename(path).split(".")[0]
+                used, size, paths = images.get(image_hash, (0, 0, []))
+                images[image_hash] = (
+                    max(used, stat.st_mtime),
+                    size + stat.st_size,
+                    paths + [path],
+                )
+
+            self._size = sum(size for _, size, _ in images.values())
+            for _, size, paths in sorted(images.values()):
+                if self._size <= self.max_bytes:
+                    break
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self._size -= size
+                LOG.debug("evicted %s", paths[0])
+
+    def lookup(self, image_hash, accept=""):
+        """Find the stored thumbnail to serve for a request with the given
+        `Accept` header, returning its path and media type, or None"""
+        if not HASH_RE.match(image_hash):
+            return None
+
+        for extension, (_, media_type) in FORMATS.items():
+            if media_type != "image/jpeg" and media_type not in accept:
+                continue
+            path = self.path(image_hash, extension)
+            if os.path.exists(path):
+                return path, media_type
+
+        return None
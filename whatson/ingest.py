@@ -11,93 +11,299 @@ import argparse
 from html import unescape
 import configparser
 import datetime
+import functools
 import logging
-from urllib.parse import urlencode
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 import re
-from bs4.element import Tag
-from bs4 import BeautifulSoup
-from psycopg2.errors import UniqueViolation  # pylint: disable=no-name-in-module
-from selenium import webdriver
-import requests
-from .db import DB, reset_database
+import signal
+import threading
+import time
+from typing import List, NamedTuple, Optional
+from .browser import BrowserPool
+from .db import DB, archive_shows, execute_values, pooled_connection
+from .details import DetailCache, DetailFetcher
+from .dates import parse_date_range
+from .duplicates import group_titles
+from .images import ImageCache, ImageError
+from .metrics import MetricsWriter
+from .pipeline import Pipeline
+from .scheduler import Scheduler
+from .shows import InvalidShow, Show
+from .sinks import create_sink
+from .streaming import iter_elements
 
 LOG = logging.getLogger("whatson")
 LOG.setLevel(logging.WARNING)
 
+# How often the daemon refreshes each venue, in seconds
+HOURLY = 60 * 60
+DAILY = 24 * HOURLY
+
 # Database management
 
+# Key of the advisory lock which serialises the rewrites of the show groups
+GROUPS_LOCK = 0x77686174
+
 
-def upload(theatre, show):
-    """Given a show extracted from the theatre page, upload the show to the database"""
-    LOG.debug("uploading %s - %s", show["title"], theatre)
-    with DB as conn:
+def group_duplicates():
+    """Find the current shows which are the same production at different
+    theatres, and store the groups. Returns the number of groups found."""
+    with pooled_connection() as conn:
         cursor = conn.cursor()
-        try:
-            cursor.execute(
-                """INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
-                    VALUES (%s, %s, %s, %s, %s, %s)""",
-                (
-                    theatre,
-                    show["title"],
-                    show["image_url"],
-                    show["link_url"],
-                    show["start_date"],
-                    show["end_date"],
-                ),
+        # Overlapping runs take turns, so the later one sees the groups stored
+        # by the earlier rather than deleting them from under it. The lock is
+        # released when the transaction ends.
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (GROUPS_LOCK,))
+        cursor.execute(
+            """SELECT id, theatre, title FROM shows
+                WHERE end_date >= CURRENT_DATE
+                ORDER BY id"""
+        )
+        shows = cursor.fetchall()
+
+        groups = []
+        for indices in group_titles([show["title"] for show in shows]):
+            if len({shows[index]["theatre"] for index in indices}) > 1:
+                groups.append([shows[index]["id"] for index in indices])
+
+        rows = {(show_id, min(group)) for group in groups for show_id in group}
+
+        # Only rewrite the groups if they changed, as every change makes the
+        # webapp reload its index of the shows
+        cursor.execute("SELECT show_id, group_id FROM show_groups")
+        if {(row["show_id"], row["group_id"]) for row in cursor.fetchall()} != rows:
+            cursor.execute("DELETE FROM show_groups")
+            execute_values(
+                cursor,
+                "INSERT INTO show_groups (show_id, group_id) VALUES %s",
+                sorted(rows),
             )
-        except UniqueViolation:
-            # We have added this show already
-            LOG.debug("duplicate show %s found, skipping", show["title"])
-            return
-        except:
-            LOG.exception("unhandled exception")
-            raise
+
+    return len(groups)
 
 
 # Show fetching
-CLIENT = requests.Session()
-CLIENT.headers["User-Agent"] = "whatson/0.1.0"
+
+# Settings of the HTTP client, which is created on first use so that runs
+# which fetch nothing over HTTP do not import `requests`
+HTTP_OPTIONS = {"user_agent": "whatson/0.1.0", "timeout": 30, "retries": 3, "rate": 1.0}
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def http_client():
+    """The shared HTTP client, created with `HTTP_OPTIONS` on first use"""
+    global _CLIENT  # pylint: disable=global-statement
+
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            from .client import HttpClient  # pylint: disable=import-outside-toplevel
+
+            _CLIENT = HttpClient(**HTTP_OPTIONS)
+        return _CLIENT
 
 
-# Lazy initialisation
-# XXX this will cause a race condition if we use multiple threads around this (mutex?)
-DRIVER = None
+# Headless browsers for javascript rendered pages, started on first use
+BROWSERS = BrowserPool()
 
 
 def _fetch_html_requests(url):
     LOG.debug("fetching from url %s", url)
 
-    response = CLIENT.get(url)
-    response.raise_for_status()
-    return response.text
+    return http_client().get_text(url)
+
+
+def _stream_html_requests(url):
+    LOG.debug("streaming from url %s", url)
+
+    return http_client().get_chunks(url)
 
 
 def _fetch_html_selenium(url):
-    global DRIVER
+    LOG.debug("fetching from url %s with browser", url)
+    return BROWSERS.fetch(url)
 
-    LOG.debug("fetching from url %s", url)
 
-    # Lazy initialisation of driver
-    if DRIVER is None:
-        options = webdriver.ChromeOptions()
-        options.add_argument("--no-sandbox")
-        options.add_argument("--headless")
-        options.add_argument("--disable-gpu")
-        DRIVER = webdriver.Chrome(chrome_options=options)
-        DRIVER.implicitly_wait(3)
+def _soup(html):
+    """Parse a page with BeautifulSoup, which is imported on first use as it
+    is slow to import"""
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
+    return BeautifulSoup(html, "lxml")
+
+
+# Thumbnails of the show images, served by the webapp
+IMAGES = ImageCache()
+
+
+def cache_images(theatre):
+    """Download the images of a theatre's shows which are not in the image
+    cache, returning the number stored"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT DISTINCT image_url, image_hash FROM shows
+                WHERE theatre = %s AND image_url <> ''""",
+            (theatre,),
+        )
+        missing = {
+            row["image_url"]
+            for row in cursor.fetchall()
+            if row["image_hash"] is None or row["image_hash"] not in IMAGES
+        }
+
+    from requests import RequestException  # pylint: disable=import-outside-toplevel
+
+    hashes = []
+    for image_url in missing:
+        try:
+            image_hash = IMAGES.store(http_client().get(image_url).content)
+            hashes.append((theatre, image_url, image_hash))
+        except (RequestException, ImageError) as exc:
+            LOG.warning("cannot cache image %s: %s", image_url, exc)
+
+    if hashes:
+        with pooled_connection() as conn:
+            execute_values(
+                conn.cursor(),
+                """UPDATE shows SET image_hash = images.image_hash
+                    FROM (VALUES %s) AS images (theatre, image_url, image_hash)
+                    WHERE shows.theatre = images.theatre
+                    AND shows.image_url = images.image_url""",
+                hashes,
+            )
+
+    return len(hashes)
+
+
+# Fetches the show detail pages with `--details`, configured by `main`
+DETAILS = DetailFetcher(None, DetailCache())
+
+
+def enrich_shows(run_id, theatres):
+    """Fetch the detail pages of the theatres' current shows which are new,
+    changed in this run or were last fetched over `DETAILS.max_age` ago, and
+    store the details of the pages which changed. Returns the number stored."""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT shows.link_url,
+                    show_changes.title IS NOT NULL AS changed,
+                    show_details.link_url IS NULL AS missing
+                FROM shows
+                LEFT JOIN show_changes ON show_changes.run_id = %s
+                    AND show_changes.theatre = shows.theatre
+                    AND show_changes.title = shows.title
+                LEFT JOIN show_details ON show_details.link_url = shows.link_url
+                WHERE shows.theatre = ANY(%s) AND shows.end_date >= CURRENT_DATE""",
+            (run_id, list(theatres)),
+        )
+        urls = {}
+        missing = set()
+        for row in cursor.fetchall():
+            urls[row["link_url"]] = urls.get(row["link_url"], False) or row["changed"]
+            if row["missing"]:
+                missing.add(row["link_url"])
+
+    fetched, failed = DETAILS.fetch_all(urls)
+    if failed:
+        LOG.warning("cannot fetch %d of %d detail pages", failed, len(urls))
+
+    # Pages which are unchanged but missing from the table are written from
+    # the cache
+    rows = [
+        (
+            url,
+            details.description,
+            list(details.performances),
+            details.min_price,
+            details.max_price,
+            details.currency,
+            content_hash,
+        )
+        for url, details, content_hash, changed in fetched
+        if changed or url in missing
+    ]
+    if rows:
+        with pooled_connection() as conn:
+            execute_values(
+                conn.cursor(),
+                """INSERT INTO show_details (link_url, description, performances,
+                        min_price, max_price, currency, content_hash)
+                    VALUES %s
+                    ON CONFLICT (link_url) DO UPDATE SET
+                        description = EXCLUDED.description,
+                        performances = EXCLUDED.performances,
+                        min_price = EXCLUDED.min_price,
+                        max_price = EXCLUDED.max_price,
+                        currency = EXCLUDED.currency,
+                        content_hash = EXCLUDED.content_hash,
+                        updated_at = CURRENT_TIMESTAMP""",
+                rows,
+            )
+
+    return len(rows)
+
 
-    DRIVER.get(url)
-    return DRIVER.page_source
+def current_year():
+    """The year assumed for listing dates without one. This is worked out as
+    each page is parsed, as the daemon runs across the new year."""
+    return datetime.date.today().year
 
 
-# Regex replacer to remove 1st/2nd/3rd/4th etc.
-DATE_REPLACER = re.compile(r"\b([0123]?[0-9])(st|th|nd|rd)\b")
-CURRENT_YEAR = datetime.date.today().year
+def _increment_query(url, key, step):
+    """Return the url with its integer query parameter `key` increased by `step`"""
+    parts = urlparse(url)
+    query = dict(parse_qsl(parts.query))
+    query[key] = int(query.get(key, 0)) + step
+    return urlunparse(parts._replace(query=urlencode(query)))
 
 
-def weekday_replacer(text):
-    """Replace Thurs -> Thu, Tues -> Tue"""
-    return text.replace("Thurs", "Thu").replace("Tues", "Tue")
+def _parse_all_events(html, make_show):
+    """Build the shows for an NEC group arena from the `all-events` hidden input.
+
+    The input holds the full event list for all of the group's arenas as HTML
+    escaped JSON, and is rendered without any javascript so the page can be
+    fetched with plain HTTP. Events for other arenas are marked as external.
+    The shows are created with the fetcher's `make_show`.
+
+    The page may be given as an iterator of chunks as it downloads, which is
+    only read as far as the input.
+
+    Raises `ValueError` if the page does not contain a usable event list.
+    """
+    data_input = next(
+        iter_elements(html, "input", lambda element: element.get("id") == "all-events"),
+        None,
+    )
+    if data_input is None or data_input.get("value") is None:
+        raise ValueError("cannot find all-events input in HTML")
+
+    try:
+        events = json.loads(unescape(data_input.get("value")))["events"]
+    except (json.JSONDecodeError, KeyError, TypeError) as exc:
+        raise ValueError(f"invalid all-events data: {exc}") from exc
+
+    shows = []
+    for event in events:
+        if event.get("isExternal"):
+            continue
+
+        try:
+            title = event["eventName"]
+            start_date, end_date = parse_date_range(event["dateString"])
+            show = make_show(
+                title, event["thumbnailUrl"], event["url"], start_date, end_date
+            )
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"invalid event in all-events data: {exc}") from exc
+        if show is not None:
+            shows.append(show)
+
+    if not shows:
+        raise ValueError("no events found in all-events data")
+
+    return shows
 
 
 class FetcherList(type):
@@ -114,14 +320,35 @@ class ValidationError(ValueError):
     pass
 
 
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Page(NamedTuple):
+    """The shows found on a listing page, and the next page to fetch if any"""
+
+    shows: List[Show]
+    next_url: Optional[str] = None
+    next_rendered: bool = False
+
+
 class Fetcher(metaclass=FetcherList):
     url = None
     root_url = None
     name = None
     active = None
+    # Whether the listing pages must be rendered in a browser
+    rendered = False
+    # Whether `parse` takes the pages as an iterator of chunks of bytes as
+    # they download, rather than the whole page
+    streamed = False
+    # How often to refresh this venue when running as a daemon
+    interval = DAILY
 
     def __init__(self):
         self.fetchers = self.__class__.fetchers
+        self.pages_fetched = 0
+        self.deadline = None
 
         # Validate the data
         if self.url is None:
@@ -136,6 +363,60 @@ class Fetcher(metaclass=FetcherList):
         if self.active is None:
             raise ValidationError(f"{self}: self.active is None")
 
+    def check_deadline(self):
+        """Raise `DeadlineExceeded` if this fetcher has run out of time"""
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DeadlineExceeded(f"{self.name} did not finish in time")
+
+    def fetch_html(self, url):
+        """Fetch the HTML of a listing page"""
+        self.check_deadline()
+        self.pages_fetched += 1
+        if self.streamed:
+            return _stream_html_requests(url)
+        return _fetch_html_requests(url)
+
+    def render_html(self, url):
+        """Fetch the HTML of a listing page after rendering it in a browser"""
+        self.check_deadline()
+        self.pages_fetched += 1
+        return _fetch_html_selenium(url)
+
+    def download(self, url, rendered=False):
+        """Fetch a listing page, rendering it in a browser if `rendered`"""
+        if rendered:
+            return self.render_html(url)
+        return self.fetch_html(url)
+
+    def make_show(self, title, image_url, link_url, start_date, end_date=None):
+        """Create a `Show` with `Show.create`, resolving its urls against the
+        venue's root url. An invalid show is logged and skipped by returning
+        None, so that one bad listing does not fail the whole venue."""
+        try:
+            return Show.create(
+                title, image_url, link_url, start_date, end_date, base_url=self.root_url
+            )
+        except InvalidShow as exc:
+            LOG.warning("%s: skipping invalid show: %s", self.name, exc)
+            return None
+
+    def start_url(self):
+        """The first listing page to fetch"""
+        return self.url
+
+    def parse(self, html, url, rendered=False):
+        """Extract the shows from a listing page, returning a `Page`"""
+        raise NotImplementedError
+
+    def fetch(self):
+        """Fetch the shows from every listing page"""
+        url, rendered = self.start_url(), self.rendered
+        while url is not None:
+            html = self.download(url, rendered)
+            page = self.parse(html, url, rendered)
+            yield from page.shows
+            url, rendered = page.next_url, page.next_rendered
+
 
 class AlbanyFetcher(Fetcher):
 
@@ -144,15 +425,13 @@ class AlbanyFetcher(Fetcher):
     url = "https://albanytheatre.co.uk/whats-on/"
     active = True
 
-    def fetch(self):
-        """Fetch shows from the Albany Theatre"""
-        html = _fetch_html_requests(self.url)
-        soup = BeautifulSoup(html, "lxml")
+    def parse(self, html, url, rendered=False):
+        """Parse shows from the Albany Theatre"""
+        soup = _soup(html)
 
+        shows = []
         container = soup.find("div", class_="query_block_content")
-        for elem in container.children:
-            if not isinstance(elem, Tag):
-                continue
+        for elem in container.find_all(recursive=False):
 
             try:
                 date_str = elem.find(class_="show-date").text.lower()
@@ -161,33 +440,16 @@ class AlbanyFetcher(Fetcher):
 
             title = elem.find("h4").find("a").text.strip()
             image_url = elem.find("img").attrs["src"]
-            image_url = "".join([self.root_url, image_url])
 
             link_url = elem.find("h4").find("a").attrs["href"]
-            link_url = "".join([self.root_url, link_url])
 
-            # Parse date string
-            if "-" in date_str:
-                # Two separate dates
-                parts = [part.strip() for part in date_str.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%d %B %Y").date()
+            start_date, end_date = parse_date_range(date_str)
 
-                date_month = datetime.datetime.strptime(parts[0], "%d %B").date()
-                start_date = datetime.date(
-                    end_date.year, date_month.month, date_month.day
-                )
-            else:
-                # One date therefore start_date = end_date
-                start_date = datetime.datetime.strptime(date_str, "%d %B %Y").date()
-                end_date = start_date
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                shows.append(show)
 
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+        return Page(shows)
 
 
 class BelgradeFetcher(Fetcher):
@@ -197,10 +459,9 @@ class BelgradeFetcher(Fetcher):
     url = "http://www.belgrade.co.uk/whats-on/"
     active = True
 
-    def fetch(self):
-        """Fetch shows from the Belgrade Theatre"""
-        html = _fetch_html_requests(self.url)
-        soup = BeautifulSoup(html, "lxml")
+    def parse(self, html, url, rendered=False):
+        """Parse shows from the Belgrade Theatre"""
+        soup = _soup(html)
 
         container = soup.find("div", class_="list-productions", id="secondary-content")
 
@@ -210,9 +471,8 @@ class BelgradeFetcher(Fetcher):
         month = None
         year = None
 
-        for elem in container.children:
-            if not isinstance(elem, Tag):
-                continue
+        shows = []
+        for elem in container.find_all(recursive=False):
 
             if elem.name == "h2":
                 # Month/Year section
@@ -239,214 +499,184 @@ class BelgradeFetcher(Fetcher):
             date_text = elem.find("p", class_="date").text.strip().lower()
 
             link_url = elem.find("a", class_="production-link").attrs["href"]
-            link_url = "".join([self.root_url, link_url])
 
             image_url = (
                 elem.find("a", class_="production-link").find("img").attrs["src"]
             )
-            image_url = "".join([self.root_url, image_url])
-
-            # Parse the date from this panel. First we replace instances of e.g.
-            # 1st -> 1 so that strptime can parse the day and month
-            date_text = DATE_REPLACER.sub(r"\1", date_text)
-
-            def parse_single_date(text):
-                try:
-                    tmp_date = datetime.datetime.strptime(text, "%d %B").date()
-                except ValueError as exc:
-                    if "day is out of range for month" in str(exc):
-                        # Leap year? Try parsing with the current year
-                        text = f"{text} {year}"
-                        tmp_date = datetime.datetime.strptime(text, "%d %B %Y").date()
-                return datetime.datetime(year, tmp_date.month, tmp_date.day).date()
-
-            if "-" in date_text:
-                # Separate start and end dates
-                parts = [part.strip() for part in date_text.split("-")]
-                start_date = parse_single_date(parts[0])
-                end_date = parse_single_date(parts[1])
-            else:
-                # Single date
-                start_date = parse_single_date(date_text)
-                end_date = start_date
 
-            # Check if the start date and end date make sense. The start date must
-            # be the same as the date panel. If this is not the case, something is
-            # up. Therefore if the end date is before the start date then we must
-            # add one to the end date year.
+            # The dates in this panel do not include the year, so take it from
+            # the month/year panel. Runs that cross the new year have their end
+            # date moved into the following year by the parser.
+            start_date, end_date = parse_date_range(date_text, year=year)
+
+            # Check if the start date makes sense. The start date must be the
+            # same as the date panel. If this is not the case, something is up.
             assert start_date.year == year
-            if end_date < start_date:
-                end_date = datetime.date(
-                    end_date.year + 1, end_date.month, end_date.day
-                )
 
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                shows.append(show)
+
+        return Page(shows)
 
 
 class SymphonyHallFetcher(Fetcher):
 
     name = "Symphony Hall"
+    interval = HOURLY
     root_url = "https://www.thsh.co.uk/"
     url = "https://www.thsh.co.uk/whats-on/"
     active = True
 
-    def fetch(self):
-        """Fetch shows from Symphony Hall"""
-        url = self.url
-
-        # Loop over all pages
-        while True:
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-
-            container = soup.find("ul", class_="grid cf")
-            assert len(container.contents) <= 16
-            for elem in container.contents:
-                # The title is in capitals so we must turn this into a nicer
-                # format. Note we should treat each word separately rather than
-                # calling the `.title` method as this does not support embedded
-                # apostrophes (https://stackoverflow.com/a/1549644)
-                raw_title = elem.find("h3").text
-                title = " ".join(w.capitalize() for w in raw_title.split())
-
-                link_url = elem.find("a", class_="event-block").attrs["href"]
-                image_url = (
-                    elem.find("img", class_="o-image__full")
-                    .attrs["data-srcset"]
-                    .split()[0]
-                )
+    def parse(self, html, url, rendered=False):
+        """Parse shows from Symphony Hall"""
+        soup = _soup(html)
+
+        shows = []
+        container = soup.find("ul", class_="grid cf")
+        assert len(container.contents) <= 16
+        for elem in container.contents:
+            # The title is in capitals so we must turn this into a nicer
+            # format. Note we should treat each word separately rather than
+            # calling the `.title` method as this does not support embedded
+            # apostrophes (https://stackoverflow.com/a/1549644)
+            raw_title = elem.find("h3").text
+            title = " ".join(w.capitalize() for w in raw_title.split())
+
+            link_url = elem.find("a", class_="event-block").attrs["href"]
+            image_url = (
+                elem.find("img", class_="o-image__full").attrs["data-srcset"].split()[0]
+            )
 
-                date_container = elem.find("span", class_="event-block__time")
-                times = date_container.find_all("time")
-                if len(times) == 1:
-                    # Simple case, only a single time available
-                    start_date = datetime.datetime.fromisoformat(
-                        times[0].attrs["datetime"]
-                    ).date()
-                    end_date = start_date
-                elif len(times) == 2:
-                    # We have start time and end time
-                    assert times[0].attrs["itemprop"] == "startDate"
-                    assert times[1].attrs["itemprop"] == "endDate"
-
-                    start_date = datetime.datetime.fromisoformat(
-                        times[0].attrs["datetime"]
-                    ).date()
-                    end_date = datetime.datetime.fromisoformat(
-                        times[1].attrs["datetime"]
-                    ).date()
-                else:
-                    raise NotImplementedError(
-                        f"cannot parse dates from {date_container}"
-                    )
-
-                yield {
-                    "title": title,
-                    "image_url": image_url,
-                    "link_url": link_url,
-                    "start_date": start_date,
-                    "end_date": end_date,
-                }
-
-            # Handle pagination
-            next_link = soup.find("a", class_="pagination__link--next")
-            if next_link and "disabled" not in next_link.attrs["class"]:
-                url = next_link.attrs["href"]
+            date_container = elem.find("span", class_="event-block__time")
+            times = date_container.find_all("time")
+            if len(times) == 1:
+                # Simple case, only a single time available
+                start_date = datetime.datetime.fromisoformat(
+                    times[0].attrs["datetime"]
+                ).date()
+                end_date = start_date
+            elif len(times) == 2:
+                # We have start time and end time
+                assert times[0].attrs["itemprop"] == "startDate"
+                assert times[1].attrs["itemprop"] == "endDate"
+
+                start_date = datetime.datetime.fromisoformat(
+                    times[0].attrs["datetime"]
+                ).date()
+                end_date = datetime.datetime.fromisoformat(
+                    times[1].attrs["datetime"]
+                ).date()
             else:
-                break
+                raise NotImplementedError(f"cannot parse dates from {date_container}")
+
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                shows.append(show)
+
+        # Handle pagination
+        next_link = soup.find("a", class_="pagination__link--next")
+        if next_link and "disabled" not in next_link.attrs["class"]:
+            return Page(shows, next_url=next_link.attrs["href"])
+        return Page(shows)
 
 
 class HippodromeFetcher(Fetcher):
 
     name = "Hippodrome"
+    interval = HOURLY
     root_url = "https://www.birminghamhippodrome.com/"
     url = "https://www.birminghamhippodrome.com/whats-on/"
     active = True
 
-    def fetch(self):
-        """Fetch shows from the Hippodrome Theatre"""
-        url = self.url
-
-        while True:
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-            container = soup.find("ul", class_="main-events-list")
-
-            for elem in container.find_all("li", class_="events-list-item"):
-                item = elem.find("div", class_="performance-listing")
-
-                try:
-                    image_url = elem.find("a", class_="block").find("img").attrs["src"]
-                except AttributeError:
-                    image_url = ""
-
-                link_url = item.find("a", class_="block").attrs["href"]
-
-                details = item.find("div", class_="event-details")
-                title = details.find("h5", class_="performance-listing-title").text
-
-                date_text = details.find("p", class_="performance-listing-date").text
-
-                def parse_single_date(txt):
-                    # Try parsing with the year
-                    try:
-                        dtime = datetime.datetime.strptime(txt, "%a %d %b %Y").date()
-                    except ValueError as exc:
-                        if "does not match format" in str(exc):
-                            # We do not have the year, so assume the current year
-                            full_date_text = f"{txt} {CURRENT_YEAR}"
-                            dtime = datetime.datetime.strptime(
-                                full_date_text, "%a %d %b %Y"
-                            ).date()
-                        else:
-                            raise
-
-                    return dtime
-
-                if "-" in date_text or "&" in date_text:
-                    if "-" in date_text:
-                        parts = [part.strip() for part in date_text.split("-")]
-                    elif "&" in date_text:
-                        parts = [part.strip() for part in date_text.split("&")]
-
-                    start_date = parse_single_date(parts[0])
-                    end_date = parse_single_date(parts[1])
-                else:
-                    start_date = parse_single_date(date_text)
-                    end_date = start_date
-
-                yield {
-                    "title": title,
-                    "image_url": image_url,
-                    "link_url": link_url,
-                    "start_date": start_date,
-                    "end_date": end_date,
-                }
-
-            next_link = soup.find("a", class_="next")
-            if next_link:
-                url = next_link.attrs["href"]
-            else:
-                break
+    def parse(self, html, url, rendered=False):
+        """Parse shows from the Hippodrome Theatre"""
+        soup = _soup(html)
+        container = soup.find("ul", class_="main-events-list")
+
+        shows = []
+        for elem in container.find_all("li", class_="events-list-item"):
+            item = elem.find("div", class_="performance-listing")
+
+            try:
+                image_url = elem.find("a", class_="block").find("img").attrs["src"]
+            except AttributeError:
+                image_url = ""
+
+            link_url = item.find("a", class_="block").attrs["href"]
+
+            details = item.find("div", class_="event-details")
+            title = details.find("h5", class_="performance-listing-title").text
+
+            date_text = details.find("p", class_="performance-listing-date").text
+
+            # If we do not have the year, assume the current year. A date which
+            # does not exist in it, e.g. 29 February, skips just that show.
+            try:
+                start_date, end_date = parse_date_range(date_text, year=current_year())
+            except ValueError:
+                LOG.warning("%s: cannot parse date text %s", self.name, date_text)
+                continue
+
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                shows.append(show)
+
+        next_link = soup.find("a", class_="next")
+        if next_link:
+            return Page(shows, next_url=next_link.attrs["href"])
+        return Page(shows)
+
+
+class AllEventsMixin:
+    """Shared handling for the NEC group arenas. Their event cards are rendered
+    with javascript, but the full event list is also embedded in the page as
+    JSON. The JSON is used where possible, falling back to rendering the page
+    in a browser and parsing the event cards with `parse_event_cards`. The
+    pages are large, so the JSON is parsed from the page as it streams in."""
+
+    streamed = True
+
+    def download(self, url, rendered=False):
+        from requests import RequestException  # pylint: disable=import-outside-toplevel
+
+        try:
+            return super().download(url, rendered)
+        except RequestException as exc:
+            if rendered:
+                raise
+            LOG.warning("%s: falling back to selenium: %s", self.name, exc)
+            return None
 
+    def parse(self, html, url, rendered=False):
+        if rendered:
+            soup = _soup(html)
+            return Page(list(self.parse_event_cards(soup)))
 
-class ResortsWorldFetcher(Fetcher):
+        from requests import RequestException  # pylint: disable=import-outside-toplevel
+
+        if html is not None:
+            try:
+                return Page(_parse_all_events(html, self.make_show))
+            except (ValueError, RequestException) as exc:
+                LOG.warning("%s: falling back to selenium: %s", self.name, exc)
+
+        return Page([], next_url=url, next_rendered=True)
+
+    def parse_event_cards(self, soup):
+        """Parse shows from the javascript rendered event cards"""
+        raise NotImplementedError
+
+
+class ResortsWorldFetcher(AllEventsMixin, Fetcher):
 
     name = "Resortsworld Arena"
+    interval = HOURLY
     root_url = "https://www.resortsworldarena.co.uk/"
     url = "https://www.resortsworldarena.co.uk/whats-on/"
     active = True
 
-    def fetch(self):
-        html = _fetch_html_selenium(self.url)
-        soup = BeautifulSoup(html, "lxml")
-
+    def parse_event_cards(self, soup):
         # First build up a mapping of event name to image url. This is JSON after
         # HTML escaping so we must:
         #
@@ -474,51 +704,26 @@ class ResortsWorldFetcher(Fetcher):
         for event in events:
             link_tag = event.find("a", class_="eventhref")
             title = link_tag.find("span", class_="title").text
-            link_url = "".join([self.root_url, link_tag.attrs["href"]])
+            link_url = link_tag.attrs["href"]
             image_url = image_mapping[title.lower()]
             date_text = event.find("span", class_="date").text
 
-            if "-" in date_text:
-                parts = [part.strip() for part in date_text.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%d %B %Y").date()
-
-                try:
-                    # Assume day month no year
-                    augmented_date = f"{parts[0]} {end_date.year}"
-                    start_date = datetime.datetime.strptime(
-                        augmented_date, "%d %B %Y"
-                    ).date()
-                except ValueError:
-                    # Assume day no month no year
-                    augmented_date = f"{parts[0]} {end_date.month} {end_date.year}"
-                    start_date = datetime.datetime.strptime(
-                        augmented_date, "%d %m %Y"
-                    ).date()
+            start_date, end_date = parse_date_range(date_text)
 
-            else:
-                start_date = datetime.datetime.strptime(date_text, "%d %B %Y").date()
-                end_date = start_date
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                yield show
 
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
 
-
-class ArenaBirminghamFetcher(Fetcher):
+class ArenaBirminghamFetcher(AllEventsMixin, Fetcher):
 
     name = "Arena Birmingham"
+    interval = HOURLY
     root_url = "https://www.arenabham.co.uk/"
     url = "https://www.arenabham.co.uk/whats-on/"
     active = True
 
-    def fetch(self):
-        html = _fetch_html_selenium(self.url)
-        soup = BeautifulSoup(html, "lxml")
-
+    def parse_event_cards(self, soup):
         # First build up a mapping of event name to image url. This is JSON after
         # HTML escaping so we must:
         #
@@ -546,7 +751,7 @@ class ArenaBirminghamFetcher(Fetcher):
 
         for event in events:
             link_tag = event.find("a", class_="eventhref")
-            link_url = "".join([self.root_url, link_tag.attrs["href"]])
+            link_url = link_tag.attrs["href"]
 
             title = event.find("span", class_="title").text
 
@@ -556,37 +761,11 @@ class ArenaBirminghamFetcher(Fetcher):
                 event.find("div", class_="information").find("span", class_="date").text
             )
 
-            if "-" in date_text:
-                parts = [part.strip() for part in date_text.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%d %B %Y").date()
-
-                # Assume the start date is the full format
-                try:
-                    augmented_date = f"{parts[0]} {end_date.year}"
-                    tmp_date = datetime.datetime.strptime(
-                        augmented_date, "%d %B %Y"
-                    ).date()
-                except ValueError as exc:
-                    if "does not match format" in str(exc):
-                        augmented_date = f"{parts[0]} {end_date.month} {end_date.year}"
-                        start_date = datetime.datetime.strptime(
-                            augmented_date, "%d %m %Y"
-                        ).date()
-                    else:
-                        LOG.warning("unhandled exception: %s", exc)
-                        raise exc
-
-            else:
-                start_date = datetime.datetime.strptime(date_text, "%d %B %Y").date()
-                end_date = start_date
+            start_date, end_date = parse_date_range(date_text)
 
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                yield show
 
 
 class ArtrixFetcher(Fetcher):
@@ -596,92 +775,61 @@ class ArtrixFetcher(Fetcher):
     url = "https://www.artrix.co.uk/whats-on/"
     active = True
 
-    def fetch(self):
-        page = 1
-
-        # Loop over all pages
-        while True:
-            params = urlencode({"page": page})
-            url = self.url + "?" + params
-
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-
-            container = soup.find("ul", id="gridview-new")
-            events = container.find_all("li", class_="Exhib")
-            if not events:
-                # We must have reached the end of the pages
-                break
-
-            for event in events:
-                link_tag = event.find("div", class_="imgBox_Intrment").find("a")
-                link_url = "".join([self.root_url, link_tag.attrs["href"]])
-
-                image_url = "".join([self.root_url, link_tag.find("img").attrs["src"]])
-
-                title = event.find("div", class_="intrment_info").find("a").text
-
-                date_text = event.find("div", class_="postDate_l").text
-
-                def parse_date_part(text, end_date=None):
-                    text = weekday_replacer(DATE_REPLACER.sub(r"\1", text))
-                    try:
-                        date = datetime.datetime.strptime(text, "%a %d %b %Y").date()
-                    except ValueError as exc:
-                        if "does not match format" in str(exc):
-                            # No year available
-                            try:
-                                date = datetime.datetime.strptime(
-                                    f"{text} {CURRENT_YEAR}", "%a %d %b %Y"
-                                ).date()
-                            except ValueError as exc:
-                                if "does not match format" in str(exc):
-                                    # no month available, we must get the month from the end date
-                                    date = datetime.datetime.strptime(
-                                        f"{text} {end_date.month} {CURRENT_YEAR}",
-                                        "%a %d %m %Y",
-                                    ).date()
-
-                    return date
-
-                if "-" in date_text:
-                    parts = [part.strip() for part in date_text.split("-")]
-
-                    end_date = parse_date_part(parts[1])
-                    start_date = parse_date_part(parts[0], end_date=end_date)
-                else:
-                    start_date = parse_date_part(date_text)
-                    end_date = start_date
-
-                yield {
-                    "title": title,
-                    "image_url": image_url,
-                    "link_url": link_url,
-                    "start_date": start_date,
-                    "end_date": end_date,
-                }
-
-            # Handle pagination
-            page += 1
+    def start_url(self):
+        return self.url + "?" + urlencode({"page": 1})
+
+    def parse(self, html, url, rendered=False):
+        soup = _soup(html)
+
+        container = soup.find("ul", id="gridview-new")
+        events = container.find_all("li", class_="Exhib")
+        if not events:
+            # We must have reached the end of the pages
+            return Page([])
+
+        shows = []
+        for event in events:
+            link_tag = event.find("div", class_="imgBox_Intrment").find("a")
+            link_url = link_tag.attrs["href"]
+
+            image_url = link_tag.find("img").attrs["src"]
+
+            title = event.find("div", class_="intrment_info").find("a").text
+
+            date_text = event.find("div", class_="postDate_l").text
+
+            try:
+                start_date, end_date = parse_date_range(date_text, year=current_year())
+            except ValueError:
+                LOG.warning("%s: cannot parse date text %s", self.name, date_text)
+                continue
+
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                shows.append(show)
+
+        # Handle pagination
+        return Page(shows, next_url=_increment_query(url, "page", 1))
 
 
 class AlexFetcher(Fetcher):
 
     name = "New Alexandra"
+    interval = HOURLY
     root_url = "https://www.atgtickets.com/"
     url = "https://www.atgtickets.com/venues/the-alexandra-theatre-birmingham/"
     active = True
 
-    def fetch(self):
-        html = _fetch_html_requests(self.url)
-        soup = BeautifulSoup(html, "lxml")
+    def parse(self, html, url, rendered=False):
+        soup = _soup(html)
 
+        shows = []
         container = soup.find("section", {"class": re.compile(r"WhatsOnPanel.*")})
         for event in container.contents:
             card_image_tag = event.find("div", {"class": re.compile(r"ShowCard_.*")})
 
             link_tag = card_image_tag.find("a")
-            link_url = "".join([self.root_url, link_tag.attrs["href"]])
+            link_url = link_tag.attrs["href"]
 
             image_tag = card_image_tag.find("img")
             image_url = image_tag.attrs["src"]
@@ -693,30 +841,13 @@ class AlexFetcher(Fetcher):
 
             date_text = card_details_tag.find("div").text
 
-            if "-" in date_text:
-                parts = [p.strip() for p in date_text.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%a %d %b %Y").date()
-                try:
-                    start_date = datetime.datetime.strptime(
-                        parts[0], "%a %d %b %Y"
-                    ).date()
-                except ValueError as exc:
-                    if "does not match format" in str(exc):
-                        start_date = datetime.datetime.strptime(
-                            f"{parts[0]} {end_date.year}", "%a %d %b %Y"
-                        ).date()
+            start_date, end_date = parse_date_range(date_text)
 
-            else:
-                start_date = datetime.datetime.strptime(date_text, "%a %d %b %Y").date()
-                end_date = start_date
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                shows.append(show)
 
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+        return Page(shows)
 
 
 class WarwickArtsCentreFetcher(Fetcher):
@@ -726,110 +857,76 @@ class WarwickArtsCentreFetcher(Fetcher):
     url = "https://www.warwickartscentre.co.uk/whats-on/list"
     active = True
 
-    def fetch(self):
-        start_idx = 0
-
-        def fix_date_text(txt):
-            """Given a date text, strip out any unrequired terms
-            """
-            repeated_days = {
-                "Mondays",
-                "Tuesdays",
-                "Wednesdays",
-                "Thursdays",
-                "Fridays",
-                "Saturdays",
-                "Sundays",
-            }
-            words = [w.strip() for w in txt.split()]
-            words = [
-                w
-                for w in words
-                if "pm" not in w
-                and "am" not in w
-                and w != "from"
-                and w not in repeated_days
-            ]
-            newstr = (
-                " ".join(words)
-                .split(",")[0]
-                .rstrip("-")
-                .split("(")[0]
-                .replace("–", "-")
-                .rstrip("&")
-            )
+    @staticmethod
+    def fix_date_text(txt):
+        """Given a date text, strip out any unrequired terms
+        """
+        repeated_days = {
+            "Mondays",
+            "Tuesdays",
+            "Wednesdays",
+            "Thursdays",
+            "Fridays",
+            "Saturdays",
+            "Sundays",
+        }
+        words = [w.strip() for w in txt.split()]
+        words = [
+            w
+            for w in words
+            if "pm" not in w
+            and "am" not in w
+            and w != "from"
+            and w not in repeated_days
+        ]
+        newstr = (
+            " ".join(words)
+            .split(",")[0]
+            .rstrip("-")
+            .split("(")[0]
+            .replace("–", "-")
+            .rstrip("&")
+        )
+
+        return newstr.strip()
+
+    def start_url(self):
+        return self.url + "?" + urlencode({"start": 0})
+
+    def parse(self, html, url, rendered=False):
+        soup = _soup(html)
+
+        container = soup.find("div", class_="area-production-list")
+        events = container.find_all("article", class_="unit-production-entry")
+
+        if not events:
+            LOG.debug("reached end of pages")
+            return Page([])
+
+        shows = []
+        for event in events:
 
-            return newstr.strip()
-
-        while True:
-
-            params = urlencode({"start": start_idx})
-            url = self.url + "?" + params
-
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-
-            container = soup.find("div", class_="area-production-list")
-            events = container.find_all("article", class_="unit-production-entry")
-
-            if not events:
-                LOG.debug("reached end of pages")
-                break
-
-            for event in events:
-
-                image_tag = event.find("a", class_="media")
-                link_url = "".join([self.root_url, image_tag.attrs["href"]])
-                image_url = image_tag.find("img").attrs["src"]
-
-                title = event.find("div", class_="body").find("h2").text
-
-                date_text = event.find("p", class_="date").text.strip()
-                LOG.debug(date_text)
-                date_text = fix_date_text(date_text)
-
-                try:
-                    if "-" in date_text:
-                        parts = [p.strip() for p in date_text.split("-")]
-                        end_date = datetime.datetime.strptime(
-                            parts[1], "%a %d %b %Y"
-                        ).date()
-                        try:
-                            start_date = datetime.datetime.strptime(
-                                f"{parts[0]} {end_date.year}", "%a %d %b %Y"
-                            ).date()
-                        except ValueError as exc:
-                            if "does not match format" in str(exc):
-                                start_date = datetime.datetime.strptime(
-                                    f"{parts[0]} {end_date.month} {end_date.year}",
-                                    "%a %d %m %Y",
-                                ).date()
-
-                    else:
-                        try:
-                            start_date = datetime.datetime.strptime(
-                                date_text, "%a %d %b %Y"
-                            ).date()
-                        except ValueError as exc:
-                            if "does not match format" in str(exc):
-                                start_date = datetime.datetime.strptime(
-                                    f"{date_text} {CURRENT_YEAR}", "%a %d %b %Y"
-                                ).date()
-
-                        end_date = start_date
-
-                    yield {
-                        "title": title,
-                        "image_url": image_url,
-                        "link_url": link_url,
-                        "start_date": start_date,
-                        "end_date": end_date,
-                    }
-                except ValueError:
-                    LOG.warning("cannot parse date text %s", date_text)
-                    continue
-
-            start_idx += 10
+            image_tag = event.find("a", class_="media")
+            link_url = image_tag.attrs["href"]
+            image_url = image_tag.find("img").attrs["src"]
+
+            title = event.find("div", class_="body").find("h2").text
+
+            date_text = event.find("p", class_="date").text.strip()
+            LOG.debug(date_text)
+            date_text = self.fix_date_text(date_text)
+
+            try:
+                start_date, end_date = parse_date_range(date_text, year=current_year())
+            except ValueError:
+                LOG.warning("%s: cannot parse date text %s", self.name, date_text)
+                continue
+
+            show = self.make_show(title, image_url, link_url, start_date, end_date)
+            if show is not None:
+                shows.append(show)
+
+        return Page(shows, next_url=_increment_query(url, "start", 10))
 
 
 def load_config(fptr):
@@ -848,6 +945,170 @@ def load_config(fptr):
         }
 
 
+def run_ingest(
+    fetcher_classes, args, sink, executor=None, profiler=None, metrics=None
+):  # pylint: disable=too-many-arguments
+    """Run the fetchers through the ingest pipeline into the sink, then apply
+    the changes each made and record the results"""
+    known_shows = {}
+    if args.incremental > 0:
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            hours=args.full_crawl_hours
+        )
+        for fetcher_cls in fetcher_classes:
+            known = sink.known_shows(fetcher_cls.name, since)
+            if known is not None:
+                known_shows[fetcher_cls.name] = known
+        LOG.info("incremental crawl of %d theatres", len(known_shows))
+
+    run_id = sink.start_run()
+    pipeline = Pipeline(
+        functools.partial(sink.write_batch, run_id),
+        fetch_workers=args.fetch_workers,
+        parse_workers=max(args.parse_workers, 1),
+        executor=executor,
+        batch_size=args.batch_size,
+        venue_timeout=args.venue_timeout,
+        profiler=profiler,
+        known_shows=known_shows,
+        known_pages=args.incremental,
+    )
+    results = pipeline.run(fetcher_classes)
+
+    changes = {}
+    for result in results:
+        try:
+            # Shows on the pages an incremental crawl skipped are not removed
+            changes[result.theatre] = sink.apply_changes(
+                run_id, result.theatre, remove=result.succeeded and result.complete
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.exception("applying changes for %s failed", result.theatre)
+            result.errors.append(f"{type(exc).__name__}: {exc}")
+
+    sink.finish_run(run_id, results, changes)
+    if metrics is not None:
+        try:
+            metrics.record(run_id, results, changes)
+        except OSError:
+            LOG.exception("writing metrics failed")
+
+    for result in results:
+        if result.succeeded:
+            LOG.info(
+                "%s: %d shows from %d pages in %.1fs",
+                result.theatre,
+                result.shows,
+                result.pages_fetched,
+                result.duration,
+            )
+            if changes.get(result.theatre) is not None:
+                LOG.info(
+                    "%s: %d added, %d changed, %d removed",
+                    result.theatre,
+                    *changes[result.theatre],
+                )
+        else:
+            LOG.warning(
+                "%s: failed after %d shows: %s",
+                result.theatre,
+                result.shows,
+                "; ".join(result.errors),
+            )
+    LOG.info("ingest run %d complete", run_id)
+
+    # The rest only applies to the shows table the webapp serves
+    if not sink.database:
+        return results
+
+    try:
+        LOG.info("found %d shows at more than one theatre", group_duplicates())
+    except Exception:  # pylint: disable=broad-except
+        LOG.exception("grouping duplicate shows failed")
+
+    if not args.skip_images:
+        for result in results:
+            try:
+                cached = cache_images(result.theatre)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("caching images for %s failed", result.theatre)
+                continue
+            LOG.info("%s: cached %d images", result.theatre, cached)
+
+    if args.details:
+        try:
+            stored = enrich_shows(run_id, [result.theatre for result in results])
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("fetching show details failed")
+        else:
+            LOG.info("stored the details of %d shows", stored)
+
+    return results
+
+
+def run_archive(args):
+    """Move the shows which have ended out of the live shows table"""
+    archived = archive_shows(DB, args.retention_days)
+    LOG.info("archived %d shows", archived)
+
+
+# Scheduled in the daemon alongside the fetchers
+ARCHIVE_JOB = "archive"
+
+
+def run_daemon(
+    fetcher_classes, args, sink, executor=None, profiler=None, metrics=None
+):  # pylint: disable=too-many-arguments
+    """Keep running each fetcher on its own interval until stopped by a signal"""
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):  # pylint: disable=unused-argument
+        LOG.warning("received signal %d, stopping after the running jobs", signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    def run_job(job):
+        if job is ARCHIVE_JOB:
+            run_archive(args)
+        else:
+            run_ingest([job], args, sink, executor, profiler, metrics)
+
+    scheduler = Scheduler(run_job, max_jobs=args.max_jobs, jitter=args.jitter)
+    for fetcher_cls in fetcher_classes:
+        scheduler.add(fetcher_cls, fetcher_cls.interval * args.interval_scale)
+    if sink.database and args.retention_days >= 0:
+        scheduler.add(ARCHIVE_JOB, DAILY * args.interval_scale)
+
+    scheduler.run(stop)
+
+
+def select_fetchers(names=None):
+    """The fetcher classes to run: those named, matched case insensitively by
+    venue or class name, or otherwise all of the active ones"""
+    if not names:
+        return sorted(
+            (fetcher_cls for fetcher_cls in Fetcher.fetchers if fetcher_cls.active),
+            key=lambda fetcher_cls: fetcher_cls.name,
+        )
+
+    by_name = {}
+    for fetcher_cls in Fetcher.fetchers:
+        by_name[fetcher_cls.name.lower()] = fetcher_cls
+        by_name[fetcher_cls.__name__.lower()] = fetcher_cls
+
+    selected = []
+    for name in names:
+        fetcher_cls = by_name.get(name.lower())
+        if fetcher_cls is None:
+            known = ", ".join(sorted(f.name for f in Fetcher.fetchers))
+            raise ValueError(f"unknown venue {name!r}, expected one of: {known}")
+        if fetcher_cls not in selected:
+            selected.append(fetcher_cls)
+    return selected
+
+
 def main():
     """The entrypoint, called by `whatson-ingest`"""
     logging.basicConfig(level=logging.INFO)
@@ -863,22 +1124,261 @@ def main():
         help="Clear database contents before ingesting",
     )
     parser.add_argument("-v", "--verbose", action="store_true", default=False)
+    parser.add_argument(
+        "--sink",
+        default="postgres",
+        help="Where to write the shows: postgres (the default, using "
+        "$DATABASE_URL), sqlite:PATH or jsonl:PATH, with - for standard output",
+    )
+    parser.add_argument(
+        "--venue",
+        metavar="NAME",
+        action="append",
+        help="Only ingest this venue, even if it is not active. May be repeated.",
+    )
+    parser.add_argument(
+        "--browsers",
+        type=int,
+        default=BROWSERS.size,
+        help="Maximum number of headless browsers to run at once",
+    )
+    parser.add_argument(
+        "--browser-max-pages",
+        type=int,
+        default=BROWSERS.max_pages,
+        help="Restart each headless browser after this many pages",
+    )
+    parser.add_argument(
+        "--page-load-timeout",
+        type=float,
+        default=BROWSERS.page_load_timeout,
+        help="Seconds to wait for a page to load in a headless browser",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=HTTP_OPTIONS["timeout"],
+        help="Seconds to wait for each HTTP request",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=HTTP_OPTIONS["retries"],
+        help="Number of times to retry a failed HTTP request",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=HTTP_OPTIONS["rate"],
+        help="Maximum HTTP requests per second to each host",
+    )
+    parser.add_argument(
+        "--fetch-workers",
+        type=int,
+        default=4,
+        help="Number of listing pages to download at once",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        help="Number of processes to parse pages in, or 0 to parse in-process",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Number of shows to write to the database at once",
+    )
+    parser.add_argument(
+        "--venue-timeout",
+        type=float,
+        default=600,
+        help="Seconds each theatre is allowed before it is abandoned",
+    )
+    parser.add_argument(
+        "--incremental",
+        metavar="PAGES",
+        type=int,
+        default=0,
+        help="Stop paginating a theatre after this many pages in a row of shows "
+        "which are already stored, or 0 to always crawl every page",
+    )
+    parser.add_argument(
+        "--full-crawl-hours",
+        type=float,
+        default=24,
+        help="With --incremental, crawl every page of a theatre if it has not "
+        "been fully crawled for this many hours",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help="Keep running, refreshing each theatre on its own schedule",
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=int,
+        default=2,
+        help="Maximum number of theatres the daemon refreshes at once",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.1,
+        help="Fraction by which the daemon varies each refresh interval",
+    )
+    parser.add_argument(
+        "--interval-scale",
+        type=float,
+        default=1.0,
+        help="Multiply every theatre's refresh interval by this factor",
+    )
+    parser.add_argument(
+        "--retention-days",
+        type=int,
+        default=0,
+        help="Archive shows this many days after they end, or -1 to never archive",
+    )
+    parser.add_argument(
+        "--image-dir",
+        default=IMAGES.directory,
+        help="Directory to store the show image thumbnails in",
+    )
+    parser.add_argument(
+        "--image-cache-mb",
+        type=int,
+        default=IMAGES.max_bytes // (1024 * 1024),
+        help="Size in megabytes beyond which the oldest thumbnails are removed",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile each theatre and the database uploads, writing the results "
+        "to DIR",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        default=False,
+        help="Also record allocation sites with tracemalloc when profiling",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        metavar="PATH",
+        help="Write per-theatre metrics to PATH for the node exporter's textfile "
+        "collector",
+    )
+    parser.add_argument(
+        "--metrics-jsonl",
+        metavar="PATH",
+        help="Append per-theatre metrics of each run to PATH as JSON lines",
+    )
+    parser.add_argument(
+        "--skip-images",
+        action="store_true",
+        default=False,
+        help="Do not download the show images",
+    )
+    parser.add_argument(
+        "--details",
+        action="store_true",
+        default=False,
+        help="Fetch each show's own page for its description, performances and "
+        "prices",
+    )
+    parser.add_argument(
+        "--details-dir",
+        default=DETAILS.cache.directory,
+        help="Directory to cache the show pages in",
+    )
+    parser.add_argument(
+        "--details-workers",
+        type=int,
+        default=DETAILS.workers,
+        help="Number of show pages to fetch at once",
+    )
+    parser.add_argument(
+        "--details-per-host",
+        type=int,
+        default=DETAILS.per_host,
+        help="Number of show pages to fetch at once from each site",
+    )
+    parser.add_argument(
+        "--details-max-age-hours",
+        type=float,
+        default=DETAILS.max_age / 3600,
+        help="Hours before an unchanged show's page is checked again",
+    )
     args = parser.parse_args()
 
     if args.verbose:
         LOG.setLevel(logging.INFO)
 
-    if args.reset:
-        reset_database(DB)
+    try:
+        fetcher_classes = select_fetchers(args.venue)
+    except ValueError as exc:
+        parser.error(str(exc))
 
-    # Run the ingestion
+    HTTP_OPTIONS.update(timeout=args.timeout, retries=args.retries, rate=args.rate)
 
-    for fetcher_cls in Fetcher.fetchers:
-        LOG.info("fetching using %s", fetcher_cls.name)
-        if fetcher_cls.active is False:
-            continue
+    BROWSERS.size = args.browsers
+    BROWSERS.max_pages = args.browser_max_pages
+    BROWSERS.page_load_timeout = args.page_load_timeout
+
+    IMAGES.directory = args.image_dir
+    IMAGES.max_bytes = args.image_cache_mb * 1024 * 1024
+
+    if args.details:
+        DETAILS.client = http_client()
+        DETAILS.cache.directory = args.details_dir
+        DETAILS.workers = args.details_workers
+        DETAILS.per_host = args.details_per_host
+        DETAILS.max_age = args.details_max_age_hours * 3600
+
+    try:
+        sink = create_sink(args.sink)
+    except (ValueError, OSError) as exc:
+        parser.error(str(exc))
+    sink.prepare(reset=args.reset)
+
+    # Run the ingestion
 
-        fetcher = fetcher_cls()
-        shows = fetcher.fetch()
-        for show in shows:
-            upload(fetcher.name, show)
+    executor = None
+    if args.parse_workers > 0:
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        # The workers are started on demand by the pipeline's threads, which
+        # forking would copy mid-flight along with any locks they hold
+        executor = ProcessPoolExecutor(
+            max_workers=args.parse_workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+
+    profiler = None
+    if args.profile:
+        from .profiling import Profiler  # pylint: disable=import-outside-toplevel
+
+        profiler = Profiler(args.profile, memory=args.profile_memory)
+
+    metrics = None
+    if args.metrics_textfile or args.metrics_jsonl:
+        metrics = MetricsWriter(args.metrics_textfile, args.metrics_jsonl)
+
+    try:
+        if args.daemon:
+            run_daemon(fetcher_classes, args, sink, executor, profiler, metrics)
+        else:
+            run_ingest(fetcher_classes, args, sink, executor, profiler, metrics)
+            if sink.database and args.retention_days >= 0:
+                run_archive(args)
+    finally:
+        sink.close()
+        BROWSERS.close()
+        if executor is not None:
+            executor.shutdown()
+        if profiler is not None:
+            profiler.write()
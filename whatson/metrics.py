@@ -0,0 +1,159 @@
+"""
+Whatson metrics
+
+Machine readable metrics of each ingest run, per venue: pages fetched, bytes
+downloaded, a histogram of page download times, parse time, shows found,
+rows added, changed, left unchanged and removed, and failures. They can be
+written as
+
+* a Prometheus node exporter textfile, holding the latest run of each venue,
+  so scrape times can be graphed and alerted on
+* JSON lines, appending one object per venue per run, for later analysis
+"""
+
+import bisect
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+
+LOG = logging.getLogger("whatson.metrics")
+
+PREFIX = "whatson_ingest"
+
+# Upper bounds in seconds of the download time histogram buckets
+DOWNLOAD_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Name, help text and type of each per venue metric
+METRICS = [
+    ("last_run_timestamp_seconds", "When the venue was last ingested", "gauge"),
+    ("duration_seconds", "Time taken to ingest the venue", "gauge"),
+    ("succeeded", "Whether the last ingest of the venue succeeded", "gauge"),
+    ("failures", "Errors in the last ingest of the venue", "gauge"),
+    ("pages_fetched", "Listing pages fetched", "gauge"),
+    ("bytes_downloaded", "Bytes of listing pages downloaded", "gauge"),
+    ("parse_seconds", "Time spent parsing listing pages", "gauge"),
+    ("shows", "Shows found in the listings", "gauge"),
+    ("rows_added", "Shows added to the database", "gauge"),
+    ("rows_changed", "Shows updated in the database", "gauge"),
+    ("rows_unchanged", "Shows found which were already up to date", "gauge"),
+    ("rows_removed", "Shows removed as they are no longer listed", "gauge"),
+]
+
+
+def venue_metrics(run_id, result, changes=None, timestamp=None):
+    """The metrics of one venue's `VenueResult` and its `(added, changed,
+    removed)` row counts, as a dict"""
+    added, changed, removed = changes or (0, 0, 0)
+    if timestamp is None:
+        timestamp = datetime.datetime.now(datetime.timezone.utc).timestamp()
+
+    buckets = [0] * len(DOWNLOAD_BUCKETS)
+    for seconds in result.download_seconds:
+        index = bisect.bisect_left(DOWNLOAD_BUCKETS, seconds)
+        if index < len(buckets):
+            buckets[index] += 1
+
+    return {
+        "run_id": run_id,
+        "venue": result.theatre,
+        "last_run_timestamp_seconds": timestamp,
+        "duration_seconds": result.duration,
+        "succeeded": int(result.succeeded),
+        "failures": len(result.errors),
+        "pages_fetched": result.pages_fetched,
+        "bytes_downloaded": result.bytes_downloaded,
+        "parse_seconds": result.parse_seconds,
+        "shows": result.shows,
+        "rows_added": added,
+        "rows_changed": changed,
+        "rows_unchanged": max(result.shows - added - changed, 0),
+        "rows_removed": removed,
+        "download_seconds": {
+            "buckets": dict(zip(DOWNLOAD_BUCKETS, buckets)),
+            "count": len(result.download_seconds),
+            "sum": sum(result.download_seconds),
+        },
+        "errors": result.errors,
+    }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_textfile(venues):
+    """Format the metrics of each venue in the Prometheus text format"""
+    lines = []
+    for name, help_text, metric_type in METRICS:
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {metric_type}")
+        for metrics in venues:
+            lines.append(
+                f'{PREFIX}_{name}{{venue="{_label(metrics["venue"])}"}} '
+                f"{metrics[name]}"
+            )
+
+    name = f"{PREFIX}_download_seconds"
+    lines.append(f"# HELP {name} Time taken to download each listing page")
+    lines.append(f"# TYPE {name} histogram")
+    for metrics in venues:
+        venue = _label(metrics["venue"])
+        histogram = metrics["download_seconds"]
+        cumulative = 0
+        for bound, count in histogram["buckets"].items():
+            cumulative += count
+            lines.append(f'{name}_bucket{{venue="{venue}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{venue="{venue}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{venue="{venue}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{venue="{venue}"}} {histogram["count"]}')
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsWriter:
+    """Writes the metrics of each ingest run to a node exporter `textfile`
+    and/or appends them to a `jsonl` file. The textfile always holds the
+    latest metrics of every venue seen, as the daemon runs venues
+    separately."""
+
+    def __init__(self, textfile=None, jsonl=None):
+        self.textfile = textfile
+        self.jsonl = jsonl
+
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def record(self, run_id, results, changes):
+        """Record the `VenueResult`s of a run, with the row changes of each
+        venue keyed by name"""
+        venues = [
+            venue_metrics(run_id, result, changes.get(result.theatre))
+            for result in results
+        ]
+
+        with self._lock:
+            if self.jsonl:
+                with open(self.jsonl, "a") as outfile:
+                    for metrics in venues:
+                        outfile.write(json.dumps(metrics, default=str) + "\n")
+
+            if self.textfile:
+                self._latest.update((metrics["venue"], metrics) for metrics in venues)
+                self._write_textfile(
+                    format_textfile(
+                        [self._latest[name] for name in sorted(self._latest)]
+                    )
+                )
+
+    def _write_textfile(self, text):
+        # The node exporter may read the file at any time, so replace it
+        # atomically rather than writing it in place
+        directory = os.path.dirname(os.path.abspath(self.textfile))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as outfile:
+            outfile.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.textfile)
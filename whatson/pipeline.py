@@ -0,0 +1,408 @@
+"""
+Whatson ingest pipeline
+
+Runs the fetchers as a staged pipeline so that downloading, parsing and
+database writes overlap:
+
+* fetch workers download listing pages onto a bounded page queue
+* parse workers turn each page into shows, placing them on a bounded show
+  queue, and schedule the next page of the listing
+* a single writer stores the shows in batches, flushed by size or time
+
+The bounded queues apply backpressure: a slow stage blocks the stage before
+it, so memory use stays flat however many venues or pages there are. Each
+venue has at most one page in flight, as its next page is only known once
+the current one has been parsed.
+
+Parsing is CPU bound, so it can optionally be run in a pool of worker
+processes to use more than one core. Only the raw HTML is sent to the
+workers, and the shows are sent back as compact `Show` tuples.
+
+Fetchers may stream their pages, in which case the download only returns
+once the response headers arrive and the body is read by the parse worker as
+it parses, so a large page is never held in memory as a whole. Streamed pages
+are read in full before being sent to a worker process, and if the body
+fails to download the fetcher parses the failure in the parse worker, as it
+would without a pool.
+"""
+
+from collections.abc import Iterator
+import contextlib
+import logging
+import queue
+import threading
+import time
+from typing import List, NamedTuple, Sequence
+
+LOG = logging.getLogger("whatson.pipeline")
+
+# Marks the end of the work on a queue
+STOP = object()
+
+# Fetchers created in a parse worker process, reused between pages
+_WORKER_FETCHERS = {}
+
+
+def _parse_in_worker(fetcher_cls, html, url, rendered):
+    """Parse a page in a worker process"""
+    fetcher = _WORKER_FETCHERS.get(fetcher_cls)
+    if fetcher is None:
+        fetcher = _WORKER_FETCHERS[fetcher_cls] = fetcher_cls()
+    return fetcher.parse(html, url, rendered)
+
+
+def _failed(exc):
+    """A streamed page whose download failed with `exc`"""
+    raise exc
+    yield  # pylint: disable=unreachable
+
+
+def _counted(venue, chunks):
+    """Count the bytes of a streamed page as they are read"""
+    for chunk in chunks:
+        venue.bytes_downloaded += len(chunk)
+        yield chunk
+
+
+class VenueResult(NamedTuple):
+    """The outcome of running a single fetcher"""
+
+    theatre: str
+    shows: int
+    pages_fetched: int
+    duration: float
+    errors: List[str]
+    bytes_downloaded: int = 0
+    download_seconds: Sequence[float] = ()
+    parse_seconds: float = 0.0
+    # False if the crawl stopped early as it only found known shows
+    complete: bool = True
+
+    @property
+    def succeeded(self):
+        return not self.errors
+
+
+class StageStats:
+    """Counts the items processed by one stage, the time spent processing
+    them and the deepest its input queue has been"""
+
+    def __init__(self, name, queue_size=0):
+        self.name = name
+        self.queue_size = queue_size
+        self.items = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def sample_depth(self, depth):
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+
+    @property
+    def throughput(self):
+        """Items processed per second of work"""
+        return self.items / self.busy if self.busy else 0.0
+
+    def __str__(self):
+        depth = f"{self.max_depth}/{self.queue_size}" if self.queue_size else "-"
+        return (
+            f"{self.name}: {self.items} items in {self.busy:.2f}s busy "
+            f"({self.throughput:.1f}/s), max queue depth {depth}"
+        )
+
+
+class _Venue:
+    """Progress of a single fetcher through the pipeline"""
+
+    def __init__(self, fetcher_cls):
+        self.fetcher_cls = fetcher_cls
+        self.fetcher = None
+        self.shows = 0
+        self.errors = []
+        self.bytes_downloaded = 0
+        self.download_seconds = []
+        self.parse_seconds = 0.0
+        self.known_pages = 0
+        self.complete = True
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def name(self):
+        return self.fetcher_cls.name
+
+    def result(self):
+        return VenueResult(
+            theatre=self.name,
+            shows=self.shows,
+            pages_fetched=self.fetcher.pages_fetched if self.fetcher else 0,
+            duration=(self.finished or time.monotonic()) - self.started,
+            errors=self.errors,
+            bytes_downloaded=self.bytes_downloaded,
+            download_seconds=self.download_seconds,
+            parse_seconds=self.parse_seconds,
+            complete=self.complete,
+        )
+
+
+class Pipeline:
+    """Runs fetchers through the fetch, parse and write stages.
+
+    `write_batch` is called from the writer thread with a list of
+    `(theatre, show)` tuples. If a process pool `executor` is given, the
+    `parse_workers` send pages to it to be parsed rather than parsing them
+    in their own thread. The pool is not shut down, so it can be reused.
+
+    If a `whatson.profiling.Profiler` is given, each venue's downloads and
+    parsing are profiled under the venue's name, and the writes as "upload".
+
+    For an incremental crawl, `known_shows` maps venue names to the set of
+    `(title, start_date)` of the shows already stored. A venue with known
+    shows stops paginating once `known_pages` pages in a row contain nothing
+    new, and its result is marked as incomplete.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(
+        self,
+        write_batch,
+        fetch_workers=4,
+        parse_workers=1,
+        executor=None,
+        page_queue_size=8,
+        show_queue_size=256,
+        batch_size=100,
+        flush_interval=1.0,
+        venue_timeout=None,
+        profiler=None,
+        known_shows=None,
+        known_pages=2,
+    ):
+        self.write_batch = write_batch
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.executor = executor
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.venue_timeout = venue_timeout
+        self.profiler = profiler
+        self.known_shows = known_shows or {}
+        self.known_pages = known_pages
+
+        self._jobs = queue.Queue()
+        self._pages = queue.Queue(maxsize=page_queue_size)
+        self._shows = queue.Queue(maxsize=show_queue_size)
+
+        self.stats = {
+            "fetch": StageStats("fetch"),
+            "parse": StageStats("parse", page_queue_size),
+            "write": StageStats("write", show_queue_size),
+        }
+
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def _profiled(self, name):
+        if self.profiler is None:
+            return contextlib.ExitStack()
+        return self.profiler.profile(name)
+
+    def _finish(self, venue, exc=None):
+        """Mark a venue as complete, stopping the fetch workers after the last"""
+        if exc is not None:
+            LOG.error("fetching from %s failed: %r", venue.name, exc)
+            venue.errors.append(f"{type(exc).__name__}: {exc}")
+        venue.finished = time.monotonic()
+
+        with self._lock:
+            self._active -= 1
+            last = self._active == 0
+
+        if last:
+            for _ in range(self.fetch_workers):
+                self._jobs.put(STOP)
+
+    def _fetch_worker(self):
+        stats = self.stats["fetch"]
+        while True:
+            job = self._jobs.get()
+            if job is STOP:
+                return
+
+            venue, url, rendered = job
+            start = time.monotonic()
+            try:
+                with self._profiled(venue.name):
+                    html = venue.fetcher.download(url, rendered)
+            except Exception as exc:  # pylint: disable=broad-except
+                self._finish(venue, exc)
+                continue
+            finally:
+                stats.record(1, time.monotonic() - start)
+
+            venue.download_seconds.append(time.monotonic() - start)
+            if isinstance(html, str):
+                venue.bytes_downloaded += len(html.encode())
+            elif isinstance(html, Iterator):
+                html = _counted(venue, html)
+            self._pages.put((venue, url, rendered, html))
+            self.stats["parse"].sample_depth(self._pages.qsize())
+
+    def _parse(self, venue, html, url, rendered):
+        if self.executor is None:
+            return venue.fetcher.parse(html, url, rendered)
+
+        if isinstance(html, Iterator):
+            try:
+                html = b"".join(html)
+            except Exception as exc:  # pylint: disable=broad-except
+                # Let the fetcher handle the failure as it would while reading
+                # the stream itself, such as by falling back to a browser
+                return venue.fetcher.parse(_failed(exc), url, rendered)
+        future = self.executor.submit(
+            _parse_in_worker, venue.fetcher_cls, html, url, rendered
+        )
+        return future.result()
+
+    def _only_known(self, venue, shows):
+        known = self.known_shows.get(venue.name)
+        if known is None or not shows:
+            return False
+        return all((show.title, show.start_date) in known for show in shows)
+
+    def _parse_worker(self):
+        stats = self.stats["parse"]
+        while True:
+            item = self._pages.get()
+            if item is STOP:
+                return
+
+            venue, url, rendered, html = item
+            start = time.monotonic()
+            try:
+                with self._profiled(venue.name):
+                    page = self._parse(venue, html, url, rendered)
+                venue.fetcher.check_deadline()
+            except Exception as exc:  # pylint: disable=broad-except
+                self._finish(venue, exc)
+                continue
+            finally:
+                stats.record(1, time.monotonic() - start)
+                venue.parse_seconds += time.monotonic() - start
+            del html
+
+            for show in page.shows:
+                self._shows.put((venue, show))
+                venue.shows += 1
+            self.stats["write"].sample_depth(self._shows.qsize())
+
+            if self._only_known(venue, page.shows):
+                venue.known_pages += 1
+            else:
+                venue.known_pages = 0
+
+            if page.next_url is None:
+                self._finish(venue)
+            elif venue.known_pages and venue.known_pages >= self.known_pages:
+                LOG.info(
+                    "%s: stopping after %d pages of known shows",
+                    venue.name,
+                    venue.known_pages,
+                )
+                venue.complete = False
+                self._finish(venue)
+            else:
+                self._jobs.put((venue, page.next_url, page.next_rendered))
+
+    def _flush(self, batch):
+        start = time.monotonic()
+        try:
+            with self._profiled("upload"):
+                self.write_batch([(venue.name, show) for venue, show in batch])
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.exception("writing %d shows failed", len(batch))
+            for venue in {venue for venue, _ in batch}:
+                venue.errors.append(f"{type(exc).__name__}: {exc}")
+        finally:
+            self.stats["write"].record(len(batch), time.monotonic() - start)
+
+    def _writer(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._shows.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is STOP:
+                break
+
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    self._flush(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+        if batch:
+            self._flush(batch)
+
+    def run(self, fetcher_classes):
+        """Run the fetchers to completion, returning a `VenueResult` for each"""
+        venues = [_Venue(fetcher_cls) for fetcher_cls in fetcher_classes]
+        if not venues:
+            return []
+
+        for venue in venues:
+            try:
+                venue.fetcher = venue.fetcher_cls()
+            except Exception as exc:  # pylint: disable=broad-except
+                venue.errors.append(f"{type(exc).__name__}: {exc}")
+                venue.finished = venue.started
+                continue
+
+            if self.venue_timeout is not None:
+                venue.fetcher.deadline = venue.started + self.venue_timeout
+
+            self._active += 1
+            self._jobs.put((venue, venue.fetcher.start_url(), venue.fetcher.rendered))
+
+        if self._active == 0:
+            return [venue.result() for venue in venues]
+
+        def start(target, count):
+            threads = [
+                threading.Thread(target=target, daemon=True) for _ in range(count)
+            ]
+            for thread in threads:
+                thread.start()
+            return threads
+
+        fetchers = start(self._fetch_worker, self.fetch_workers)
+        parsers = start(self._parse_worker, self.parse_workers)
+        writers = start(self._writer, 1)
+
+        # Shut the stages down in order once all venues have finished
+        for thread in fetchers:
+            thread.join()
+        for _ in parsers:
+            self._pages.put(STOP)
+        for thread in parsers:
+            thread.join()
+        self._shows.put(STOP)
+        for thread in writers:
+            thread.join()
+
+        for stats in self.stats.values():
+            LOG.info("%s", stats)
+
+        return [venue.result() for venue in venues]
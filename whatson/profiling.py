@@ -0,0 +1,129 @@
+"""
+Whatson profiling
+
+Optional CPU and memory profiling of an ingest run, enabled with
+`whatson-ingest --profile DIR`. Each named section (a venue's downloads and
+parsing, or the database uploads) is profiled with `cProfile`, and
+optionally `tracemalloc`, and the results are written to `DIR`:
+
+* `<name>.prof`, a `pstats` file per section for e.g. `snakeviz`
+* `<name>.memory.txt`, the top allocation sites per section
+* `summary.txt`, the hottest functions and allocation sites of each section
+
+Memory is measured as the difference between snapshots taken before and
+after each profiled block, so allocations made by other threads at the same
+time are included. Run with one fetch and parse worker to isolate them.
+"""
+
+import collections
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import tracemalloc
+
+LOG = logging.getLogger("whatson.profiling")
+
+# Number of functions and allocation sites listed per section in the summary
+TOP = 15
+
+
+def _filename(name):
+    return re.sub(r"[^\w-]+", "_", name).strip("_").lower() or "section"
+
+
+class Profiler:
+    """Collects a profile per named section, written out by `write`"""
+
+    def __init__(self, directory, memory=False):
+        self.directory = directory
+        self.memory = memory
+
+        self._profiles = {}
+        self._section_locks = {}
+        self._allocations = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+        # From Python 3.12 only one profiler can be active at a time, so the
+        # profiled blocks have to take turns
+        self._serialise = threading.Lock() if sys.version_info >= (3, 12) else None
+
+        self._started_tracing = memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def _profile_for(self, name):
+        """The profile of a section, and the lock held while it is enabled"""
+        with self._lock:
+            if name not in self._profiles:
+                self._profiles[name] = cProfile.Profile()
+                self._section_locks[name] = threading.Lock()
+            return self._profiles[name], self._section_locks[name]
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        """Profile the block as part of the section `name`. Blocks for the same
+        section take turns, as a profile must not be enabled by two threads at
+        once, e.g. the uploads of the daemon's concurrent jobs."""
+        profile, section_lock = self._profile_for(name)
+        with section_lock, self._serialise or contextlib.ExitStack():
+            before = tracemalloc.take_snapshot() if self.memory else None
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                if before is not None:
+                    self._record_allocations(name, before)
+
+    def _record_allocations(self, name, before):
+        after = tracemalloc.take_snapshot()
+        sites = collections.Counter()
+        for diff in after.compare_to(before, "lineno"):
+            if diff.size_diff > 0:
+                frame = diff.traceback[0]
+                sites[f"{frame.filename}:{frame.lineno}"] += diff.size_diff
+        with self._lock:
+            self._allocations[name].update(sites)
+
+    def write(self):
+        """Write the profiles and summary to the directory, and stop tracing
+        memory allocations"""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        summary = io.StringIO()
+        for name, profile in sorted(self._profiles.items()):
+            filename = _filename(name)
+            profile.dump_stats(os.path.join(self.directory, f"{filename}.prof"))
+
+            stats = pstats.Stats(profile, stream=summary)
+            summary.write(f"== {name}: {stats.total_tt:.3f}s profiled ==\n")
+            stats.sort_stats("tottime").print_stats(TOP)
+
+            allocations = self._allocations.get(name)
+            if allocations:
+                with open(
+                    os.path.join(self.directory, f"{filename}.memory.txt"), "w"
+                ) as outfile:
+                    for site, size in allocations.most_common():
+                        outfile.write(f"{size:>12} {site}\n")
+
+                summary.write("Top allocation sites:\n")
+                for site, size in allocations.most_common(TOP):
+                    summary.write(f"{size / 1024:>12.1f} KiB {site}\n")
+                summary.write("\n")
+
+        with open(os.path.join(self.directory, "summary.txt"), "w") as outfile:
+            outfile.write(summary.getvalue())
+
+        LOG.warning(
+            "wrote profiles of %d sections to %s", len(self._profiles), self.directory
+        )
@@ -0,0 +1,84 @@
+"""
+Whatson scheduler
+
+Runs each venue on its own interval for `whatson-ingest --daemon`, so busy
+box offices can be refreshed more often than quiet venues while the HTTP
+sessions, browsers and database connections stay warm between runs.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+LOG = logging.getLogger("whatson.scheduler")
+
+
+class Scheduler:
+    """Calls `run_job(job)` for each added job every `interval` seconds.
+
+    Each interval is varied by up to `jitter` (as a fraction of the interval)
+    so venues drift apart rather than all running at once, no more than
+    `max_jobs` jobs run concurrently and a job is never run twice at once.
+    """
+
+    def __init__(self, run_job, max_jobs=2, jitter=0.1, clock=time.monotonic):
+        self.run_job = run_job
+        self.max_jobs = max_jobs
+        self.jitter = jitter
+        self.clock = clock
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_jobs)
+        self._wakeup = threading.Event()
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _push(self, due, job, interval):
+        with self._lock:
+            heapq.heappush(self._queue, (due, next(self._counter), job, interval))
+        self._wakeup.set()
+
+    def add(self, job, interval):
+        """Schedule `job` every `interval` seconds, with the first run spread
+        over the jitter window"""
+        first = self.clock() + random.uniform(0, self.jitter * interval)
+        self._push(first, job, interval)
+
+    def _run(self, job, interval):
+        try:
+            self.run_job(job)
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("scheduled job %s failed", job)
+        finally:
+            self._slots.release()
+            self._push(self.clock() + self._jittered(interval), job, interval)
+
+    def run(self, stop):
+        """Run jobs as they fall due until the `stop` event is set, then wait
+        for the running jobs to finish"""
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            while not stop.is_set():
+                with self._lock:
+                    wait = self._queue[0][0] - self.clock() if self._queue else None
+
+                if wait is None or wait > 0:
+                    self._wakeup.clear()
+                    # Wake up regularly to check whether we have been stopped
+                    self._wakeup.wait(timeout=min(wait or 1.0, 1.0))
+                    continue
+
+                if not self._slots.acquire(timeout=1.0):
+                    continue
+
+                with self._lock:
+                    _, _, job, interval = heapq.heappop(self._queue)
+
+                LOG.info("running scheduled job %s", job)
+                executor.submit(self._run, job, interval)
@@ -0,0 +1,187 @@
+"""
+Whatson shows
+
+The `Show` record emitted by the fetchers, and presentation helpers shared by
+the WSGI (`whatson.webapp`) and ASGI (`whatson.asgi`) apps, so both serve the
+same API contract. Nothing here touches the database.
+"""
+
+import datetime
+from typing import NamedTuple
+from urllib.parse import urljoin, urlparse
+
+
+class InvalidShow(ValueError):
+    """Raised for a show which is missing data or is inconsistent"""
+
+
+def _absolute_url(url, base_url, title):
+    url = url.strip()
+    if base_url is not None:
+        url = urljoin(base_url, url)
+    parts = urlparse(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise InvalidShow(f"{title!r}: {url!r} is not an absolute url")
+    return url
+
+
+def _image_url(url, base_url):
+    """The absolute url of an image, or "" for a missing image or one which
+    cannot be fetched, such as a lazy loading `data:` placeholder"""
+    url = url.strip()
+    if base_url is not None and url:
+        url = urljoin(base_url, url)
+    parts = urlparse(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return ""
+    return url
+
+
+def _as_date(value, title):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if not isinstance(value, datetime.date):
+        raise InvalidShow(f"{title!r}: {value!r} is not a date")
+    return value
+
+
+class Show(NamedTuple):
+    """A show found in a theatre's listings.
+
+    The fields are in the order of the show columns of the staging table, so
+    a show is already the row written to the database. Fetchers create shows
+    with `Show.create`, which normalises and validates them.
+    """
+
+    title: str
+    image_url: str
+    link_url: str
+    start_date: datetime.date
+    end_date: datetime.date
+
+    @classmethod
+    def create(  # pylint: disable=too-many-arguments
+        cls, title, image_url, link_url, start_date, end_date=None, base_url=None
+    ):
+        """Create a show, collapsing the whitespace in its title and resolving
+        its urls against `base_url`. A show without an end date is on for a
+        single day. An image url which is not http(s) is dropped, as the
+        image is optional. Raises `InvalidShow` if the show has no title, its
+        link is not an absolute url or it ends before it starts."""
+        title = " ".join(title.split())
+        if not title:
+            raise InvalidShow("show has no title")
+
+        start_date = _as_date(start_date, title)
+        end_date = start_date if end_date is None else _as_date(end_date, title)
+        if end_date < start_date:
+            raise InvalidShow(f"{title!r}: ends on {end_date} before {start_date}")
+
+        return cls(
+            title,
+            _image_url(image_url or "", base_url),
+            _absolute_url(link_url, base_url, title),
+            start_date,
+            end_date,
+        )
+
+    def to_json(self):
+        """The show as a dict which can be serialised as JSON"""
+        return {
+            "title": self.title,
+            "image_url": self.image_url,
+            "link_url": self.link_url,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+        }
+
+
+# The columns the API needs from the shows table, in the order
+# `serialise_show` expects them
+SHOW_COLUMNS = (
+    "theatre",
+    "title",
+    "image_url",
+    "image_hash",
+    "link_url",
+    "start_date",
+    "end_date",
+)
+
+
+def image_path(image_hash):
+    """The path the webapp serves a cached thumbnail from"""
+    return f"/img/{image_hash}"
+
+
+def serialise_show(show):
+    """Turn a row of the `SHOW_COLUMNS` from the shows table into its API
+    representation. Images are served from the thumbnail cache if they have
+    been fetched, and from the theatre's site otherwise."""
+    theatre, title, image_url, image_hash, link_url, start_date, end_date = show
+    return {
+        "name": title,
+        "theatre": theatre,
+        "image_url": image_path(image_hash) if image_hash else image_url,
+        "link_url": link_url,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+    }
+
+
+def month_range(year, month):
+    """The first and last days of a month"""
+    first = datetime.date(year, month, 1)
+    if month == 12:
+        return first, datetime.date(year, 12, 31)
+    return first, datetime.date(year, month + 1, 1) - datetime.timedelta(days=1)
+
+
+def shows_request(body):
+    """The `(start_date, end_date, theatre)` asked for by the body of a
+    `/api/shows` request: a `year` and `month`, or a `start` and optional `end`
+    date, and optionally a `theatre` (None for every theatre)"""
+    if "start" in body:
+        start_date = datetime.date.fromisoformat(body["start"])
+        end_date = datetime.date.fromisoformat(body.get("end", body["start"]))
+    else:
+        start_date, end_date = month_range(int(body["year"]), int(body["month"]))
+    return start_date, end_date, body.get("theatre") or None
+
+
+def group_productions(rows):
+    """Turn rows of a group id followed by the `SHOW_COLUMNS`, ordered by
+    group, into the API representation of each production"""
+    productions = []
+    current_group = None
+    for group_id, *show in rows:
+        if group_id != current_group:
+            current_group = group_id
+            productions.append({"name": show[1], "shows": []})
+        productions[-1]["shows"].append(serialise_show(show))
+    return productions
+
+
+def interpolate_months(seen_months):
+    """Helper function to interpolate months that do not have a start or end
+    date, but are in the middle of a show run.
+    """
+    # Make sure to interpolate the in-between months
+    current = seen_months[0]
+    current_year, current_month = current["year"], current["month"]
+
+    end = seen_months[-1]
+
+    while True:
+        if current_year > end["year"]:
+            break
+
+        if current_year == end["year"] and current_month > end["month"]:
+            break
+
+        yield {"year": current_year, "month": current_month}
+
+        current_month += 1
+        if current_month > 12:
+            current_month = 1
+            current_year += 1
@@ -0,0 +1,463 @@
+"""
+Whatson sinks
+
+Where an ingest run writes the shows it finds, chosen with
+`whatson-ingest --sink`:
+
+* `postgres`, the default, stages the shows in the database pointed to by
+  `$DATABASE_URL` and applies the changes to the shows table the webapp
+  serves
+* `sqlite:PATH` keeps a shows table, with the same change tracking, in a
+  local SQLite file, so scrapes can be run and compared without a database
+  server
+* `jsonl:PATH` streams each show found as a line of JSON to `PATH`, or to
+  standard output for `-`, e.g. to diff two scrapes
+
+For each run a sink's `start_run` is called, then `write_batch` from the
+pipeline's writer thread as shows are found, `apply_changes` for each venue
+once every venue has finished, and `finish_run`.
+"""
+
+import collections
+import datetime
+import itertools
+import json
+import logging
+import sqlite3
+import sys
+import threading
+
+from .db import DB, ensure_schema, execute_values, pooled_connection, reset_database
+
+LOG = logging.getLogger("whatson.sinks")
+
+
+class Sink:
+    """Base class of the sinks. Sinks which do not track the shows they have
+    seen return None from `apply_changes`."""
+
+    # Whether the shows are stored in the database the webapp serves, so they
+    # can be archived, grouped and have their images cached
+    database = False
+
+    def __init__(self):
+        self._run_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def prepare(self, reset=False):
+        """Create the sink's storage if needed, emptying it if `reset`"""
+
+    def start_run(self):
+        """Record the start of an ingest run, returning the run id"""
+        with self._lock:
+            return next(self._run_ids)
+
+    def write_batch(self, run_id, batch):
+        """Write a list of `(theatre, Show)` tuples found in a run"""
+        raise NotImplementedError
+
+    def known_shows(self, theatre, since):
+        """The `(title, start_date)` of the shows stored for a theatre, for an
+        incremental crawl, or None if the theatre needs a full crawl as it has
+        not had a complete, successful one since the datetime `since`"""
+        return None
+
+    def apply_changes(self, run_id, theatre, remove=True):
+        """Apply the shows written for a theatre, returning the number of
+        shows added, changed and removed. Shows are only removed if `remove`
+        is set, as an incomplete scrape would remove every show missed."""
+        return None
+
+    def finish_run(self, run_id, results, changes):
+        """Record the `VenueResult` and changes of each venue in the run"""
+
+    def close(self):
+        """Release the sink's resources"""
+
+
+# Applies the differences between the shows staged for one theatre and the
+# shows table, and records them in `show_changes`. Shows are added or updated
+# if their details differ, and shows that have not finished yet are removed
+# if they are no longer listed. Unchanged shows are not written at all, and
+# shows which have already ended are left to the archive.
+APPLY_CHANGES = """
+    WITH staged AS (
+        SELECT DISTINCT ON (title) title, image_url, link_url, start_date, end_date
+        FROM show_staging
+        WHERE run_id = %(run_id)s AND theatre = %(theatre)s
+            AND end_date >= CURRENT_DATE
+        ORDER BY title
+    ),
+    stored AS (
+        SELECT title, image_url, link_url, start_date, end_date
+        FROM shows
+        WHERE theatre = %(theatre)s
+    ),
+    differing AS (
+        SELECT * FROM staged
+        EXCEPT
+        SELECT * FROM stored
+    ),
+    missing AS (
+        SELECT title FROM stored WHERE end_date >= CURRENT_DATE AND %(remove)s
+        EXCEPT
+        SELECT title FROM staged
+    ),
+    removed AS (
+        DELETE FROM shows
+        WHERE theatre = %(theatre)s AND title IN (SELECT title FROM missing)
+        RETURNING title, start_date, end_date
+    ),
+    upserted AS (
+        INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
+        SELECT %(theatre)s, title, image_url, link_url, start_date, end_date
+        FROM differing
+        ON CONFLICT (theatre, title) DO UPDATE SET
+            image_hash = CASE WHEN shows.image_url = EXCLUDED.image_url
+                THEN shows.image_hash END,
+            image_url = EXCLUDED.image_url,
+            link_url = EXCLUDED.link_url,
+            start_date = EXCLUDED.start_date,
+            end_date = EXCLUDED.end_date
+        RETURNING title, start_date, end_date, xmax = 0 AS inserted
+    )
+    INSERT INTO show_changes (run_id, theatre, title, change, start_date, end_date)
+        SELECT %(run_id)s, %(theatre)s, title,
+            CASE WHEN inserted THEN 'added' ELSE 'changed' END, start_date, end_date
+        FROM upserted
+        UNION ALL
+        SELECT %(run_id)s, %(theatre)s, title, 'removed', start_date, end_date
+        FROM removed
+    RETURNING change
+"""
+
+
+class PostgresSink(Sink):
+    """Stages the shows in Postgres in batches, applying them to the shows
+    table at the end of each run"""
+
+    database = True
+
+    def prepare(self, reset=False):
+        if reset:
+            reset_database(DB)
+        else:
+            ensure_schema(DB)
+
+    def start_run(self):
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO ingest_runs DEFAULT VALUES RETURNING id")
+            return cursor.fetchone()["id"]
+
+    def write_batch(self, run_id, batch):
+        LOG.debug("staging %d shows", len(batch))
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            execute_values(
+                cursor,
+                """INSERT INTO show_staging (run_id, theatre, title, image_url,
+                        link_url, start_date, end_date)
+                    VALUES %s""",
+                [(run_id, theatre, *show) for theatre, show in batch],
+                page_size=len(batch),
+            )
+
+    def known_shows(self, theatre, since):
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT 1 FROM ingest_run_venues
+                    JOIN ingest_runs ON ingest_runs.id = ingest_run_venues.run_id
+                    WHERE theatre = %s AND succeeded AND complete
+                    AND started_at >= %s
+                    LIMIT 1""",
+                (theatre, since),
+            )
+            if cursor.fetchone() is None:
+                return None
+
+            cursor.execute(
+                "SELECT title, start_date FROM shows WHERE theatre = %s", (theatre,)
+            )
+            return {(row["title"], row["start_date"]) for row in cursor.fetchall()}
+
+    def apply_changes(self, run_id, theatre, remove=True):
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) AS count FROM show_staging "
+                "WHERE run_id = %s AND theatre = %s",
+                (run_id, theatre),
+            )
+            if remove and cursor.fetchone()["count"] == 0:
+                LOG.warning("%s: no shows found, not removing any", theatre)
+                remove = False
+
+            cursor.execute(
+                APPLY_CHANGES, {"run_id": run_id, "theatre": theatre, "remove": remove}
+            )
+            changes = collections.Counter(row["change"] for row in cursor.fetchall())
+
+        return changes["added"], changes["changed"], changes["removed"]
+
+    def finish_run(self, run_id, results, changes):
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE ingest_runs SET finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (run_id,),
+            )
+            cursor.execute("DELETE FROM show_staging WHERE run_id = %s", (run_id,))
+
+            for result in results:
+                added, changed, removed = changes.get(result.theatre) or (0, 0, 0)
+                cursor.execute(
+                    """INSERT INTO ingest_run_venues (run_id, theatre, succeeded,
+                            shows, pages_fetched, duration_seconds, errors, added,
+                            changed, removed, complete)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                    (
+                        run_id,
+                        result.theatre,
+                        result.succeeded,
+                        result.shows,
+                        result.pages_fetched,
+                        result.duration,
+                        result.errors,
+                        added,
+                        changed,
+                        removed,
+                        result.complete,
+                    ),
+                )
+
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS shows (
+        id INTEGER PRIMARY KEY,
+        theatre TEXT NOT NULL,
+        title TEXT NOT NULL,
+        image_url TEXT NOT NULL,
+        link_url TEXT NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        UNIQUE (theatre, title)
+    );
+    CREATE TABLE IF NOT EXISTS show_staging (
+        run_id INTEGER NOT NULL,
+        theatre TEXT NOT NULL,
+        title TEXT NOT NULL,
+        image_url TEXT NOT NULL,
+        link_url TEXT NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS _idx_show_staging_run_theatre
+        ON show_staging (run_id, theatre);
+    CREATE TABLE IF NOT EXISTS ingest_runs (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        finished_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS ingest_run_venues (
+        run_id INTEGER NOT NULL REFERENCES ingest_runs (id),
+        theatre TEXT NOT NULL,
+        succeeded INTEGER NOT NULL,
+        shows INTEGER NOT NULL,
+        pages_fetched INTEGER NOT NULL,
+        duration_seconds REAL NOT NULL,
+        errors TEXT NOT NULL,
+        added INTEGER NOT NULL,
+        changed INTEGER NOT NULL,
+        removed INTEGER NOT NULL,
+        complete INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (run_id, theatre)
+    );
+"""
+
+
+class SqliteSink(Sink):
+    """Keeps the shows in a local SQLite file, tracking changes between runs
+    like the Postgres sink. Dates are stored as ISO 8601 text."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        # Batches are written from the pipeline's writer thread, so the
+        # connection is shared between threads behind the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    def prepare(self, reset=False):
+        with self._lock, self.conn:
+            if reset:
+                # Keep the run history, as the Postgres sink does
+                self.conn.execute("DROP TABLE IF EXISTS shows")
+                self.conn.execute("DROP TABLE IF EXISTS show_staging")
+            self.conn.executescript(SQLITE_SCHEMA)
+
+    def start_run(self):
+        with self._lock, self.conn:
+            return self.conn.execute("INSERT INTO ingest_runs DEFAULT VALUES").lastrowid
+
+    def write_batch(self, run_id, batch):
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO show_staging VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        theatre,
+                        show.title,
+                        show.image_url,
+                        show.link_url,
+                        show.start_date.isoformat(),
+                        show.end_date.isoformat(),
+                    )
+                    for theatre, show in batch
+                ],
+            )
+
+    def known_shows(self, theatre, since):
+        # CURRENT_TIMESTAMP is stored as UTC text, which sorts by time
+        since = since.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            crawled = self.conn.execute(
+                """SELECT 1 FROM ingest_run_venues
+                    JOIN ingest_runs ON ingest_runs.id = ingest_run_venues.run_id
+                    WHERE theatre = ? AND succeeded AND complete
+                    AND started_at >= ?""",
+                (theatre, since),
+            ).fetchone()
+            if crawled is None:
+                return None
+
+            rows = self.conn.execute(
+                "SELECT title, start_date FROM shows WHERE theatre = ?", (theatre,)
+            ).fetchall()
+        return {(title, datetime.date.fromisoformat(start)) for title, start in rows}
+
+    def apply_changes(self, run_id, theatre, remove=True):
+        today = datetime.date.today().isoformat()
+        columns = "title, image_url, link_url, start_date, end_date"
+
+        with self._lock, self.conn:
+            staged_rows = self.conn.execute(
+                f"SELECT {columns} FROM show_staging WHERE run_id = ? AND theatre = ?",
+                (run_id, theatre),
+            ).fetchall()
+            if remove and not staged_rows:
+                LOG.warning("%s: no shows found, not removing any", theatre)
+                remove = False
+
+            # As in Postgres, shows which have already ended are left alone
+            staged = {row[0]: row for row in staged_rows if row[4] >= today}
+            stored = {
+                row[0]: row
+                for row in self.conn.execute(
+                    f"SELECT {columns} FROM shows WHERE theatre = ?", (theatre,)
+                )
+            }
+
+            added = [row for title, row in staged.items() if title not in stored]
+            changed = [
+                row
+                for title, row in staged.items()
+                if title in stored and stored[title] != row
+            ]
+            removed = []
+            if remove:
+                removed = [
+                    (theatre, title)
+                    for title, row in stored.items()
+                    if row[4] >= today and title not in staged
+                ]
+
+            self.conn.executemany(
+                f"""INSERT INTO shows (theatre, {columns}) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (theatre, title) DO UPDATE SET
+                        image_url = excluded.image_url,
+                        link_url = excluded.link_url,
+                        start_date = excluded.start_date,
+                        end_date = excluded.end_date""",
+                [(theatre, *row) for row in added + changed],
+            )
+            self.conn.executemany(
+                "DELETE FROM shows WHERE theatre = ? AND title = ?", removed
+            )
+
+        return len(added), len(changed), len(removed)
+
+    def finish_run(self, run_id, results, changes):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE ingest_runs SET finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (run_id,),
+            )
+            self.conn.execute("DELETE FROM show_staging WHERE run_id = ?", (run_id,))
+            self.conn.executemany(
+                "INSERT INTO ingest_run_venues "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        result.theatre,
+                        result.succeeded,
+                        result.shows,
+                        result.pages_fetched,
+                        result.duration,
+                        json.dumps(result.errors),
+                        *(changes.get(result.theatre) or (0, 0, 0)),
+                        result.complete,
+                    )
+                    for result in results
+                ],
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+class JsonlSink(Sink):
+    """Streams each show found as a line of JSON, with its theatre and run,
+    flushing after every batch"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.outfile = sys.stdout if path == "-" else open(path, "a")
+
+    def prepare(self, reset=False):
+        if reset and self.outfile is not sys.stdout:
+            self.outfile.truncate(0)
+
+    def write_batch(self, run_id, batch):
+        lines = [
+            json.dumps({"run_id": run_id, "theatre": theatre, **show.to_json()}) + "\n"
+            for theatre, show in batch
+        ]
+        with self._lock:
+            self.outfile.writelines(lines)
+            self.outfile.flush()
+
+    def close(self):
+        if self.outfile is not sys.stdout:
+            self.outfile.close()
+
+
+SINKS = {"postgres": PostgresSink, "sqlite": SqliteSink, "jsonl": JsonlSink}
+
+
+def create_sink(spec):
+    """Create the sink described by `spec`, such as `postgres` or
+    `sqlite:PATH`. Raises `ValueError` for an unknown or incomplete spec."""
+    kind, _, path = spec.partition(":")
+    if kind not in SINKS:
+        raise ValueError(f"unknown sink {kind!r}, expected one of: {', '.join(SINKS)}")
+    if kind == "postgres":
+        if path:
+            raise ValueError("the postgres sink uses $DATABASE_URL and takes no path")
+        return PostgresSink()
+    if not path:
+        raise ValueError(f"the {kind} sink needs a path, e.g. {kind}:shows.{kind}")
+    return SINKS[kind](path)
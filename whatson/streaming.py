@@ -0,0 +1,60 @@
+"""
+Whatson streaming
+
+Parses listing pages as they download, rather than holding the whole page
+and a full tree of it in memory. Chunks of the response are fed to lxml's
+incremental HTML parser, the wanted elements are handed over as they close,
+and everything which has been parsed is thrown away as it goes, so memory
+use is bounded by the size of a single item rather than the page.
+"""
+
+
+def chunks(html):
+    """The chunks of a page which may already have been downloaded, as a
+    string or bytes, or which may be an iterable of chunks still downloading"""
+    if isinstance(html, (str, bytes)):
+        return [html]
+    return html
+
+
+def iter_elements(html, tag, match=None):
+    """Parse the page `html` (see `chunks`) incrementally, yielding each `tag`
+    element for which `match(element)` is true once it has closed. Elements
+    are cleared as soon as they have been yielded or are no longer needed, so
+    they must be used before the next is requested."""
+    from lxml import etree  # pylint: disable=import-outside-toplevel
+
+    parser = etree.HTMLPullParser(events=("start", "end"))
+    # Elements of interest which have started but not yet closed, whose
+    # children must be kept
+    open_items = 0
+
+    def drain():
+        nonlocal open_items
+        for event, element in parser.read_events():
+            if element.tag != tag and open_items:
+                continue
+
+            if element.tag == tag:
+                if event == "start":
+                    open_items += 1
+                    continue
+                open_items -= 1
+                if match is None or match(element):
+                    yield element
+            elif event == "start":
+                continue
+
+            # Drop the element's content, and the (already empty) elements
+            # before it, leaving just the chain of open ancestors
+            element.clear(keep_tail=False)
+            parent = element.getparent()
+            if parent is not None and not open_items:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+    for chunk in chunks(html):
+        parser.feed(chunk)
+        yield from drain()
+    parser.close()
+    yield from drain()
@@ -1,34 +1,90 @@
-from flask import jsonify, Flask, render_template, request
+from flask import abort, jsonify, Flask, redirect, render_template, request, send_file
 import json
 from typing import NamedTuple
+import psycopg2.extensions
+from .catalogue import Catalogue
 from .db import DB
+from .images import CACHE_CONTROL, ImageCache
+from .shows import (
+    SHOW_COLUMNS,
+    interpolate_months,
+    serialise_show,
+    shows_request,
+)
 import datetime
 from functools import wraps
 
 
-def create_app(db=None):
+def _shows_in_month(table):
+    return f"""SELECT {", ".join(SHOW_COLUMNS)} FROM {table}
+        WHERE total_months(start_date) <= total_months($1::date)
+        AND total_months(end_date) >= total_months($1::date)
+        ORDER BY start_date ASC
+        """
+
+
+# The API queries which are not answered from the catalogue, prepared once per
+# connection so they are not parsed and planned again on every request
+PREPARED_STATEMENTS = {
+    "whatson_archive_in_month": _shows_in_month("shows_archive"),
+    "whatson_image_url": """SELECT image_url FROM shows WHERE image_hash = $1
+        UNION ALL
+        SELECT image_url FROM shows_archive WHERE image_hash = $1
+        LIMIT 1
+        """,
+}
+
+
+def create_app(db=None, images=None, catalogue=None):
     if db is None:
         db = DB
+    if images is None:
+        images = ImageCache()
+    if catalogue is None:
+        catalogue = Catalogue(db)
 
     app = Flask("whatson")
 
+    # The rendered index page, keyed by the show index and day it was rendered
+    # from, so it is only rendered again when either changes
+    rendered_index = {}
+
+    def initial_data(index, today):
+        """The months and the shows of the current (or else first) month, which
+        are embedded in the index page so the frontend does not have to fetch
+        them before it can render"""
+        dates = index.months(today)
+        selected = {"year": today.year, "month": today.month}
+        if selected not in dates:
+            selected = dates[0] if dates else None
+        shows = index.in_month(selected["year"], selected["month"]) if selected else []
+        return {"dates": dates, "selected": selected, "shows": shows}
+
     @app.route("/")
     def index():
-        return render_template("index.html")
+        try:
+            show_index = catalogue.current()
+        except Exception:  # pylint: disable=broad-except
+            app.logger.exception("cannot load the shows for the index page")
+            # The frontend fetches the data itself if it is not embedded
+            return render_template("index.html")
+
+        today = datetime.date.today()
+        key = (show_index, today)
+        page = rendered_index.get("page")
+        if page is None or page[0] != key:
+            html = render_template(
+                "index.html", initial=initial_data(show_index, today)
+            )
+            page = rendered_index["page"] = (key, html)
+        return page[1]
 
     class ShowPresenter(object):
         def __init__(self, show):
             self.show = show
 
         def serialise(self):
-            return {
-                "name": self.show["title"],
-                "theatre": self.show["theatre"],
-                "image_url": self.show["image_url"],
-                "link_url": self.show["link_url"],
-                "start_date": self.show["start_date"].isoformat(),
-                "end_date": self.show["end_date"].isoformat(),
-            }
+            return serialise_show(self.show)
 
     class ShowEncoder(json.JSONEncoder):
         def default(self, o):
@@ -56,21 +112,46 @@ def create_app(db=None):
         kwargs.pop("status", None)
         return jsonify(status="ok", **kwargs)
 
+    prepared = set()
+
+    def tuple_cursor(conn):
+        """Prepare the API statements on `conn` if needed, and return a cursor
+        returning plain tuples rather than dicts"""
+        cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+        # Prepared statements belong to the server session, so are lost if the
+        # connection is re-established
+        key = (id(conn), conn.get_backend_pid())
+        if key not in prepared:
+            cursor.execute("SELECT name FROM pg_prepared_statements")
+            existing = {name for name, in cursor.fetchall()}
+            for name, statement in PREPARED_STATEMENTS.items():
+                if name not in existing:
+                    cursor.execute(f"PREPARE {name} AS {statement}")
+            prepared.add(key)
+        return cursor
+
     @app.route("/api/shows", methods=["POST"])
     @json_errors
     def get_by_month():
+        """Shows running in a month or date range, optionally at one theatre"""
+        start_date, end_date, theatre = shows_request(request.json)
+        index = catalogue.current()
+        if theatre is not None:
+            index = index.theatre(theatre)
+        return jsonify_ok(shows=index.between(start_date, end_date))
+
+    @app.route("/api/archive", methods=["POST"])
+    @json_errors
+    def get_archived_by_month():
+        """Shows which have ended and been moved out of the shows table"""
         month = int(request.json["month"])
         year = int(request.json["year"])
 
         with db as conn:
-            with conn.cursor() as cursor:
+            with tuple_cursor(conn) as cursor:
                 cursor.execute(
-                    """SELECT * FROM shows
-                        WHERE total_months(start_date) <= total_months(%(date_ref)s)
-                        AND total_months(end_date) >= total_months(%(date_ref)s)
-                        ORDER BY start_date ASC
-                        """,
-                    {"date_ref": datetime.date(year, month, 1)},
+                    "EXECUTE whatson_archive_in_month (%s)",
+                    (datetime.date(year, month, 1),),
                 )
                 rows = cursor.fetchall()
 
@@ -79,64 +160,42 @@ def create_app(db=None):
     @app.route("/api/months", methods=["GET"])
     @json_errors
     def get_months():
-        with db as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """(SELECT
-                            EXTRACT(MONTH FROM start_date)::int AS month,
-                            EXTRACT(YEAR FROM start_date)::int AS year
-                        FROM shows
-                        WHERE end_date > CURRENT_DATE
-                        )
-                        UNION
-                        (
-                        SELECT
-                            EXTRACT(MONTH FROM end_date)::int AS month,
-                            EXTRACT(YEAR FROM end_date)::int AS year
-                        FROM shows
-                        WHERE end_date > CURRENT_DATE
-                        )
-                    ORDER BY year, month
-                    """
-                )
-                rows = cursor.fetchall()
-
-        print(rows)
-
-        if not rows:
-            # We do not have anything in the database
-            return jsonify_ok(dates=[])
-
-        dates = interpolate_months(rows)
-
-        return jsonify_ok(dates=list(dates))
+        return jsonify_ok(dates=catalogue.current().months(datetime.date.today()))
 
+    @app.route("/api/productions", methods=["GET"])
+    @json_errors
+    def get_productions():
+        """Current shows grouped by production, for those at several theatres"""
+        productions = catalogue.current().current_productions(datetime.date.today())
+        return jsonify_ok(productions=productions)
+
+    @app.route("/img/<image_hash>", methods=["GET"])
+    def get_image(image_hash):
+        """Serve a show image from the thumbnail cache"""
+        found = images.lookup(image_hash, request.headers.get("Accept", ""))
+        if found is None:
+            # The image has not been fetched yet or has been evicted, so send
+            # the browser to the original, which only has to be looked up in
+            # the database for archived shows
+            image_url = catalogue.current().image_url(image_hash)
+            if image_url is None:
+                with db as conn:
+                    with tuple_cursor(conn) as cursor:
+                        cursor.execute("EXECUTE whatson_image_url (%s)", (image_hash,))
+                        row = cursor.fetchone()
+                if row is None:
+                    abort(404)
+                image_url = row[0]
+            return redirect(image_url)
+
+        path, media_type = found
+        response = send_file(path, mimetype=media_type, conditional=True)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        response.vary.add("Accept")
+        return response
+
+    app.catalogue = catalogue
     return app
 
 
-def interpolate_months(seen_months):
-    """Helper function to interpolate months that do not have a start or end
-    date, but are in the middle of a show run.
-    """
-    # Make sure to interpolate the in-between months
-    current = seen_months[0]
-    current_year, current_month = current["year"], current["month"]
-
-    end = seen_months[-1]
-
-    while True:
-        if current_year > end["year"]:
-            break
-
-        if current_year == end["year"] and current_month > end["month"]:
-            break
-
-        yield {"year": current_year, "month": current_month}
-
-        current_month += 1
-        if current_month > 12:
-            current_month = 1
-            current_year += 1
-
-
 app = create_app()